@@ -2,15 +2,56 @@
 
 import os
 import sys
+import time
 import pandas as pd
 import argparse
 import configparser
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from kevs.TA1Library import TA1Library, TA1Collection
 from kevs.TA2Instantiation import TA2Instantiation, TA2Collection
+from kevs.extraction_files import get_extraction_file_format
 
 
-def extract_sdf(config_filepath: str, config_mode: str, score_tasks: str):
+def discover_teams(submission_dir: str) -> list:
+    """
+    Returns the team names of a submission directory, one subdirectory per team
+    """
+    if not os.path.isdir(submission_dir):
+        print("Warning: Submission Directory {} Not Found".format(submission_dir))
+        return []
+    return sorted(team_name for team_name in os.listdir(submission_dir)
+                  if os.path.isdir(os.path.join(submission_dir, team_name)) and
+                  not team_name.startswith('.'))
+
+
+def extract_job(task_name: str, team_name: str, submission_dir: str, score_dir: str,
+                file_format: str, full_extraction: bool):
+    """
+    Extracts and writes the SDF submission of one team for one task. Runs in a worker process.
+    TA2 submissions are extracted incrementally: only SDF files that are new or changed since
+    the previous run are extracted, unless full_extraction is set
+
+    Returns:
+        the TA1Library or TA2Instantiation, the wall time of the job in seconds and a
+        description of the extracted files
+    """
+    start_time = time.time()
+    if task_name == "ta1":
+        extraction = TA1Library(team_name)
+        extraction.extract_contents_from_sdf(submission_dir)
+        extraction.write_extractions_to_files(score_dir)
+        return extraction, time.time() - start_time, "all files"
+    extraction = TA2Instantiation(team_name, is_task2=(task_name != "ta2task1"))
+    update_counts = extraction.update_extractions(submission_dir, score_dir, file_format,
+                                                  full_extraction=full_extraction)
+    return extraction, time.time() - start_time, \
+        "{extracted} extracted, {unchanged} unchanged, {removed} removed files".format(
+            **update_counts)
+
+
+def extract_sdf(config_filepath: str, config_mode: str, score_tasks: str, workers=None,
+                full_extraction=False):
     # get path of directories
     try:
         config = configparser.ConfigParser()
@@ -25,6 +66,7 @@ def extract_sdf(config_filepath: str, config_mode: str, score_tasks: str):
     eval_phase_subdir = config[config_mode]["eval_phase_subdir"]
     input_dir_prefix = os.path.join(root_dir, input_subdir, eval_phase_subdir)
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     # Subfolders of root_directory/input_subdir/eval_phase_subdir
     ta1_submission_dir = os.path.join(input_dir_prefix,
@@ -45,121 +87,70 @@ def extract_sdf(config_filepath: str, config_mode: str, score_tasks: str):
                                config[config_mode]["graph_g_subdir"])
     graph_g_extraction_dir = os.path.join(output_dir_prefix,
                                           config[config_mode]["graph_g_extraction_subdir"])
-    # TA1
-    ta1_collection = TA1Collection()
+    # Each (team, task) extraction is an independent job
+    job_list = []
     # only run in 'ta1' since we don't need to compute TA1 stats in Phase2b
     if score_tasks == "ta1":
-        print("Extracting TA1 Libraries from SDF")
-        try:
-            cmu_ta1_library = TA1Library("CMU")
-            cmu_ta1_library.extract_contents_from_sdf(ta1_submission_dir)
-            cmu_ta1_library.write_extractions_to_files(ta1_score_dir)
-            ta1_collection.ta1dict['{}'.format("CMU")] = cmu_ta1_library
-        except FileNotFoundError as e:
-            print("Warning: TA1 CMU Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            ibm_ta1_library = TA1Library("IBM")
-            ibm_ta1_library.extract_contents_from_sdf(ta1_submission_dir)
-            ibm_ta1_library.write_extractions_to_files(ta1_score_dir)
-            ta1_collection.ta1dict['{}'.format("IBM")] = ibm_ta1_library
-        except FileNotFoundError as e:
-            print("Warning: TA1 IBM Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            isi_ta1_library = TA1Library("ISI")
-            isi_ta1_library.extract_contents_from_sdf(ta1_submission_dir)
-            isi_ta1_library.write_extractions_to_files(ta1_score_dir)
-            ta1_collection.ta1dict['{}'.format("ISI")] = isi_ta1_library
-        except FileNotFoundError as e:
-            print("Warning: TA1 ISI Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            resin_ta1_library = TA1Library("RESIN")
-            resin_ta1_library.extract_contents_from_sdf(ta1_submission_dir)
-            resin_ta1_library.write_extractions_to_files(ta1_score_dir)
-            ta1_collection.ta1dict['{}'.format("RESIN")] = resin_ta1_library
-        except FileNotFoundError as e:
-            print("Warning: TA1 RESIN Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            sbu_ta1_library = TA1Library("SBU")
-            sbu_ta1_library.extract_contents_from_sdf(ta1_submission_dir)
-            sbu_ta1_library.write_extractions_to_files(ta1_score_dir)
-            ta1_collection.ta1dict['{}'.format("SBU")] = sbu_ta1_library
-        except FileNotFoundError as e:
-            print("Warning: TA1 SBU Submission Not Found. Exception Message:")
-            print(e)
-
-    # TA2 Task 1
-    ta2_task1_collection = TA2Collection(is_task2=False)
+        for ta1_team_name in discover_teams(ta1_submission_dir):
+            job_list.append(("ta1", ta1_team_name, ta1_submission_dir, ta1_score_dir))
     if score_tasks == "ta2task1" or score_tasks == "all":
-        print("Extracting TA2 Task 1 Instantiations from SDF")
-        ta2_output_directory = ta2_task1_submission_dir
-        ta2_score_directory = ta2_task1_score_dir
-        try:
-            cmu_ta2_task1_instantiation = TA2Instantiation("CMU", is_task2=False)
-            cmu_ta2_task1_instantiation.extract_contents_from_sdf(ta2_output_directory)
-            cmu_ta2_task1_instantiation.write_extractions_to_files(ta2_score_directory)
-            ta2_task1_collection.ta2dict['{}'.format("CMU")] = cmu_ta2_task1_instantiation
-        except FileNotFoundError as e:
-            print("Warning: TA2 Task1 CMU Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            ibm_ta2_task1_instantiation = TA2Instantiation("IBM", is_task2=False)
-            ibm_ta2_task1_instantiation.extract_contents_from_sdf(ta2_output_directory)
-            ibm_ta2_task1_instantiation.write_extractions_to_files(ta2_score_directory)
-            ta2_task1_collection.ta2dict['{}'.format("IBM")] = ibm_ta2_task1_instantiation
-        except FileNotFoundError as e:
-            print("Warning: TA2 Task1 IBM Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            resin_ta2_task1_instantiation = TA2Instantiation("RESIN", is_task2=False)
-            resin_ta2_task1_instantiation.extract_contents_from_sdf(ta2_output_directory)
-            resin_ta2_task1_instantiation.write_extractions_to_files(ta2_score_directory)
-            ta2_task1_collection.ta2dict['{}'.format("RESIN")] = resin_ta2_task1_instantiation
-        except FileNotFoundError as e:
-            print("Warning: TA2 Task1 RESIN Submission Not Found. Exception Message:")
-            print(e)
-    # TA2 Task 2
-    ta2_task2_collection = TA2Collection(is_task2=True)
-
+        for ta2_team_name in discover_teams(ta2_task1_submission_dir):
+            job_list.append(("ta2task1", ta2_team_name, ta2_task1_submission_dir,
+                             ta2_task1_score_dir))
     if score_tasks == "all" or score_tasks == "ta2task2":
-        print("Extracting TA2 Task 2 Instantiations from SDF")
-        ta2_output_directory = ta2_task2_submission_dir
-        ta2_score_directory = ta2_task2_score_dir
-        try:
-            cmu_ta2_task2_instantiation = TA2Instantiation("CMU", is_task2=True)
-            cmu_ta2_task2_instantiation.extract_contents_from_sdf(ta2_output_directory)
-            cmu_ta2_task2_instantiation.write_extractions_to_files(ta2_score_directory)
-            ta2_task2_collection.ta2dict['{}'.format("CMU")] = cmu_ta2_task2_instantiation
-        except FileNotFoundError as e:
-            print("Warning: TA2 Task2 CMU Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            ibm_ta2_task2_instantiation = TA2Instantiation("IBM", is_task2=True)
-            ibm_ta2_task2_instantiation.extract_contents_from_sdf(ta2_output_directory)
-            ibm_ta2_task2_instantiation.write_extractions_to_files(ta2_score_directory)
-            ta2_task2_collection.ta2dict['{}'.format("IBM")] = ibm_ta2_task2_instantiation
-        except FileNotFoundError as e:
-            print("Warning: TA2 Task2 IBM Submission Not Found. Exception Message:")
-            print(e)
-        try:
-            resin_ta2_task2_instantiation = TA2Instantiation("RESIN", is_task2=True)
-            resin_ta2_task2_instantiation.extract_contents_from_sdf(ta2_output_directory)
-            resin_ta2_task2_instantiation.write_extractions_to_files(ta2_score_directory)
-            ta2_task2_collection.ta2dict['{}'.format("RESIN")] = resin_ta2_task2_instantiation
-        except FileNotFoundError as e:
-            print("Warning: TA2 Task2 RESIN Submission Not Found. Exception Message:")
-            print(e)
+        for ta2_team_name in discover_teams(ta2_task2_submission_dir):
+            job_list.append(("ta2task2", ta2_team_name, ta2_task2_submission_dir,
+                             ta2_task2_score_dir))
+    if score_tasks == "all" or score_tasks == "graphg":
+        job_list.append(("graphg", "GRAPHG", graph_g_dir, graph_g_extraction_dir))
 
+    ta1_collection = TA1Collection()
+    ta2_task1_collection = TA2Collection(is_task2=False)
+    ta2_task2_collection = TA2Collection(is_task2=True)
     graph_g_collection = TA2Collection(is_task2=True)
-    if score_tasks == "all" or score_tasks == "graphg":
-        print("Extracting Graph G from Graph G SDF")
-        graph_g_instantiation = TA2Instantiation("GRAPHG", is_task2=True)
-        graph_g_instantiation.extract_contents_from_sdf(graph_g_dir)
-        graph_g_instantiation.write_extractions_to_files(graph_g_extraction_dir)
-        graph_g_collection.ta2dict['{}'.format("GRAPHG")] = graph_g_instantiation
+    collection_dict = {"ta1": ta1_collection.ta1dict, "ta2task1": ta2_task1_collection.ta2dict,
+                       "ta2task2": ta2_task2_collection.ta2dict,
+                       "graphg": graph_g_collection.ta2dict}
+
+    if not job_list:
+        print("No Submissions to Extract")
+    else:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(job_list)))
+        print("Extracting {} SDF Submissions with {} workers".format(len(job_list), workers))
+        job_results = dict()
+        missing_job_list = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            future_dict = {executor.submit(extract_job, *job, extraction_file_format,
+                                           full_extraction): job
+                           for job in job_list}
+            for future in as_completed(future_dict):
+                task_name, team_name = future_dict[future][0:2]
+                try:
+                    extraction, wall_time, file_summary = future.result()
+                    job_results[future_dict[future]] = extraction
+                    print("Extracted {} {} in {:.1f} s ({})".format(task_name, team_name,
+                                                                    wall_time, file_summary))
+                except FileNotFoundError as e:
+                    print("Warning: {} {} Submission was not extracted. Exception Message:".format(
+                        task_name, team_name))
+                    print(repr(e))
+                    missing_job_list.append(future_dict[future])
+                except Exception as e:
+                    # Other jobs still finish, but the run fails below
+                    print("Error: {} {} Submission could not be extracted. Exception Message:".
+                          format(task_name, team_name))
+                    print(repr(e))
+        # Collections are filled in job order so they do not depend on completion order
+        for job in job_list:
+            if job in job_results:
+                collection_dict[job[0]]['{}'.format(job[1])] = job_results[job]
+        failed_job_list = [job for job in job_list
+                           if job not in job_results and job not in missing_job_list]
+        if failed_job_list:
+            sys.exit("Failed extractions: {}".format(
+                ", ".join("{} {}".format(job[0], job[1]) for job in failed_job_list)))
 
     print("Done")
     return ta1_collection, ta2_task1_collection, ta2_task2_collection, graph_g_collection
@@ -186,6 +177,14 @@ def define_parser():
     parser.add_argument("-s", "--score_tasks",
                         help="Which tasks to score: 'all', 'ta1', 'ta2task1' or 'ta2task2'",
                         type=str, default="all")
+    parser.add_argument("-w", "--workers",
+                        help="Number of (team, task) extractions to run in parallel " +
+                             "(default: number of CPUs)",
+                        type=int, default=None)
+    parser.add_argument("--full_extraction",
+                        help="Extract every TA2 SDF file, even if it did not change since the " +
+                             "previous extraction",
+                        required=False, action='store_true', default=False)
     parser.add_argument('-v', '--verbose', help='Enable Verbose output',
                         required=False, action='store_true', default=False)
 
@@ -205,7 +204,8 @@ def code_main(args):
     # We can extract the objects if we wish to chain the stats with the extraction
     ta1_collection, ta2_task1_collection, \
         ta2_task2_collection, graph_g_collection = extract_sdf(config_filepath, config_mode,
-                                                               score_tasks)
+                                                               score_tasks, args.workers,
+                                                               args.full_extraction)
 
 
 def main():
@@ -7,6 +7,7 @@ import pandas as pd
 import argparse
 
 from kevs.generate_stats import compute_ta1_submission_stats, compute_ta2_submission_stats
+from kevs.extraction_files import get_extraction_file_format
 
 
 def compute_submission_stats(config_filepath: str, config_mode: str, score_tasks: str) -> None:
@@ -21,6 +22,7 @@ def compute_submission_stats(config_filepath: str, config_mode: str, score_tasks
     output_subdir = config[config_mode]["output_subdir"]
     eval_phase_subdir = config[config_mode]["eval_phase_subdir"]
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     # Subfolders of root_directory/input_subdir/eval_phase_subdir
 
@@ -69,7 +71,8 @@ def compute_submission_stats(config_filepath: str, config_mode: str, score_tasks
             sys.exit('Directory not found: ' + ta2_task1_score_dir)
         print("Computing TA2 Task 1 Stats")
         ta2_stats_df, ta2_group_stats_df, ta2_qnode_df, ta2_ent_ev_df, ta2_ins_ent_ev_df = \
-            compute_ta2_submission_stats(ta2_task1_score_dir, ta2_task1_analysis_dir)
+            compute_ta2_submission_stats(ta2_task1_score_dir, ta2_task1_analysis_dir,
+                                         file_format=extraction_file_format)
 
     # # if TA2 Task2 analysis directories do not exist, create them
     if not os.path.isdir(ta2_task2_analysis_dir):
@@ -83,7 +86,8 @@ def compute_submission_stats(config_filepath: str, config_mode: str, score_tasks
             sys.exit('Directory not found: ' + ta2_task2_score_dir)
         print("Computing TA2 Task 2 Stats")
         ta2_stats_df, ta2_group_stats_df, ta2_qnode_df, ta2_ent_ev_df, ta2_ins_ent_ev_df = \
-            compute_ta2_submission_stats(ta2_task2_score_dir, ta2_task2_analysis_dir)
+            compute_ta2_submission_stats(ta2_task2_score_dir, ta2_task2_analysis_dir,
+                                         file_format=extraction_file_format)
 
     # # if TA2 GraphG analysis directories do not exist, create them
     if not os.path.isdir(graph_g_analysis_dir):
@@ -96,7 +100,8 @@ def compute_submission_stats(config_filepath: str, config_mode: str, score_tasks
         print("Computing Graph_G Stats")
         ta2_stats_df, ta2_group_stats_df, ta2_qnode_df, ta2_ent_ev_df, ta2_ins_ent_ev_df = \
             compute_ta2_submission_stats(graph_g_extraction_dir, graph_g_analysis_dir,
-                                         extract_for_graph_g=True)
+                                         extract_for_graph_g=True,
+                                         file_format=extraction_file_format)
 
     print("Done")
 
@@ -8,6 +8,7 @@ import argparse
 
 # from kevs.TA1Library import TA1Collection
 from kevs.TA2Instantiation import TA2Collection
+from kevs.extraction_files import get_extraction_file_format
 from kevs.Annotation import Annotation
 from kevs.match_ke import match_ke_elements
 
@@ -26,6 +27,7 @@ def score_ke_matches(config_filepath: str, config_mode: str, score_tasks: str) -
     eval_phase_subdir = config[config_mode]["eval_phase_subdir"]
     input_dir_prefix = os.path.join(root_dir, input_subdir, eval_phase_subdir)
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     # Subfolders of root_directory/input_subdir/eval_phase_subdir
     task1_annotation_dir = os.path.join(input_dir_prefix,
@@ -54,6 +56,14 @@ def score_ke_matches(config_filepath: str, config_mode: str, score_tasks: str) -
                                         config[config_mode]["graph_g_analysis_subdir"])
     qnode_dir = os.path.join(output_dir_prefix,
                              config[config_mode]["qnode_subdir"])
+    # Older configurations have no match result cache
+    ke_match_cache_dir = None
+    if config[config_mode].get("ke_match_cache_subdir"):
+        ke_match_cache_dir = os.path.join(output_dir_prefix,
+                                          config[config_mode]["ke_match_cache_subdir"])
+    # Optional list of confidence thresholds of the precision and recall curves
+    ke_confidence_threshold_list = [float(threshold) for threshold in config[config_mode].get(
+        "ke_confidence_thresholds", "").split(",") if threshold.strip()]
 
     task1_complex_event_list = os.listdir(task1_annotation_dir)
     task1_complex_event_list.remove('.DS_Store')
@@ -86,22 +96,24 @@ def score_ke_matches(config_filepath: str, config_mode: str, score_tasks: str) -
     if score_tasks == "all" or score_tasks == "ta2task1":
         if not os.path.isdir(ta2_task1_score_dir):
             sys.exit('Directory not found: ' + ta2_task1_score_dir)
-        ta2_task1_collection.import_extractions_from_file_collection(ta2_task1_score_dir)
+        ta2_task1_collection.import_extractions_from_file_collection(
+            ta2_task1_score_dir, file_format=extraction_file_format)
 
     print("Importing TA2 Task 2 Submissions")
     ta2_task2_collection = TA2Collection(is_task2=True)
     if score_tasks == "all" or score_tasks == "ta2task2":
         if not os.path.isdir(ta2_task2_score_dir):
             sys.exit('Directory not found: ' + ta2_task2_score_dir)
-        ta2_task2_collection.import_extractions_from_file_collection(ta2_task2_score_dir)
+        ta2_task2_collection.import_extractions_from_file_collection(
+            ta2_task2_score_dir, file_format=extraction_file_format)
 
     # Graph G must be imported for multiple tasks
     print("Importing Graph G")
     graph_g_collection = TA2Collection(is_task2=True)
     if score_tasks == "all" or score_tasks == "graphg" or \
             score_tasks == "ta2task1" or score_tasks == "ta2task2":
-        graph_g_collection.import_extractions_from_file_collection(graph_g_extraction_dir,
-                                                                   extract_for_graph_g=True)
+        graph_g_collection.import_extractions_from_file_collection(
+            graph_g_extraction_dir, extract_for_graph_g=True, file_format=extraction_file_format)
 
     if score_tasks == "all" or score_tasks == "ta2task2":
         print("Automatically Scoring TA2 Task 2 Output")
@@ -109,7 +121,9 @@ def score_ke_matches(config_filepath: str, config_mode: str, score_tasks: str) -
             match_ke_elements(ta2_t2_as_path, task1_annotation_collection, ta2_task2_collection,
                               graph_g_collection, qnode_dir,
                               qnode_sim_fp, is_task2=True, use_graph_g=False,
-                              min_confidence_threshold=0)
+                              min_confidence_threshold=0,
+                              ke_match_cache_dir=ke_match_cache_dir,
+                              confidence_threshold_list=ke_confidence_threshold_list)
         else:
             print("No TA2 Task 2 Submissions to Score")
 
@@ -119,7 +133,9 @@ def score_ke_matches(config_filepath: str, config_mode: str, score_tasks: str) -
             match_ke_elements(ta2_t1_as_path, task1_annotation_collection, ta2_task1_collection,
                               graph_g_collection, qnode_dir,
                               qnode_sim_fp, is_task2=False, use_graph_g=False,
-                              min_confidence_threshold=0)
+                              min_confidence_threshold=0,
+                              ke_match_cache_dir=ke_match_cache_dir,
+                              confidence_threshold_list=ke_confidence_threshold_list)
             pass
         else:
             print("No TA2 Task 1 Submissions to Score")
@@ -130,7 +146,9 @@ def score_ke_matches(config_filepath: str, config_mode: str, score_tasks: str) -
             match_ke_elements(ta2_g_as_path, task1_annotation_collection, graph_g_collection,
                               graph_g_collection, qnode_dir,
                               qnode_sim_fp, is_task2=True, use_graph_g=True,
-                              min_confidence_threshold=0)
+                              min_confidence_threshold=0,
+                              ke_match_cache_dir=ke_match_cache_dir,
+                              confidence_threshold_list=ke_confidence_threshold_list)
             pass
         else:
             print("No Graph G Submissions to Score")
@@ -7,6 +7,7 @@ import pandas as pd
 import argparse
 
 from kevs.TA2Instantiation import TA2Collection
+from kevs.extraction_files import get_extraction_file_format
 from kevs.Annotation import Annotation
 from kevs.analyze_assessments import assess_task1_submissions, \
     produce_aggregated_scores
@@ -28,6 +29,7 @@ def score_task1_assessment(config_filepath: str, config_mode: str, score_tasks:
     eval_phase_subdir = config[config_mode]["eval_phase_subdir"]
     input_dir_prefix = os.path.join(root_dir, input_subdir, eval_phase_subdir)
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     # Subfolders of root_directory/input_subdir/eval_phase_subdir
     task1_annotation_dir = os.path.join(input_dir_prefix,
@@ -68,7 +70,8 @@ def score_task1_assessment(config_filepath: str, config_mode: str, score_tasks:
     print("Importing TA2 Task 1 Submissions")
     ta2_task1_collection = TA2Collection(is_task2=False)
     if score_tasks == "all" or score_tasks == "ta2task1":
-        ta2_task1_collection.import_extractions_from_file_collection(ta2_task1_score_dir)
+        ta2_task1_collection.import_extractions_from_file_collection(
+            ta2_task1_score_dir, file_format=extraction_file_format)
 
     print("Importing Task 1 Assessment")
     assessment_collection = Assessment()
@@ -5,6 +5,7 @@ import pandas as pd
 import argparse
 
 from kevs.TA1Library import TA1Collection
+from kevs.extraction_files import get_extraction_file_format
 from kevs.compute_ta1_coverage import compute_ta1_coverage, compute_task1_ins_schema
 
 
@@ -22,6 +23,7 @@ def generate_t1_coverage_stats(config_filepath: str, config_mode: str, score_tas
     eval_phase_subdir = config[config_mode]["eval_phase_subdir"]
     input_dir_prefix = os.path.join(root_dir, input_subdir, eval_phase_subdir)
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     # subfolders of root_directory/output_subdir/eval_phase_subdir
     ta1_score_dir = os.path.join(output_dir_prefix,
@@ -39,7 +41,8 @@ def generate_t1_coverage_stats(config_filepath: str, config_mode: str, score_tas
     if score_tasks == "all" or score_tasks == "ta1":
         compute_ta1_coverage(ta1_score_dir, ta1_collection, ta1_analysis_dir)
         compute_task1_ins_schema(ta2_task1_score_dir, task1_annotation_dir,
-                                 ta1_collection, ta1_analysis_dir)
+                                 ta1_collection, ta1_analysis_dir,
+                                 file_format=extraction_file_format)
     print("Done")
 
 
@@ -6,6 +6,7 @@ import argparse
 
 
 from kevs.TA2Instantiation import TA2Collection
+from kevs.extraction_files import get_extraction_file_format
 from kevs.Annotation import Annotation
 from kevs.compute_graph_g_stats import compute_graph_g_stats, score_graph_g_stats
 
@@ -24,6 +25,7 @@ def generate_graph_g_stats(config_filepath: str, config_mode: str, score_tasks:
     eval_phase_subdir = config[config_mode]["eval_phase_subdir"]
     input_dir_prefix = os.path.join(root_dir, input_subdir, eval_phase_subdir)
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     task2_annotation_dir = os.path.join(input_dir_prefix,
                                         config[config_mode]["task2_annotation_subdir"])
@@ -47,13 +49,14 @@ def generate_graph_g_stats(config_filepath: str, config_mode: str, score_tasks:
     # TA2 Task 2
     ta2_task2_collection = TA2Collection(is_task2=True)
     print("Importing TA2 Task 2 Collection")
-    ta2_task2_collection.import_extractions_from_file_collection(ta2_task2_score_dir)
+    ta2_task2_collection.import_extractions_from_file_collection(
+        ta2_task2_score_dir, file_format=extraction_file_format)
 
     # Graph G
     graph_g_collection = TA2Collection(is_task2=True)
     print("Importing Graph G Collection")
-    graph_g_collection.import_extractions_from_file_collection(graph_g_extraction_dir,
-                                                               extract_for_graph_g=True)
+    graph_g_collection.import_extractions_from_file_collection(
+        graph_g_extraction_dir, extract_for_graph_g=True, file_format=extraction_file_format)
 
     # Annotation
     print("Importing Annotations")
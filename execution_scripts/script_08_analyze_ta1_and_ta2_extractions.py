@@ -8,6 +8,7 @@ import argparse
 
 # from kevs.TA1Library import TA1Collection
 from kevs.TA2Instantiation import TA2Collection
+from kevs.extraction_files import get_extraction_file_format
 from kevs.Annotation import Annotation
 from kevs.Assessment import Assessment
 from kevs.compare_graph_g_versions import get_graph_g_comparison
@@ -34,6 +35,7 @@ def generate_analysis(config_filepath: str, config_mode: str, score_tasks: str)
     include_all_events = (config[config_mode]['include_all_events'].lower() == "true")
     input_dir_prefix = os.path.join(root_dir, input_subdir, eval_phase_subdir)
     output_dir_prefix = os.path.join(root_dir, output_subdir, eval_phase_subdir)
+    extraction_file_format = get_extraction_file_format(config[config_mode])
 
     # Subfolders of root_directory/input_subdir/eval_phase_subdir
     task1_annotation_dir = os.path.join(input_dir_prefix,
@@ -86,7 +88,8 @@ def generate_analysis(config_filepath: str, config_mode: str, score_tasks: str)
     # TA2 Task 1
     ta2_task1_collection = TA2Collection(is_task2=False)
     print("Importing TA2 Task 1 Collection")
-    ta2_task1_collection.import_extractions_from_file_collection(ta2_task1_score_dir)
+    ta2_task1_collection.import_extractions_from_file_collection(
+        ta2_task1_score_dir, file_format=extraction_file_format)
     if score_tasks == "all" or score_tasks == "ta2task1":
         # print("Validating TA1 References")
         # validate_ta1_references_by_ta2(ta2_task1_analysis_dir, ta1_collection,
@@ -97,7 +100,8 @@ def generate_analysis(config_filepath: str, config_mode: str, score_tasks: str)
     # TA2 Task 2
     ta2_task2_collection = TA2Collection(is_task2=True)
     print("Importing TA2 Task 2 Collection")
-    ta2_task2_collection.import_extractions_from_file_collection(ta2_task2_score_dir)
+    ta2_task2_collection.import_extractions_from_file_collection(
+        ta2_task2_score_dir, file_format=extraction_file_format)
     if score_tasks == "all" or score_tasks == "ta2task2":
         # print("Validating TA1 References")
         # validate_ta1_references_by_ta2(ta2_task2_analysis_dir, ta1_collection,
@@ -108,8 +112,8 @@ def generate_analysis(config_filepath: str, config_mode: str, score_tasks: str)
     # Graph G
     graph_g_collection = TA2Collection(is_task2=True)
     print("Importing Graph G Collection")
-    graph_g_collection.import_extractions_from_file_collection(graph_g_extraction_dir,
-                                                               extract_for_graph_g=True)
+    graph_g_collection.import_extractions_from_file_collection(
+        graph_g_extraction_dir, extract_for_graph_g=True, file_format=extraction_file_format)
     if score_tasks == "all" or score_tasks == "graphg":
         print("Producing Graph G Event Trees")
         graph_g_collection.produce_event_trees(graph_g_extraction_dir, include_all_events=True)
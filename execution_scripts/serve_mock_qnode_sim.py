@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+import pandas as pd
+
+from kevs.qnode_sim_server import MockQnodeSimServer
+
+
+def define_parser():
+    """
+    Defines accepted CLI syntax and the actions to take for command and args.
+
+    Returns:
+        argparse parser
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve qnode similarity scores from a fixture table in place of the " +
+                    "similarity API, for offline testing and benchmarking"
+    )
+    parser.add_argument("-i", "--fixture_file",
+                        help='Tsv file of similarity scores, such as nist_isi_qnode_sim_cache.tsv',
+                        required=True, type=str)
+    parser.add_argument("--host", help='Host name to listen on', required=False, type=str,
+                        default="127.0.0.1")
+    parser.add_argument("-p", "--port", help='Port to listen on', required=False, type=int,
+                        default=8000)
+    parser.add_argument("-d", "--delay", help='Seconds the server takes to answer a request',
+                        required=False, type=float, default=0)
+
+    # This tells the code to automatically execute this function
+    parser.set_defaults(func=code_main)
+
+    return parser
+
+
+def code_main(args):
+    qnode_sim_df = pd.read_csv(args.fixture_file, sep='\t')
+    with MockQnodeSimServer(qnode_sim_df, host=args.host, port=args.port,
+                            delay_seconds=args.delay) as server:
+        print("Serving {} qnode pairs at {}".format(server.qnode_sim_df.shape[0], server.url))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Served {} requests".format(server.num_requests))
+
+
+def main():
+    parser = define_parser()
+    args = parser.parse_args()
+    if hasattr(args, "func") and args.func is not None:
+        args.func(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
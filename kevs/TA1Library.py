@@ -1,9 +1,14 @@
 import pandas as pd
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 
 import kevs.extract_elements_from_json
 import kevs.produce_event_trees
 from kevs import load_json_data as load
+from kevs.extraction_files import LazyElementTables, extraction_file_exists, \
+    read_element_table, read_extraction_file
 
 
 # Initiate TA1 Data Frames
@@ -62,10 +67,29 @@ def init_ta1_rel_dataframe() -> pd.DataFrame:
     return rel_df
 
 
-class TA1Library:
+def extract_ta1_sdf_file(ta1_team_name: str, directory_path: str, file_name: str):
+    """
+    Extracts a single TA1 SDF file into its own TA1Library. This is a module level function so
+    that TA1Library.extract_contents_from_sdf can run it in worker processes.
+    Args:
+        ta1_team_name:
+        directory_path: directory of the SDF files of the library
+        file_name:
+
+    Returns:
+        TA1Library with the extractions of the file
+    """
+    ta1_library = TA1Library(ta1_team_name)
+    ta1_library.extract_contents_from_sdf_file(
+        {file_name: load.load_json_file(directory_path, file_name)}, file_name)
+    return ta1_library
+
+
+class TA1Library(LazyElementTables):
     """
     As there is one TA1 file per TA1 Library, we have a single class for a TA1 Library
     """
+    child_id_column = 'child_id'
 
     def __init__(self, ta1_team_name):
         """
@@ -99,17 +123,17 @@ class TA1Library:
             extract_ta1_elements_from_json_file(self.ta1_team_name, self.base_file_name, self,
                                                 json_dict, file_name)
 
-    def extract_contents_from_sdf(self, sdf_collection_dir):
+    def extract_contents_from_sdf(self, sdf_collection_dir, workers=1):
         """
 
         Args:
-            json_collection_dir:
+            sdf_collection_dir:
+            workers: number of worker processes. With more than one worker, the SDF files are
+                extracted in parallel, one file per task, and merged in file order
 
         Returns:
 
         """
-        json_dict = load.load_json_directory(self.ta1_team_name, sdf_collection_dir)
-
         # Re-empty library
         self.ev_df = init_ta1_ev_dataframe()
         self.arg_df = init_ta1_arg_dataframe()
@@ -119,13 +143,45 @@ class TA1Library:
         self.children_df = init_ta1_children_dataframe()
         self.schema_df = init_ta1_schema_dataframe()
 
+        file_list = load.list_json_directory(self.ta1_team_name, sdf_collection_dir)
+        if workers > 1 and len(file_list) > 1:
+            directory_path = os.path.join(sdf_collection_dir, self.ta1_team_name)
+            # executor.map returns the results in the order of file_list
+            with ProcessPoolExecutor(max_workers=min(workers, len(file_list))) as executor:
+                for file_library in executor.map(extract_ta1_sdf_file,
+                                                 repeat(self.ta1_team_name),
+                                                 repeat(directory_path), file_list):
+                    self.append_library(file_library)
+            return
         # Because there is the assumption that there is only one file in the dictionary, this
-        # method has been shortened
-        for file_name in json_dict:
-            self.extract_contents_from_sdf_file(json_dict, file_name)
+        # method has been shortened. Files are read one at a time
+        for file_name, json_data in load.iter_json_directory(self.ta1_team_name,
+                                                             sdf_collection_dir):
+            self.extract_contents_from_sdf_file({file_name: json_data}, file_name)
+
+    def append_library(self, ta1_library) -> None:
+        """
+        Appends the extractions of another TA1Library of the same team, such as one extracted
+        from a single file in a worker process
+
+        Args:
+            ta1_library:
+        """
+        self.ev_df = pd.concat([self.ev_df, ta1_library.ev_df], ignore_index=True)
+        self.arg_df = pd.concat([self.arg_df, ta1_library.arg_df], ignore_index=True)
+        self.ent_df = pd.concat([self.ent_df, ta1_library.ent_df], ignore_index=True)
+        self.rel_df = pd.concat([self.rel_df, ta1_library.rel_df], ignore_index=True)
+        self.temporalrel_df = pd.concat([self.temporalrel_df, ta1_library.temporalrel_df],
+                                        ignore_index=True)
+        self.children_df = pd.concat([self.children_df, ta1_library.children_df],
+                                     ignore_index=True)
+        self.schema_df = pd.concat([self.schema_df, ta1_library.schema_df], ignore_index=True)
+        self.schema_id = ta1_library.schema_id
 
     def import_extractions_from_files(self, ta1_extraction_dir: str):
         """
+        Registers the extraction files of the library. Each element data frame is read when
+        it is first used
 
         Args:
             ta1_extraction_dir:
@@ -134,36 +190,28 @@ class TA1Library:
         Returns:
 
         """
-        self.schema_df = pd.read_csv(os.path.join(ta1_extraction_dir,
-                                     os.path.basename(self.base_file_name) + '_schema.csv'))
-        self.ev_df = pd.read_csv(os.path.join(ta1_extraction_dir,
-                                 os.path.basename(self.base_file_name) + '_ev.csv'))
-        self.arg_df = pd.read_csv(os.path.join(ta1_extraction_dir,
-                                  os.path.basename(self.base_file_name) + '_arg.csv'))
-        try:
-            self.children_df = pd.read_csv(os.path.join(ta1_extraction_dir,
-                                           os.path.basename(self.base_file_name) + '_children.csv'))
-        except FileNotFoundError:
-            pass
-        try:
-            self.ent_df = pd.read_csv(os.path.join(ta1_extraction_dir,
-                                      os.path.basename(self.base_file_name) + '_ent.csv'))
-        except FileNotFoundError:
-            pass
-        try:
-            self.rel_df = pd.read_csv(os.path.join(
-                ta1_extraction_dir, os.path.basename(self.base_file_name) + '_rel.csv'))
-        except FileNotFoundError:
-            pass
-        try:
-            self.temporalrel_df = pd.read_csv(os.path.join(
-                ta1_extraction_dir, os.path.basename(self.base_file_name) + '_temporalrel.csv'))
-        except FileNotFoundError:
-            pass
+        file_name_base = os.path.basename(self.base_file_name)
+        for attribute_name, file_suffix, init_function in [
+                ('schema_df', '_schema', init_ta1_schema_dataframe),
+                ('ev_df', '_ev', init_ta1_ev_dataframe),
+                ('arg_df', '_arg', init_ta1_arg_dataframe),
+                ('children_df', '_children', init_ta1_children_dataframe),
+                ('ent_df', '_ent', init_ta1_ent_dataframe),
+                ('rel_df', '_rel', init_ta1_rel_dataframe),
+                ('temporalrel_df', '_temporalrel', init_ta1_rel_dataframe)]:
+            file_path_base = os.path.join(ta1_extraction_dir, file_name_base + file_suffix)
+            # schema, event and argument files are required
+            if attribute_name in ['schema_df', 'ev_df', 'arg_df'] and \
+                    not extraction_file_exists(file_path_base):
+                raise FileNotFoundError("No such file: '{}'".format(file_path_base + '.csv'))
+            self.set_table_loader(attribute_name, partial(read_element_table, file_path_base,
+                                                          'csv', init_function))
         # Need to get a unique library ID
         self.library_id = ""
         # Get the schema id from the first value of the extracted event
-        self.schema_id = self.ev_df.iloc[0, :]['schema_id']
+        self.schema_id = read_extraction_file(os.path.join(ta1_extraction_dir,
+                                                           file_name_base + '_ev'),
+                                              columns=['schema_id']).iloc[0, :]['schema_id']
 
     def write_extractions_to_files(self, score_directory: str) -> None:
         """
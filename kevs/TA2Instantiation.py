@@ -1,10 +1,19 @@
+import numpy as np
 import pandas as pd
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 
 import kevs.extract_elements_from_json
 import kevs.produce_event_trees
 
 from kevs import load_json_data as load
+from kevs.extraction_files import DEFAULT_EXTRACTION_FILE_FORMAT, LazyElementTables, \
+    extraction_file_exists, get_extraction_file_extension, read_element_table, \
+    read_extraction_file, get_partition_slices, get_partition_view, \
+    write_partitioned_extraction_file, get_sdf_file_entry, read_extraction_manifest, \
+    write_extraction_manifest
 
 """
 change/add field names (wd_node, wd_label, wd_description, temporal, child)
@@ -87,7 +96,19 @@ def init_ta2_rel_dataframe() -> pd.DataFrame:
     return rel_df
 
 
-class TA2CEInstance:
+# Data frame attribute, file name and initialization of each element table of a TA2 team.
+# Each table is stored once per team in the Extracted_Tables directory, partitioned by
+# schema_instance_id
+TA2_ELEMENT_TABLES = [('schema_df', 'extracted_schema', init_ta2_schema_dataframe),
+                      ('ev_df', 'extracted_events', init_ta2_ev_dataframe),
+                      ('arg_df', 'extracted_arg', init_ta2_arg_dataframe),
+                      ('children_df', 'extracted_children', init_ta2_children_dataframe),
+                      ('ent_df', 'extracted_ent', init_ta2_ent_dataframe),
+                      ('rel_df', 'extracted_rel', init_ta2_rel_dataframe),
+                      ('temporalrel_df', 'extracted_temporalrel', init_ta2_rel_dataframe)]
+
+
+class TA2CEInstance(LazyElementTables):
     """
     Object that stores one Instantation of a TA1-TA2 System pair on a single "instance"
     within a SDF File of a Complex Event
@@ -150,123 +171,6 @@ class TA2CEInstance:
                                                     json_dict, file_name, self.instance_id,
                                                     self.instance_name)
 
-    def import_extractions_from_files(self, ta2_extraction_dir: str):
-        """
-
-        Args:
-            ta2_extraction_dir:
-
-        Returns:
-
-        """
-        self.schema_df = pd.read_csv(os.path.join(ta2_extraction_dir, 'Extracted_Schemas',
-                                                  os.path.basename(self.ce_instance_file_name_base)
-                                                  + '_schema.csv'))
-        self.ev_df = pd.read_csv(os.path.join(ta2_extraction_dir, 'Extracted_Events',
-                                              os.path.basename(self.ce_instance_file_name_base)
-                                              + '_ev.csv'))
-        self.arg_df = pd.read_csv(os.path.join(ta2_extraction_dir, 'Extracted_Arguments',
-                                               os.path.basename(self.ce_instance_file_name_base)
-                                               + '_arg.csv'))
-        try:
-            self.children_df = pd.read_csv(os.path.join(ta2_extraction_dir, 'Extracted_Children',
-                                                        os.path.basename(
-                                                            self.ce_instance_file_name_base)
-                                                        + '_children.csv'))
-        except FileNotFoundError:
-            pass
-        try:
-            self.ent_df = pd.read_csv(os.path.join(ta2_extraction_dir, 'Extracted_Entities',
-                                                   os.path.basename(self.ce_instance_file_name_base)
-                                                   + '_ent.csv'))
-        except FileNotFoundError:
-            pass
-        try:
-            self.rel_df = pd.read_csv(os.path.join(ta2_extraction_dir, 'Extracted_Relations',
-                                                   os.path.basename(self.ce_instance_file_name_base)
-                                                   + '_rel.csv'))
-        except FileNotFoundError:
-            pass
-        try:
-            self.temporalrel_df = pd.read_csv(os.path.join(ta2_extraction_dir,
-                                                           'Extracted_TemporalRelations',
-                                                           os.path.basename(
-                                                               self.ce_instance_file_name_base)
-                                                           + '_temporalrel.csv'))
-        except FileNotFoundError:
-            pass
-        # Need to get the TA1 ID
-        self.ta1_team_name = self.schema_df.iloc[0, :]['ta1_team_name']
-
-    def write_extractions_to_files(self, score_directory: str) -> None:
-        """
-        Writes the extracted objects to Files
-        Returns:
-
-        """
-        # create schema, event, argument, children directories if not exist
-        if not os.path.isdir(score_directory):
-            os.makedirs(score_directory)
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name)):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_Schemas")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name, "Extracted_Schemas"))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_Events")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name, "Extracted_Events"))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_Arguments")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name, "Extracted_Arguments"))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_Children")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name, "Extracted_Children"))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_Entities")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name, "Extracted_Entities"))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_Relations")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name, "Extracted_Relations"))
-        if not os.path.isdir(os.path.join(score_directory, self.ta2_team_name,
-                                          "Extracted_TemporalRelations")):
-            os.makedirs(os.path.join(score_directory, self.ta2_team_name,
-                                     "Extracted_TemporalRelations"))
-        if len(self.schema_df) > 0:
-            self.schema_df.to_csv(os.path.join(score_directory, self.ta2_team_name,
-                                               'Extracted_Schemas',
-                                               os.path.basename(self.ce_instance_file_name_base)
-                                               + '_schema.csv'), index=False)
-        if len(self.ev_df) > 0:
-            self.ev_df.to_csv(os.path.join(score_directory, self.ta2_team_name, 'Extracted_Events',
-                                           os.path.basename(self.ce_instance_file_name_base)
-                                           + '_ev.csv'), index=False)
-        if len(self.arg_df) > 0:
-            self.arg_df.to_csv(os.path.join(score_directory, self.ta2_team_name,
-                                            'Extracted_Arguments',
-                                            os.path.basename(self.ce_instance_file_name_base)
-                                            + '_arg.csv'), index=False)
-        if len(self.children_df) > 0:
-            self.children_df.to_csv(os.path.join(score_directory, self.ta2_team_name,
-                                                 'Extracted_Children',
-                                                 os.path.basename(self.ce_instance_file_name_base)
-                                                 + '_children.csv'), index=False)
-        if len(self.ent_df) > 0:
-            self.ent_df.to_csv(os.path.join(score_directory, self.ta2_team_name,
-                                            'Extracted_Entities',
-                                            os.path.basename(self.ce_instance_file_name_base)
-                                            + '_ent.csv'), index=False)
-        if len(self.rel_df) > 0:
-            self.rel_df.to_csv(os.path.join(score_directory, self.ta2_team_name,
-                                            'Extracted_Relations',
-                                            os.path.basename(self.ce_instance_file_name_base)
-                                            + '_rel.csv'), index=False)
-        if len(self.temporalrel_df) > 0:
-            self.temporalrel_df.to_csv(os.path.join(score_directory, self.ta2_team_name,
-                                                    'Extracted_TemporalRelations',
-                                                    os.path.basename(
-                                                        self.ce_instance_file_name_base)
-                                                    + '_temporalrel.csv'), index=False)
-
     def produce_event_tree(self, output_dir, include_all_events):
         tree_output_dir = os.path.join(output_dir, self.ta2_team_name, "Event_Trees")
         if not os.path.isdir(tree_output_dir):
@@ -275,7 +179,44 @@ class TA2CEInstance:
                                                                        include_all_events)
 
 
-class TA2Instantiation:
+def extract_ta2_sdf_file(ta2_team_name: str, is_task2: bool, directory_path: str,
+                         file_name: str) -> list:
+    """
+    Extracts every instance of a single TA2 SDF file. This is a module level function so that
+    TA2Instantiation.extract_contents_from_sdf can run it in worker processes.
+    Args:
+        ta2_team_name:
+        is_task2:
+        directory_path: directory of the SDF files of the team
+        file_name:
+
+    Returns:
+        list of TA2CEInstance objects in the order of the instances in the file
+    """
+    # Parse the information from the filename
+    # All TA2 File Submissions follow <ta1>-<ta2>-<task>-<ce>
+    file_split = file_name.split('.')[0].split('-')
+    ta1_team_name = file_split[0].upper()
+    ce_name = file_split[3].lower()
+    instance_list = []
+    # The SDF file is streamed one instance at a time, so only the top-level fields of the
+    # file and the current instance are held in memory
+    for schema, instance_schema in load.iter_sdf_instances(directory_path, file_name):
+        instance_name = instance_schema['name']
+        instance_id = instance_schema['@id']
+        schema_id = None
+        if '@id' in schema.keys():
+            schema_id = schema['@id']
+        # initiate schema, event, argument, and children dataframes
+        ta2_ceinstance = TA2CEInstance(ta1_team_name, ta2_team_name, is_task2, ce_name,
+                                       instance_id, instance_name, schema_id, file_name)
+        ta2_ceinstance.extract_contents_from_sdf(ta2_team_name, instance_schema,
+                                                 {file_name: schema}, file_name)
+        instance_list.append(ta2_ceinstance)
+    return instance_list
+
+
+class TA2Instantiation(LazyElementTables):
     """
     Container for all Instances of a single TA2 system
     (not a single TA1-TA2 pair). Contains a dictionary of TA2Instantiations with key
@@ -299,18 +240,20 @@ class TA2Instantiation:
         self.temporalrel_df = init_ta2_rel_dataframe()
         self.children_df = init_ta2_children_dataframe()
         self.schema_df = init_ta2_schema_dataframe()
+        # Row ranges of each instance in the imported team tables, see get_instance_table
+        self.partition_slices = dict()
 
-    def extract_contents_from_sdf(self, sdf_collection_dir):
+    def extract_contents_from_sdf(self, sdf_collection_dir, workers=1):
         """
 
         Args:
             sdf_collection_dir:
+            workers: number of worker processes. With more than one worker, the SDF files are
+                extracted in parallel, one file per task, and merged in file order
 
         Returns:
 
         """
-        json_dict = load.load_json_directory(self.ta2_team_name, sdf_collection_dir)
-
         # Reinitiate dictionary and data frames to be empty
         self.ta2dict = dict()
         self.ev_df = init_ta2_ev_dataframe()
@@ -321,163 +264,267 @@ class TA2Instantiation:
         self.children_df = init_ta2_children_dataframe()
         self.schema_df = init_ta2_schema_dataframe()
 
-        for file_name in json_dict:
-            # initiate schema, event, argument, and children dataframes
-            # Parse the information from the filename
-            # All TA2 File Submissions follow <ta1>-<ta2>-<task>-<ce>
-            file_split = file_name.split('.')[0].split('-')
-            ta1_team_name = file_split[0].upper()
-            ce_name = file_split[3].lower()
-            schema = json_dict[file_name]
-            for instance_schema in schema['instances']:
-                instance_name = instance_schema['name']
-                instance_id = instance_schema['@id']
-                schema_id = None
-                if '@id' in schema.keys():
-                    schema_id = schema['@id']
-                # initiate schema, event, argument, and children dataframes
-                ta2_ceinstance = TA2CEInstance(ta1_team_name, self.ta2_team_name,
-                                               self.is_task2, ce_name, instance_id, instance_name,
-                                               schema_id, file_name)
-                ta2_ceinstance.extract_contents_from_sdf(self.ta2_team_name,
-                                                         instance_schema, json_dict,
-                                                         file_name)
-
-                # save schema, event, argument, children, entity, and relation
-                # dataframes to csv files
-                self.ta2dict['{}|{}|{}|{}'.format(ta2_ceinstance.ta1_team_name, self.ta2_team_name,
-                                                  ta2_ceinstance.ce_name,
-                                                  instance_id)] = ta2_ceinstance
-                # Now append the data frames to form the group data frames for the ta2_instantiation
-                self.ev_df = pd.concat([self.ev_df, ta2_ceinstance.ev_df], ignore_index=True)
-                self.arg_df = pd.concat([self.arg_df, ta2_ceinstance.arg_df], ignore_index=True)
-                self.ent_df = pd.concat([self.ent_df, ta2_ceinstance.ent_df], ignore_index=True)
-                self.rel_df = pd.concat([self.rel_df, ta2_ceinstance.rel_df], ignore_index=True)
-                self.temporalrel_df = pd.concat([self.temporalrel_df,
-                                                 ta2_ceinstance.temporalrel_df], ignore_index=True)
-                self.children_df = pd.concat([self.children_df, ta2_ceinstance.children_df],
-                                             ignore_index=True)
-                self.schema_df = pd.concat([self.schema_df, ta2_ceinstance.schema_df],
+        file_list = load.list_json_directory(self.ta2_team_name, sdf_collection_dir)
+        instance_list = self.extract_sdf_files(sdf_collection_dir, file_list, workers)
+        for ta2_ceinstance in instance_list:
+            self.ta2dict['{}|{}|{}|{}'.format(ta2_ceinstance.ta1_team_name, self.ta2_team_name,
+                                              ta2_ceinstance.ce_name,
+                                              ta2_ceinstance.instance_id)] = ta2_ceinstance
+        self.combine_instance_dataframes(instance_list)
+
+    def extract_sdf_files(self, sdf_collection_dir, file_list: list, workers=1) -> list:
+        """
+        Extracts the instances of the given SDF files of the team
+
+        Args:
+            sdf_collection_dir:
+            file_list: SDF file names in the team directory of sdf_collection_dir
+            workers: number of worker processes, one file per task
+
+        Returns:
+            list of TA2CEInstance objects in file order
+        """
+        directory_path = os.path.join(sdf_collection_dir, self.ta2_team_name)
+        instance_list = []
+        if workers > 1 and len(file_list) > 1:
+            # executor.map returns the results in the order of file_list, so the merge is
+            # deterministic regardless of which worker finishes first
+            with ProcessPoolExecutor(max_workers=min(workers, len(file_list))) as executor:
+                for file_instance_list in executor.map(extract_ta2_sdf_file,
+                                                       repeat(self.ta2_team_name),
+                                                       repeat(self.is_task2),
+                                                       repeat(directory_path), file_list):
+                    instance_list.extend(file_instance_list)
+        else:
+            for file_name in file_list:
+                instance_list.extend(extract_ta2_sdf_file(self.ta2_team_name, self.is_task2,
+                                                          directory_path, file_name))
+        return instance_list
+
+    def update_extractions(self, sdf_collection_dir, score_dir,
+                           file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT, workers=1,
+                           full_extraction=False) -> dict:
+        """
+        Incremental version of extract_contents_from_sdf followed by write_extractions_to_files.
+        The manifest in the team extraction directory records the content hash, size and
+        extractor version of every extracted SDF file. Only new and changed files are
+        extracted, the rows of unchanged files are kept from the existing team tables and the
+        rows of deleted files are dropped. The object is then imported from the written tables
+
+        Args:
+            sdf_collection_dir:
+            score_dir:
+            file_format: format of the extraction files, one of EXTRACTION_FILE_FORMATS
+            workers: number of worker processes for the extracted files
+            full_extraction: extract every file regardless of the manifest
+
+        Returns:
+            dictionary with the number of 'unchanged', 'extracted' and 'removed' SDF files
+        """
+        team_directory = os.path.join(score_dir, self.ta2_team_name)
+        table_directory = os.path.join(team_directory, 'Extracted_Tables')
+        file_list = load.list_json_directory(self.ta2_team_name, sdf_collection_dir)
+        file_entry_dict = {file_name: get_sdf_file_entry(
+            os.path.join(sdf_collection_dir, self.ta2_team_name, file_name),
+            kevs.extract_elements_from_json.EXTRACTOR_VERSION, file_format)
+            for file_name in file_list}
+        manifest_dict = read_extraction_manifest(team_directory)
+        # Without the required tables of a previous extraction, every file is extracted
+        if full_extraction or not all(
+                extraction_file_exists(os.path.join(table_directory, table_name), file_format)
+                for table_name in ['extracted_schema', 'extracted_events', 'extracted_arg']):
+            manifest_dict = dict()
+        unchanged_file_set = {file_name for file_name in file_list
+                              if manifest_dict.get(file_name) == file_entry_dict[file_name]}
+        extract_file_list = [file_name for file_name in file_list
+                             if file_name not in unchanged_file_set]
+        update_counts = {'unchanged': len(unchanged_file_set),
+                         'extracted': len(extract_file_list),
+                         'removed': len(set(manifest_dict) - set(file_list))}
+
+        if extract_file_list or update_counts['removed'] > 0 or not file_list:
+            # Rows of the unchanged files in the existing team tables
+            kept_df_dict = dict()
+            if unchanged_file_set:
+                self.import_extractions_from_files(team_directory, file_format)
+                kept_schema_instance_id_set = set(self.schema_df.loc[
+                    self.schema_df['file_name'].isin(unchanged_file_set), 'schema_instance_id'])
+                for attribute_name, _, _ in TA2_ELEMENT_TABLES:
+                    element_df = getattr(self, attribute_name)
+                    kept_df_dict[attribute_name] = element_df[
+                        element_df['schema_instance_id'].isin(kept_schema_instance_id_set)]
+            # Rows of the new and changed files
+            self.ta2dict = dict()
+            for attribute_name, _, init_function in TA2_ELEMENT_TABLES:
+                setattr(self, attribute_name, init_function())
+            self.combine_instance_dataframes(self.extract_sdf_files(sdf_collection_dir,
+                                                                    extract_file_list, workers))
+            # Team tables in file order, as a full extraction would produce them
+            file_rank_dict = {file_name: rank for rank, file_name in enumerate(file_list)}
+            if kept_df_dict:
+                self.schema_df = pd.concat([kept_df_dict['schema_df'], self.schema_df],
+                                           ignore_index=True)
+            schema_file_rank = self.schema_df['file_name'].map(file_rank_dict)
+            schema_instance_rank_dict = dict(zip(self.schema_df['schema_instance_id'],
+                                                 schema_file_rank))
+            if not os.path.isdir(table_directory):
+                os.makedirs(table_directory)
+            for attribute_name, table_name, _ in TA2_ELEMENT_TABLES:
+                element_df = getattr(self, attribute_name)
+                if kept_df_dict and attribute_name != 'schema_df':
+                    element_df = pd.concat([kept_df_dict[attribute_name], element_df],
                                            ignore_index=True)
+                element_rank = element_df['schema_instance_id'].map(schema_instance_rank_dict)
+                element_df = element_df.iloc[np.argsort(element_rank.to_numpy(),
+                                                        kind='stable')]
+                write_partitioned_extraction_file(element_df,
+                                                  os.path.join(table_directory, table_name),
+                                                  file_format)
+            write_extraction_manifest(team_directory, file_entry_dict)
+
+        # Reinitiate and import the written tables
+        self.ta2dict = dict()
+        for attribute_name, _, init_function in TA2_ELEMENT_TABLES:
+            setattr(self, attribute_name, init_function())
+        self.partition_slices = dict()
+        if file_list:
+            self.import_extractions_from_files(team_directory, file_format)
+        return update_counts
+
+    def combine_instance_dataframes(self, instance_list: list):
+        """
+        Appends the data frames of the extracted TA2CEInstance objects to the group data frames
+        of the ta2_instantiation, concatenating each element type once
 
-    def import_extractions_from_files(self, team_directory):
+        Args:
+            instance_list: list of TA2CEInstance objects in extraction order
         """
-        Method that imports all TA1 Libraries from extractions and labels them.
+        if not instance_list:
+            return
+        self.ev_df = pd.concat([self.ev_df] + [ta2_ceinstance.ev_df
+                                               for ta2_ceinstance in instance_list],
+                               ignore_index=True)
+        self.arg_df = pd.concat([self.arg_df] + [ta2_ceinstance.arg_df
+                                                 for ta2_ceinstance in instance_list],
+                                ignore_index=True)
+        self.ent_df = pd.concat([self.ent_df] + [ta2_ceinstance.ent_df
+                                                 for ta2_ceinstance in instance_list],
+                                ignore_index=True)
+        self.rel_df = pd.concat([self.rel_df] + [ta2_ceinstance.rel_df
+                                                 for ta2_ceinstance in instance_list],
+                                ignore_index=True)
+        self.temporalrel_df = pd.concat([self.temporalrel_df] +
+                                        [ta2_ceinstance.temporalrel_df
+                                         for ta2_ceinstance in instance_list],
+                                        ignore_index=True)
+        self.children_df = pd.concat([self.children_df] + [ta2_ceinstance.children_df
+                                                           for ta2_ceinstance in instance_list],
+                                     ignore_index=True)
+        self.schema_df = pd.concat([self.schema_df] + [ta2_ceinstance.schema_df
+                                                       for ta2_ceinstance in instance_list],
+                                   ignore_index=True)
+
+    def import_extractions_from_files(self, team_directory,
+                                      file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT):
+        """
+        Method that imports the element tables of the team and splits them into its
+        TA2CEInstance objects. Only the schema table and the partition column of the event
+        table are read here. Every other table is read when it is first used, and the data
+        frames of each instance are zero-copy slices of the team data frames
         Args:
             team_directory:
+            file_format: format of the extraction files, one of EXTRACTION_FILE_FORMATS
 
         Returns:
         """
-        # Strategy: Read each file in the "Extracted Events Directory". Use that filename
-        # to obtain the right TA1 library and then load the others
-        # Loop over all of the different teams from the collection directory
-        team_ev_directory = os.path.join(team_directory, 'Extracted_Events')
-        for file_name in os.listdir(team_ev_directory):
-            if file_name.startswith('.') or (not file_name.endswith('.csv')):
+        table_directory = os.path.join(team_directory, 'Extracted_Tables')
+        for attribute_name, table_name, init_function in TA2_ELEMENT_TABLES:
+            file_path_base = os.path.join(table_directory, table_name)
+            # schema, event and argument tables are required
+            if attribute_name in ['schema_df', 'ev_df', 'arg_df'] and \
+                    not extraction_file_exists(file_path_base, file_format):
+                raise FileNotFoundError("No such file: '{}'".format(
+                    file_path_base + get_extraction_file_extension(file_format)))
+            self.set_table_loader(attribute_name, partial(read_element_table, file_path_base,
+                                                          file_format, init_function))
+        self.partition_slices = dict()
+        ev_schema_instance_id_set = set(read_extraction_file(
+            os.path.join(table_directory, 'extracted_events'), file_format,
+            columns=['schema_instance_id'])['schema_instance_id'])
+
+        for schema_row in self.schema_df[['file_name', 'schema_instance_id', 'ta1_team_name',
+                                          'instance_id', 'instance_name',
+                                          'schema_id']].itertuples(index=False):
+            # Instances without events have no extraction to score
+            if schema_row.schema_instance_id not in ev_schema_instance_id_set:
                 continue
-            # This assumes a filename of
-            # <ta1_team_name>-<ta2_team_name>-<task1/2>-<ce_name>-<instance_id>_ev.csv
-            file_split = file_name.split('.')[0].split('-')
-            ta1_team_name = file_split[0].upper()
-            ta2_team_name = file_split[1].upper()
+            # All TA2 File Submissions follow <ta1>-<ta2>-<task>-<ce>
+            file_split = schema_row.file_name.split('.')[0].split('-')
             is_task2 = (file_split[2].lower() == "task2")
             ce_name = file_split[3].lower()
-            # We must read the events file to get the instance name
-            temp_ev_df = pd.read_csv(os.path.join(team_ev_directory, file_name))
-            schema_id = temp_ev_df.iloc[0, :]['schema_id']
-            instance_name = temp_ev_df.iloc[0, :]['instance_name']
-            instance_id = temp_ev_df.iloc[0, :]['instance_id']
-            # Get json_file_name and pass it as the file name
-            json_file_name = file_name.replace("_ev.csv", ".json")
-            ta2_ceinstance = TA2CEInstance(ta1_team_name, ta2_team_name, is_task2, ce_name,
-                                           instance_id, instance_name, schema_id, json_file_name)
-            ta2_ceinstance.import_extractions_from_files(team_directory)
-            # Get the ta1_team by extracting the event
+            ta2_ceinstance = TA2CEInstance(file_split[0].upper(), self.ta2_team_name, is_task2,
+                                           ce_name, schema_row.instance_id,
+                                           schema_row.instance_name, schema_row.schema_id,
+                                           schema_row.file_name)
+            for attribute_name, _, init_function in TA2_ELEMENT_TABLES:
+                ta2_ceinstance.set_table_loader(attribute_name,
+                                                partial(self.get_instance_table, attribute_name,
+                                                        schema_row.schema_instance_id,
+                                                        init_function))
+            ta2_ceinstance.ta1_team_name = schema_row.ta1_team_name
             self.ta2dict['{}|{}|{}|{}'.format(ta2_ceinstance.ta1_team_name, self.ta2_team_name,
-                                              ce_name, instance_id)] = ta2_ceinstance
-
-        # Now import the group data frames
-        # System level readings
-        self.ev_df = pd.read_csv(os.path.join(team_directory, "System_Level_Extractions",
-                                              "extracted_sys_events.csv"))
-        self.arg_df = pd.read_csv(os.path.join(team_directory, "System_Level_Extractions",
-                                               "extracted_sys_arg.csv"))
-        try:
-            self.rel_df = pd.read_csv(os.path.join(team_directory, "System_Level_Extractions",
-                                                   "extracted_sys_rel.csv"))
-        except FileNotFoundError:
-            pass
-        try:
-            self.temporalrel_df = pd.read_csv(os.path.join(team_directory,
-                                                           "System_Level_Extractions",
-                                                           "extracted_sys_temporalrel.csv"))
-        except FileNotFoundError:
-            pass
-        try:
-            self.ent_df = pd.read_csv(os.path.join(team_directory, "System_Level_Extractions",
-                                                   "extracted_sys_ent.csv"))
-        except FileNotFoundError:
-            pass
-        try:
-            self.children_df = pd.read_csv(os.path.join(team_directory, "System_Level_Extractions",
-                                                        "extracted_sys_children.csv"))
-        except FileNotFoundError:
-            pass
-        self.schema_df = pd.read_csv(os.path.join(team_directory, "System_Level_Extractions",
-                                                  "extracted_sys_schema.csv"))
-
-    def write_extractions_to_files(self, score_dir):
+                                              ce_name, schema_row.instance_id)] = ta2_ceinstance
+
+    def get_instance_table(self, attribute_name: str, schema_instance_id: str,
+                           init_function) -> pd.DataFrame:
         """
-        Write Extractions of all TA2 Instantiation objects to their respective files
+        Rows of one instance in a team element table, as a zero-copy slice
+        Args:
+            attribute_name: element data frame attribute, e.g. 'ev_df'
+            schema_instance_id:
+            init_function: initialization of the data frame for instances without rows
+
+        Returns:
+            data frame of the instance
+        """
+        element_df = getattr(self, attribute_name)
+        if attribute_name not in self.partition_slices:
+            self.partition_slices[attribute_name] = get_partition_slices(element_df)
+        partition_slice = self.partition_slices[attribute_name].get(schema_instance_id)
+        if partition_slice is None:
+            return init_function()
+        return get_partition_view(element_df, partition_slice)
+
+    def release_element_tables(self) -> None:
+        """
+        Drops the loaded element data frames of the team and of all of its instances. They
+        are read again from the extraction files when they are next used
+        """
+        for ta2_ceinstance in self.ta2dict.values():
+            ta2_ceinstance.release_element_tables()
+        super().release_element_tables()
+        self.partition_slices = dict()
+
+    def write_extractions_to_files(self, score_dir,
+                                   file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT):
+        """
+        Write the element tables of the team, one file per element type partitioned by
+        schema_instance_id
 
         Args:
             score_dir:
+            file_format: format of the extraction files, one of EXTRACTION_FILE_FORMATS
 
         Returns:
 
         """
-
-        # create schema, event, argument, children directories if not exist
-        kevs.extract_elements_from_json.create_extraction_directories(score_dir, self.ta2_team_name)
-        for key, value in self.ta2dict.items():
-            value.write_extractions_to_files(score_dir)
-        # Now write the group File Extractions
-        # Now write any system-specific output
-        if len(self.schema_df) > 0:
-            self.schema_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_schema.csv'),
-                       index=False)
-        if len(self.ev_df) > 0:
-            self.ev_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_events.csv'),
-                       index=False)
-        if len(self.arg_df) > 0:
-            self.arg_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_arg.csv'),
-                       index=False)
-        if len(self.children_df) > 0:
-            self.children_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_children.csv'),
-                       index=False)
-        if len(self.ent_df) > 0:
-            self.ent_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_ent.csv'),
-                       index=False)
-        if len(self.rel_df) > 0:
-            self.rel_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_rel.csv'),
-                       index=False)
-        if len(self.temporalrel_df) > 0:
-            self.temporalrel_df. \
-                to_csv(os.path.join(score_dir, self.ta2_team_name, 'System_Level_Extractions',
-                                    'extracted_sys_temporalrel.csv'),
-                       index=False)
+        table_directory = os.path.join(score_dir, self.ta2_team_name, 'Extracted_Tables')
+        if not os.path.isdir(table_directory):
+            os.makedirs(table_directory)
+        for attribute_name, table_name, _ in TA2_ELEMENT_TABLES:
+            write_partitioned_extraction_file(getattr(self, attribute_name),
+                                              os.path.join(table_directory, table_name),
+                                              file_format)
 
     def produce_event_trees(self, output_dir, include_all_events):
         for key, value in self.ta2dict.items():
@@ -510,12 +557,14 @@ class TA2Collection:
         """
     pass
 
-    def import_extractions_from_file_collection(self, collection_dir, extract_for_graph_g=False):
+    def import_extractions_from_file_collection(self, collection_dir, extract_for_graph_g=False,
+                                                file_format=DEFAULT_EXTRACTION_FILE_FORMAT):
         """
         Method that imports all TA1 Libraries from extractions and labels them.
         Args:
             collection_dir:
             extract_for_graph_g: bool of whether or not to extract for graph_g
+            file_format: format of the extraction files, one of EXTRACTION_FILE_FORMATS
 
         Returns:
         """
@@ -528,7 +577,7 @@ class TA2Collection:
                 team_directory = os.path.join(collection_dir, ta2_team)
                 ta2_instance = TA2Instantiation(ta2_team, self.is_task2)
                 try:
-                    ta2_instance.import_extractions_from_files(team_directory)
+                    ta2_instance.import_extractions_from_files(team_directory, file_format)
                     # Get the ta1_team by extracting the event
                     self.ta2dict['{}'.format(ta2_team)] = ta2_instance
                 except FileNotFoundError as e:
@@ -62,7 +62,9 @@ def produce_compare_event_str(ev_id: str, ta2_ce_instance, a_ev_df) -> str:
         is_ins, is_pred = is_event_ins_or_pred(ev_id, ta2_ce_instance)
         if is_pred:
             ev_pred_str = "*predicted* "
-        ev_conf_str = dforig.loc[dforig['ev_id'] == ev_id, 'ev_confidence_val'].iloc[0]
+        # Missing confidence values print as nan
+        ev_conf_str = \
+            dforig.loc[dforig['ev_id'] == ev_id, 'ev_confidence_val'].astype(float).iloc[0]
         ev_tree_name_root = "{}{} ({})".format(ev_pred_str, ev_name_root, ev_a_root)
         qlabel_str = dforig.loc[dforig['ev_id'] == ev_id, 'ev_ta2qlabel'].iloc[0]
         if pd.isna(qlabel_str) or qlabel_str == "":
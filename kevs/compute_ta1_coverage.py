@@ -1,22 +1,17 @@
 import os
 import pandas as pd
-import ast
 from collections import deque
 
 from kevs.TA2Instantiation import TA2Collection
+from kevs.extraction_files import DEFAULT_EXTRACTION_FILE_FORMAT
 from kevs.produce_event_trees import get_ta1_full_name
 
 
 def search_schema_for_ev(ins_ev_list: list, ta1_team: str, ta1_collection: str) -> int:
     ta1_library = ta1_collection.ta1dict[ta1_team]
 
-    team_ev_df = ta1_library.ev_df.copy(deep=True)
-    team_ev_child_df = ta1_library.ev_df.copy(deep=True)
-    team_ev_child_df['ev_child_list'] = team_ev_child_df['ev_child_list'].apply(ast.literal_eval)
-    team_ev_child_df = team_ev_child_df.explode("ev_child_list")[["ev_id", "ev_child_list"]]
-    team_ev_child_df = team_ev_child_df.loc[pd.notnull(team_ev_child_df["ev_child_list"]), :]
-    child_list = pd.unique(team_ev_child_df['ev_child_list']).tolist()
-    top_nodes = pd.unique(team_ev_df.loc[~team_ev_df['ev_id'].isin(child_list), 'ev_id']).tolist()
+    ev_hierarchy = ta1_library.event_hierarchy
+    top_nodes = ev_hierarchy.root_ids
 
     num_ev_in_schema = 0
     ev_in_schema = False
@@ -36,8 +31,7 @@ def search_schema_for_ev(ins_ev_list: list, ta1_team: str, ta1_collection: str)
                     break
                 parent_name = get_ta1_full_name(parent, ta1_library)
                 searched_list.append(parent)
-                child_list = team_ev_child_df.loc[team_ev_child_df["ev_id"] == parent,
-                                                  'ev_child_list'].tolist()
+                child_list = ev_hierarchy.get_children(parent)
                 if len(child_list) > 0 and (child_list != ['']):
                     for child in child_list:
                         child_name = get_ta1_full_name(child, ta1_library)
@@ -45,13 +39,11 @@ def search_schema_for_ev(ins_ev_list: list, ta1_team: str, ta1_collection: str)
                             children_to_search.append(child)
                             childnode = {child_name: []}
                             # If child is a leaf node, omit the '[]' for a leaf node
-                            if all(team_ev_df.loc[team_ev_df['ev_id'] == child,
-                                                  'ev_child_list'] == "[]"):
+                            if ev_hierarchy.is_leaf(child):
                                 childnode = child_name
                             children = node2children[parent_name]
                             children.append(childnode)
-                            if all(team_ev_df.loc[team_ev_df['ev_id'] == child,
-                                                  'ev_child_list'] == "[]"):
+                            if ev_hierarchy.is_leaf(child):
                                 node2children[child_name] = childnode
                             else:
                                 node2children[child_name] = childnode[child_name]
@@ -69,10 +61,12 @@ def search_schema_for_ev(ins_ev_list: list, ta1_team: str, ta1_collection: str)
 
 
 def compute_task1_ins_schema(ta2_task1_score_dir: str, task1_annotation_subdir: str,
-                             ta1_collection: str, ta1_analysis_dir: str) -> None:
+                             ta1_collection: str, ta1_analysis_dir: str,
+                             file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT) -> None:
     print("Importing TA2 Collection")
     ta2_task1_collection = TA2Collection(is_task2=False)
-    ta2_task1_collection.import_extractions_from_file_collection(ta2_task1_score_dir)
+    ta2_task1_collection.import_extractions_from_file_collection(ta2_task1_score_dir,
+                                                                 file_format=file_format)
 
     ta1_team_list = ['CMU', 'IBM', 'ISI', 'RESIN', 'SBU']
     complex_event_list = os.listdir(task1_annotation_subdir)
@@ -138,15 +132,8 @@ def compute_ta1_coverage(ta1_score_directory: str, ta1_collection: str,
         ta1_library = ta1_collection.ta1dict[ta1_team_name]
 
         # compute stats for event primitives
-        team_ev_df = ta1_library.ev_df.copy(deep=True)
-        team_ev_child_df = ta1_library.ev_df.copy(deep=True)
-        team_ev_child_df['ev_child_list'] = team_ev_child_df['ev_child_list'].apply(
-            ast.literal_eval)
-        team_ev_child_df = team_ev_child_df.explode("ev_child_list")[["ev_id", "ev_child_list"]]
-        team_ev_child_df = team_ev_child_df.loc[pd.notnull(team_ev_child_df["ev_child_list"]), :]
-        child_list = pd.unique(team_ev_child_df['ev_child_list']).tolist()
-        top_nodes = pd.unique(
-            team_ev_df.loc[~team_ev_df['ev_id'].isin(child_list), 'ev_id']).tolist()
+        ev_hierarchy = ta1_library.event_hierarchy
+        top_nodes = ev_hierarchy.root_ids
 
         num_schemas = len(top_nodes)
         num_ep_min = 200
@@ -163,8 +150,7 @@ def compute_ta1_coverage(ta1_score_directory: str, ta1_collection: str,
                 parent = children_to_search.pop()
                 parent_name = get_ta1_full_name(parent, ta1_library)
                 searched_list.append(parent)
-                child_list = team_ev_child_df.loc[team_ev_child_df["ev_id"]
-                                                  == parent, 'ev_child_list'].tolist()
+                child_list = ev_hierarchy.get_children(parent)
                 if len(child_list) > 0 and (child_list != ['']):
                     for child in child_list:
                         child_name = get_ta1_full_name(child, ta1_library)
@@ -172,13 +158,11 @@ def compute_ta1_coverage(ta1_score_directory: str, ta1_collection: str,
                             children_to_search.append(child)
                             childnode = {child_name: []}
                             # If child is a leaf node, omit the '[]' for a leaf node
-                            if all(team_ev_df.loc[team_ev_df['ev_id'] == child,
-                                                  'ev_child_list'] == "[]"):
+                            if ev_hierarchy.is_leaf(child):
                                 childnode = child_name
                             children = node2children[parent_name]
                             children.append(childnode)
-                            if all(team_ev_df.loc[team_ev_df['ev_id'] == child,
-                                                  'ev_child_list'] == "[]"):
+                            if ev_hierarchy.is_leaf(child):
                                 node2children[child_name] = childnode
                             else:
                                 node2children[child_name] = childnode[child_name]
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+class EventHierarchy:
+    """
+    Parent to child adjacency of the events of a TA1 library or TA2 instance in compressed
+    sparse row (CSR) form. Every event id and child id is a node, numbered in order of first
+    appearance. The children of node i are node_ids[child_indices[child_indptr[i]:
+    child_indptr[i + 1]]], in the order they are listed in the SDF, and the parents are stored
+    the same way in parent_indptr and parent_indices
+    """
+
+    def __init__(self, node_ids: np.ndarray, ev_codes: np.ndarray, parent_codes: np.ndarray,
+                 child_codes: np.ndarray):
+        """
+        Args:
+            node_ids: array of the node ids
+            ev_codes: node number of every row of the event data frame
+            parent_codes: node number of the parent of every edge
+            child_codes: node number of the child of every edge
+        """
+        self.node_ids = node_ids
+        self.node_index = {node_id: index for index, node_id in enumerate(node_ids)}
+        num_nodes = len(node_ids)
+        # stable sorts keep the SDF order of the children of a parent
+        child_order = np.argsort(parent_codes, kind='stable')
+        self.child_indices = child_codes[child_order]
+        self.child_indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(parent_codes, minlength=num_nodes))])
+        parent_order = np.argsort(child_codes, kind='stable')
+        self.parent_indices = parent_codes[parent_order]
+        self.parent_indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(child_codes, minlength=num_nodes))])
+        # Events that are nobody's child, in the order of the event data frame
+        has_parent = np.diff(self.parent_indptr) > 0
+        root_codes = pd.unique(ev_codes[~has_parent[ev_codes]])
+        self.root_ids = node_ids[root_codes].tolist()
+
+    def get_children(self, ev_id) -> list:
+        index = self.node_index.get(ev_id)
+        if index is None:
+            return []
+        return self.node_ids[
+            self.child_indices[self.child_indptr[index]:self.child_indptr[index + 1]]].tolist()
+
+    def get_parents(self, ev_id) -> list:
+        index = self.node_index.get(ev_id)
+        if index is None:
+            return []
+        return self.node_ids[
+            self.parent_indices[self.parent_indptr[index]:self.parent_indptr[index + 1]]].tolist()
+
+    def is_leaf(self, ev_id) -> bool:
+        """
+        True for an event without children, including ids that are not events of the schema
+        """
+        index = self.node_index.get(ev_id)
+        return index is None or self.child_indptr[index] == self.child_indptr[index + 1]
+
+
+def build_event_hierarchy(ev_df: pd.DataFrame, children_df: pd.DataFrame,
+                          child_column: str) -> EventHierarchy:
+    """
+    Builds the adjacency of the events from the extracted children data frame, which holds one
+    parent to child edge per row
+    Args:
+        ev_df: extracted event data frame
+        children_df: extracted children data frame
+        child_column: column of children_df with the child event id, child_id for TA1 and
+            child_ev_id for TA2
+
+    Returns:
+        EventHierarchy of the events
+    """
+    ev_ids = ev_df['ev_id'].dropna().to_numpy(dtype=object)
+    edge_df = children_df.loc[pd.notna(children_df['ev_id']) &
+                              pd.notna(children_df[child_column]), :]
+    parent_ids = edge_df['ev_id'].to_numpy(dtype=object)
+    child_ids = edge_df[child_column].to_numpy(dtype=object)
+    codes, node_ids = pd.factorize(np.concatenate([ev_ids, parent_ids, child_ids]))
+    num_ev = len(ev_ids)
+    num_edges = len(parent_ids)
+    return EventHierarchy(np.asarray(node_ids, dtype=object), codes[:num_ev],
+                          codes[num_ev:num_ev + num_edges], codes[num_ev + num_edges:])
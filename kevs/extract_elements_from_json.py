@@ -1,46 +1,55 @@
-import os
 import numpy as np
 import pandas as pd
 import json
 
+# Version of the extracted tables. Increase it whenever a change to the extraction changes
+# its output, so that incremental extraction re-extracts every SDF file
+EXTRACTOR_VERSION = "1"
+
 # Global variable for temporal qnodes as a reference
 temporal_qnodes = ["Q79030196", "Q65560376", "P4330",
                    "wd:Q79030196", "wd:Q65560376", "wd:P4330",
                    "wiki:Q79030196", "wiki:Q65560376", "wiki:P4330"]
 
 
-def create_single_extraction_directory(score_directory: str, team_name: str, element: str) -> None:
-    extraction_output_directory = os.path.join(score_directory, team_name, element)
-    # if the extraction_output_directory does not exist, create the folder
-    if not os.path.isdir(extraction_output_directory):
-        os.makedirs(extraction_output_directory)
-    # if the folder exists, clear the contents
-    else:
-        pass
-        # files = glob.glob(os.path.join(extraction_output_directory, '*'))
-        # for file in files:
-        #    os.remove(file)
-
-
-def create_extraction_directories(score_directory: str, team_name: str) -> None:
-    # schema directory
-    create_single_extraction_directory(score_directory, team_name, 'Extracted_Schemas')
-    # event directory
-    create_single_extraction_directory(score_directory, team_name, 'Extracted_Events')
-    # argument directory
-    create_single_extraction_directory(score_directory, team_name, 'Extracted_Arguments')
-    # children directory
-    create_single_extraction_directory(score_directory, team_name, 'Extracted_Children')
-    # entity directory
-    create_single_extraction_directory(score_directory, team_name, 'Extracted_Entities')
-    # relation directory
-    create_single_extraction_directory(score_directory, team_name, 'Extracted_Relations')
-    create_single_extraction_directory(score_directory, team_name, 'System_Level_Extractions')
+def init_element_rows() -> dict:
+    """
+    Row buffers for one extraction. Each element type collects plain row dicts that are turned
+    into a data frame once by build_element_dataframe, instead of concatenating row by row
+    """
+    return {'ev': [], 'arg': [], 'children': [], 'ent': [], 'rel': []}
+
+
+def build_element_dataframe(element_df: pd.DataFrame, element_rows: list) -> pd.DataFrame:
+    """
+    Builds an element data frame from buffered rows in a single step. The columns of
+    element_df come first, followed by any new row keys in order of appearance, which gives the
+    same columns as appending each row with pd.concat.
+    Args:
+        element_df: existing (usually empty, initialized) data frame of the element
+        element_rows: list of row dicts
+
+    Returns:
+        element_df with element_rows appended
+    """
+    if not element_rows:
+        return element_df
+    columns = list(element_df.columns)
+    column_set = set(columns)
+    for row in element_rows:
+        for key in row:
+            if key not in column_set:
+                columns.append(key)
+                column_set.add(key)
+    rows_df = pd.DataFrame(element_rows, columns=columns)
+    if element_df.shape[0] == 0:
+        return rows_df
+    return pd.concat([element_df, rows_df], ignore_index=True)
 
 
 # TA1 Methods
-def get_ta1_children(children_df: pd.DataFrame, event: json, ev_child_list: list, schema_id: str,
-                     ev_id: str) -> pd.DataFrame:
+def get_ta1_children(children_rows: list, event: json, ev_child_list: list, schema_id: str,
+                     ev_id: str) -> list:
     if 'children' in event.keys():
         children = event['children']
         if children:
@@ -71,14 +80,13 @@ def get_ta1_children(children_df: pd.DataFrame, event: json, ev_child_list: list
                         'child_comment': child_comment, 'child_importance': child_importance,
                         'child_outlinks': child_outlinks
                     }
-                    children_df = pd.concat([children_df, pd.DataFrame([children_row])],
-                                            ignore_index=True)
+                    children_rows.append(children_row)
 
-    return children_df
+    return children_rows
 
 
-def get_ta1_arguments(arg_df: pd.DataFrame, event: json, ev_arg_list: list,
-                      schema_id: str, ev_id: str) -> pd.DataFrame:
+def get_ta1_arguments(arg_rows: list, event: json, ev_arg_list: list,
+                      schema_id: str, ev_id: str) -> list:
     if 'participants' in event.keys():
         participants = event['participants']
         if participants:
@@ -101,13 +109,13 @@ def get_ta1_arguments(arg_df: pd.DataFrame, event: json, ev_arg_list: list,
                     'schema_id': schema_id, 'ev_id': ev_id, 'arg_id': arg_id,
                     'arg_role_name': arg_role_name, 'arg_entity': arg_entity
                 }
-                arg_df = pd.concat([arg_df, pd.DataFrame([arg_row])], ignore_index=True)
+                arg_rows.append(arg_row)
 
-    return arg_df
+    return arg_rows
 
 
-def get_ta1_entities(ent_df: pd.DataFrame, schema: json, entity_list: list,
-                     schema_id: str) -> pd.DataFrame:
+def get_ta1_entities(ent_rows: list, schema: json, entity_list: list,
+                     schema_id: str) -> list:
     if 'entities' in schema.keys():
         ent_list = schema['entities']
         if ent_list:
@@ -134,13 +142,13 @@ def get_ta1_entities(ent_df: pd.DataFrame, schema: json, entity_list: list,
                     'ent_qnode': ent_qnode,
                     'ent_qlabel': ent_qlabel, 'ent_comment': ent_comment
                 }
-                ent_df = pd.concat([ent_df, pd.DataFrame([ent_row])], ignore_index=True)
+                ent_rows.append(ent_row)
 
-    return ent_df
+    return ent_rows
 
 
-def get_ta1_relations(rel_df: pd.DataFrame, schema: json, relation_list: list, schema_id: str,
-                      rel_inEvent: str) -> pd.DataFrame:
+def get_ta1_relations(rel_rows: list, schema: json, relation_list: list, schema_id: str,
+                      rel_inEvent: str) -> list:
     if 'relations' in schema.keys():
         rel_list = schema['relations']
         if rel_list:
@@ -177,12 +185,12 @@ def get_ta1_relations(rel_df: pd.DataFrame, schema: json, relation_list: list, s
                     'rel_relationPredicate': rel_relationPredicate,
                     'rel_relationObject': rel_relationObject, 'rel_inEvent': rel_inEvent
                 }
-                rel_df = pd.concat([rel_df, pd.DataFrame([rel_row])], ignore_index=True)
+                rel_rows.append(rel_row)
 
-    return rel_df
+    return rel_rows
 
 
-def get_ta1_events(ta1_libraryfile, schema: json, schema_id: str,
+def get_ta1_events(element_rows: dict, schema: json, schema_id: str,
                    event_list: list, relation_list: list):
     if 'events' in schema.keys():
         ev_list = schema['events']
@@ -230,11 +238,9 @@ def get_ta1_events(ta1_libraryfile, schema: json, schema_id: str,
                 if 'repeatable' in event.keys():
                     ev_repeatable = event['repeatable']
                 # get children information
-                ta1_libraryfile.children_df = get_ta1_children(ta1_libraryfile.children_df, event,
-                                                               ev_child_list, schema_id, ev_id)
+                get_ta1_children(element_rows['children'], event, ev_child_list, schema_id, ev_id)
                 # get argument information
-                ta1_libraryfile.arg_df = get_ta1_arguments(ta1_libraryfile.arg_df, event,
-                                                           ev_arg_list, schema_id, ev_id)
+                get_ta1_arguments(element_rows['arg'], event, ev_arg_list, schema_id, ev_id)
                 # if the ev_id is not none, add ev_id to ev_arg_list
                 # and add the ev_row to ev_df
                 if ev_id is not None:
@@ -253,13 +259,10 @@ def get_ta1_events(ta1_libraryfile, schema: json, schema_id: str,
                         'ev_child_list': ev_child_list,
                         'ev_arg_list': ev_arg_list
                     }
-                    ta1_libraryfile.ev_df = pd.concat([ta1_libraryfile.ev_df,
-                                                       pd.DataFrame([ev_row])],
-                                                      ignore_index=True)
+                    element_rows['ev'].append(ev_row)
                 if 'relations' in event.keys():
-                    ta1_libraryfile.rel_df = get_ta1_relations(ta1_libraryfile.rel_df, event,
-                                                               relation_list, schema_id, ev_id)
-    # The object is updated so there is nothing to return
+                    get_ta1_relations(element_rows['rel'], event, relation_list, schema_id, ev_id)
+    # The row buffers are updated so there is nothing to return
     return
 
 
@@ -303,20 +306,31 @@ def extract_ta1_elements_from_json_file(ta1_team_name: str, base_file_name: str,
     if 'primitives' in schema.keys():
         schema_primitives = schema['primitives']
     # get event, argument, and children information
-    # The ta1_events updates events, args, entities, and relations
-    get_ta1_events(ta1_libraryfile, schema, schema_id, event_list, relation_list)
+    # The ta1_events updates the row buffers of events, args, children, and relations
+    element_rows = init_element_rows()
+    get_ta1_events(element_rows, schema, schema_id, event_list, relation_list)
     # get entity information
-    ta1_libraryfile.ent_df = get_ta1_entities(ta1_libraryfile.ent_df, schema, entity_list,
-                                              schema_id)
+    get_ta1_entities(element_rows['ent'], schema, entity_list, schema_id)
     # get relation information
-    ta1_libraryfile.rel_df = get_ta1_relations(ta1_libraryfile.rel_df, schema, relation_list,
-                                               schema_id, None)
+    get_ta1_relations(element_rows['rel'], schema, relation_list, schema_id, None)
+    # Build each data frame once from the row buffers
+    ta1_libraryfile.ev_df = build_element_dataframe(ta1_libraryfile.ev_df, element_rows['ev'])
+    ta1_libraryfile.arg_df = build_element_dataframe(ta1_libraryfile.arg_df, element_rows['arg'])
+    ta1_libraryfile.children_df = build_element_dataframe(ta1_libraryfile.children_df,
+                                                          element_rows['children'])
+    ta1_libraryfile.ent_df = build_element_dataframe(ta1_libraryfile.ent_df, element_rows['ent'])
+    ta1_libraryfile.rel_df = build_element_dataframe(ta1_libraryfile.rel_df, element_rows['rel'])
 
     # Separate order relations from relations into order df, remove
-    # order relations from rel_df.
-    ta1_libraryfile.temporalrel_df = \
+    # order relations from rel_df. The order relations of previous files of the library were
+    # already moved, so those of this file are appended to them
+    temporalrel_df = \
         ta1_libraryfile.rel_df.loc[ta1_libraryfile.rel_df['rel_relationPredicate'].isin(
             temporal_qnodes), :]
+    if ta1_libraryfile.temporalrel_df.shape[0] > 0:
+        temporalrel_df = pd.concat([ta1_libraryfile.temporalrel_df, temporalrel_df],
+                                   ignore_index=True)
+    ta1_libraryfile.temporalrel_df = temporalrel_df
     ta1_libraryfile.rel_df = \
         ta1_libraryfile.rel_df.loc[(
             ~ta1_libraryfile.rel_df['rel_relationPredicate'].isin(temporal_qnodes)), :]
@@ -332,9 +346,7 @@ def extract_ta1_elements_from_json_file(ta1_team_name: str, base_file_name: str,
         'entity_list': entity_list,
         'relation_list': relation_list
     }
-    ta1_libraryfile.schema_df = pd.concat([ta1_libraryfile.schema_df,
-                                           pd.DataFrame([schema_row])],
-                                          ignore_index=True)
+    ta1_libraryfile.schema_df = build_element_dataframe(ta1_libraryfile.schema_df, [schema_row])
 
     # Add ta1_team_name to each data frame
     ta1_libraryfile.ev_df['ta1_team_name'] = ta1_team_name
@@ -354,8 +366,8 @@ updated
 # TA2 Methods
 
 
-def get_ta2_children(children_df: pd.DataFrame, event: json, ev_child_list: list, schema_id: str,
-                     ev_id: str, instance_id: str, file_name: str) -> pd.DataFrame:
+def get_ta2_children(children_rows: list, event: json, ev_child_list: list, schema_id: str,
+                     ev_id: str, instance_id: str, file_name: str) -> list:
     instance_id_short = str(instance_id.split('/')[1])
     if 'subgroup_events' in event.keys():
         children = event['subgroup_events']
@@ -367,10 +379,8 @@ def get_ta2_children(children_df: pd.DataFrame, event: json, ev_child_list: list
                     'schema_id': schema_id, 'instance_id': instance_id, 'ev_id': ev_id,
                     'child_ev_id': child
                 }
-                children_df = pd.concat([children_df,
-                                        pd.DataFrame([children_row])],
-                                        ignore_index=True)
-    return children_df
+                children_rows.append(children_row)
+    return children_rows
 
 
 """
@@ -378,9 +388,9 @@ updated
 """
 
 
-def get_ta2_arguments(arg_df: pd.DataFrame, event: json, ev_arg_list: list,
+def get_ta2_arguments(arg_rows: list, event: json, ev_arg_list: list,
                       schema_id: str, ev_id: str,
-                      instance_id: str, file_name: str) -> pd.DataFrame:
+                      instance_id: str, file_name: str) -> list:
     instance_id_short = str(instance_id.split('/')[1])
     if 'participants' in event.keys():
         participants = event['participants']
@@ -423,7 +433,7 @@ def get_ta2_arguments(arg_df: pd.DataFrame, event: json, ev_arg_list: list,
                                 'arg_ta2confidence': arg_ta2confidence,
                                 'arg_ta2provenance': arg_ta2provenance
                             }
-                            arg_df = pd.concat([arg_df, pd.DataFrame([arg_row])], ignore_index=True)
+                            arg_rows.append(arg_row)
                     else:
                         if '@id' in participant['values'].keys():
                             arg_value_id = participant['values']['@id']
@@ -444,7 +454,7 @@ def get_ta2_arguments(arg_df: pd.DataFrame, event: json, ev_arg_list: list,
                             'arg_ta2entity': arg_ta2entity, 'arg_ta2confidence': arg_ta2confidence,
                             'arg_ta2provenance': arg_ta2provenance
                         }
-                        arg_df = pd.concat([arg_df, pd.DataFrame([arg_row])], ignore_index=True)
+                        arg_rows.append(arg_row)
                 else:
                     # If there is no "values", we add a stub holder with no ta2 entity link
                     arg_row = {
@@ -456,9 +466,9 @@ def get_ta2_arguments(arg_df: pd.DataFrame, event: json, ev_arg_list: list,
                         'arg_ta2entity': "kairos:NULL", 'arg_ta2confidence': '0',
                         'arg_ta2provenance': "kairos:NULL"
                     }
-                    arg_df = pd.concat([arg_df, pd.DataFrame([arg_row])], ignore_index=True)
+                    arg_rows.append(arg_row)
 
-    return arg_df
+    return arg_rows
 
 
 """
@@ -466,8 +476,8 @@ updated
 """
 
 
-def get_ta2_entities(ent_df: pd.DataFrame, schema: json, entity_list: list, schema_id: str,
-                     instance_id: str, file_name: str) -> pd.DataFrame:
+def get_ta2_entities(ent_rows: list, schema: json, entity_list: list, schema_id: str,
+                     instance_id: str, file_name: str) -> list:
     instance_id_short = str(instance_id.split('/')[1])
     if 'entities' in schema.keys():
         ent_list = schema['entities']
@@ -509,9 +519,9 @@ def get_ta2_entities(ent_df: pd.DataFrame, schema: json, entity_list: list, sche
                     'ent_ta2wd_label': ent_ta2wd_label,
                     'ent_ta2wd_description': ent_ta2wd_description
                 }
-                ent_df = pd.concat([ent_df, pd.DataFrame([ent_row])], ignore_index=True)
+                ent_rows.append(ent_row)
 
-    return ent_df
+    return ent_rows
 
 
 """
@@ -519,8 +529,8 @@ updated
 """
 
 
-def get_ta2_relations(rel_df: pd.DataFrame, schema: json, relation_list: list, schema_id: str,
-                      instance_id: str, file_name: str, rel_inEvent: str) -> pd.DataFrame:
+def get_ta2_relations(rel_rows: list, schema: json, relation_list: list, schema_id: str,
+                      instance_id: str, file_name: str, rel_inEvent: str) -> list:
     instance_id_short = str(instance_id.split('/')[1])
     if 'relations' in schema.keys():
         rel_list = schema['relations']
@@ -578,9 +588,9 @@ def get_ta2_relations(rel_df: pd.DataFrame, schema: json, relation_list: list, s
                     'rel_confidence': rel_confidence,
                     'rel_inEvent': rel_inEvent
                 }
-                rel_df = pd.concat([rel_df, pd.DataFrame([rel_row])], ignore_index=True)
+                rel_rows.append(rel_row)
 
-    return rel_df
+    return rel_rows
 
 
 """
@@ -588,7 +598,7 @@ updated
 """
 
 
-def get_ta2_events(ta2_ceinstance, schema: json, schema_id: str,
+def get_ta2_events(ta2_ceinstance, element_rows: dict, schema: json, schema_id: str,
                    event_list: list, instance_name: str, instance_id: str, file_name: str,
                    relation_list: list):
     instance_id_short = str(instance_id.split('/')[1])
@@ -684,13 +694,11 @@ def get_ta2_events(ta2_ceinstance, schema: json, schema_id: str,
                 if 'outlinks' in event.keys():
                     ev_outlinks = event['outlinks']
                 # get children information
-                ta2_ceinstance.children_df = get_ta2_children(ta2_ceinstance.children_df, event,
-                                                              ev_child_list, schema_id, ev_id,
-                                                              instance_id, file_name)
+                get_ta2_children(element_rows['children'], event, ev_child_list, schema_id,
+                                 ev_id, instance_id, file_name)
                 # get argument information
-                ta2_ceinstance.arg_df = get_ta2_arguments(ta2_ceinstance.arg_df, event,
-                                                          ev_arg_list, schema_id, ev_id,
-                                                          instance_id, file_name)
+                get_ta2_arguments(element_rows['arg'], event, ev_arg_list, schema_id, ev_id,
+                                  instance_id, file_name)
                 # if the ev_id is not none, add ev_id to ev_arg_list
                 # and add the ev_row to ev_df
                 if ev_id is not None:
@@ -727,15 +735,12 @@ def get_ta2_events(ta2_ceinstance, schema: json, schema_id: str,
                         'ev_latestEndTime': ev_latestEndTime,
                         'ev_absoluteTime': ev_absoluteTime
                     }
-                    ta2_ceinstance.ev_df = pd.concat([ta2_ceinstance.ev_df,
-                                                      pd.DataFrame([ev_row])],
-                                                     ignore_index=True)
+                    element_rows['ev'].append(ev_row)
                 if 'relations' in event.keys():
-                    ta2_ceinstance.rel_df = get_ta2_relations(ta2_ceinstance.rel_df, event,
-                                                              relation_list, schema_id,
-                                                              instance_id, file_name, ev_id)
+                    get_ta2_relations(element_rows['rel'], event, relation_list, schema_id,
+                                      instance_id, file_name, ev_id)
 
-    # Since the object is updated, nothing is returned
+    # Since the row buffers are updated, nothing is returned
     return
 
 
@@ -791,17 +796,23 @@ def extract_ta2_elements_from_json_instance(ta2_team_name: str,
         instance_description = instance_schema['description']
     if 'ta1ref' in instance_schema.keys():
         instance_ta1ref = instance_schema['ta1ref']
-    # Now get the specific information
-    get_ta2_events(ta2_ceinstance, instance_schema, schema_id, event_list, instance_name,
-                   instance_id, file_name,
-                   relation_list)
+    # Now get the specific information, buffering the rows of the whole instance
+    element_rows = init_element_rows()
+    get_ta2_events(ta2_ceinstance, element_rows, instance_schema, schema_id, event_list,
+                   instance_name, instance_id, file_name, relation_list)
     # get entity information
-    ta2_ceinstance.ent_df = get_ta2_entities(ta2_ceinstance.ent_df, instance_schema, entity_list,
-                                             schema_id, instance_id, file_name)
+    get_ta2_entities(element_rows['ent'], instance_schema, entity_list,
+                     schema_id, instance_id, file_name)
     # get relation information
-    ta2_ceinstance.rel_df = get_ta2_relations(ta2_ceinstance.rel_df, instance_schema,
-                                              relation_list, schema_id, instance_id,
-                                              file_name, None)
+    get_ta2_relations(element_rows['rel'], instance_schema, relation_list, schema_id,
+                      instance_id, file_name, None)
+    # Build each data frame once from the row buffers
+    ta2_ceinstance.ev_df = build_element_dataframe(ta2_ceinstance.ev_df, element_rows['ev'])
+    ta2_ceinstance.arg_df = build_element_dataframe(ta2_ceinstance.arg_df, element_rows['arg'])
+    ta2_ceinstance.children_df = build_element_dataframe(ta2_ceinstance.children_df,
+                                                         element_rows['children'])
+    ta2_ceinstance.ent_df = build_element_dataframe(ta2_ceinstance.ent_df, element_rows['ent'])
+    ta2_ceinstance.rel_df = build_element_dataframe(ta2_ceinstance.rel_df, element_rows['rel'])
     # Separate order relations from relations into order df, remove
     # order relations from rel_df.
     ta2_ceinstance.temporalrel_df = \
@@ -833,9 +844,7 @@ def extract_ta2_elements_from_json_instance(ta2_team_name: str,
         'entity_list': entity_list,
         'relation_list': relation_list, 'ce_id': ceId, 'provenance_list': provenance_list
     }
-    ta2_ceinstance.schema_df = pd.concat([ta2_ceinstance.schema_df,
-                                          pd.DataFrame([schema_row])],
-                                         ignore_index=True)
+    ta2_ceinstance.schema_df = build_element_dataframe(ta2_ceinstance.schema_df, [schema_row])
     # Add ta1_team_name and ta2_team_name to each data frame
     ta2_ceinstance.ev_df['ta1_team_name'] = ta1_team_name
     ta2_ceinstance.arg_df['ta1_team_name'] = ta1_team_name
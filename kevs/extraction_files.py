@@ -0,0 +1,411 @@
+import hashlib
+import json
+import math
+import numbers
+import os
+
+import numpy as np
+import pandas as pd
+
+from kevs.event_hierarchy import EventHierarchy, build_event_hierarchy
+
+# Supported on-disk formats of the extracted element tables and their file extensions.
+# parquet and feather require pyarrow
+EXTRACTION_FILE_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+DEFAULT_EXTRACTION_FILE_FORMAT = 'csv'
+# Manifest of the SDF files extracted into a team directory, see get_sdf_file_entry
+EXTRACTION_MANIFEST_FILE_NAME = 'extraction_manifest.json'
+# Dtypes of the extracted element table columns. A column has the same meaning in every TA1 and
+# TA2 table it appears in, so one mapping covers all tables; columns that are not listed keep
+# their inferred dtype. Team names, complex events and tasks repeat on every row and are stored
+# as categoricals, confidence values are nullable floats
+EXTRACTION_COLUMN_DTYPES = {
+    'ta1_team_name': 'category',
+    'ta2_team_name': 'category',
+    'ce_id': 'category',
+    'task': 'category',
+    'instance_confidence': 'Float64',
+    'ev_confidence_val': 'Float64',
+    'arg_ta2confidence': 'Float64',
+}
+
+
+def get_extraction_file_format(config_section) -> str:
+    """
+    Reads the extraction_file_format key of a config.ini section, csv when it is not set
+    Args:
+        config_section: section of a ConfigParser, e.g. config[config_mode]
+
+    Returns:
+        file format name, one of EXTRACTION_FILE_FORMATS
+    """
+    file_format = config_section.get('extraction_file_format',
+                                     DEFAULT_EXTRACTION_FILE_FORMAT).strip().lower()
+    check_extraction_file_format(file_format)
+    return file_format
+
+
+def check_extraction_file_format(file_format: str) -> None:
+    if file_format not in EXTRACTION_FILE_FORMATS:
+        raise ValueError("Unknown extraction file format '{}', expected one of {}".format(
+            file_format, ", ".join(EXTRACTION_FILE_FORMATS)))
+
+
+def get_extraction_file_extension(file_format: str) -> str:
+    check_extraction_file_format(file_format)
+    return EXTRACTION_FILE_FORMATS[file_format]
+
+
+def is_scalar_value(value) -> bool:
+    return value is None or isinstance(value, (str, numbers.Number))
+
+
+def to_text_value(value):
+    """
+    Text form of a cell, as a csv round trip would produce it (lists and dicts become their
+    repr, None and NaN stay missing)
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return str(value)
+
+
+def apply_extraction_schema(element_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the columns listed in EXTRACTION_COLUMN_DTYPES to their schema dtype. A column
+    whose values do not fit the schema (e.g. a list of confidence values) is left as it is
+    Args:
+        element_df: extracted element data frame
+
+    Returns:
+        data frame with the converted columns
+    """
+    converted_columns = dict()
+    for column_name, dtype in EXTRACTION_COLUMN_DTYPES.items():
+        if column_name not in element_df.columns or element_df[column_name].dtype == dtype:
+            continue
+        column = element_df[column_name]
+        try:
+            if dtype == 'category':
+                converted_columns[column_name] = column.astype(dtype)
+            else:
+                converted_columns[column_name] = pd.to_numeric(column).astype(dtype)
+        except (ValueError, TypeError):
+            print("Warning: column {} does not match the {} dtype of the extraction schema and "
+                  "was not converted".format(column_name, dtype))
+    if converted_columns:
+        element_df = element_df.assign(**converted_columns)
+    return element_df
+
+
+def set_extraction_dtypes(element_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Gives every column of an extracted element data frame an explicit, storable dtype.
+    Columns of EXTRACTION_COLUMN_DTYPES get their schema dtype. Of the other columns, those
+    whose values are all numbers (or numeric text) become numeric, columns without any value
+    become float64 and every other column holds text, so that a binary file reads back with
+    the same values a csv file would.
+    Args:
+        element_df: extracted element data frame
+
+    Returns:
+        data frame with the converted columns and a default index
+    """
+    element_df = element_df.reset_index(drop=True)
+    converted_columns = dict()
+    for column_name in element_df.columns:
+        column = element_df[column_name]
+        if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+            continue
+        if not column.map(is_scalar_value).all():
+            converted_columns[column_name] = column.map(to_text_value).astype(object)
+        elif column.isna().all():
+            converted_columns[column_name] = column.astype('float64')
+        else:
+            try:
+                converted_columns[column_name] = pd.to_numeric(column)
+            except (ValueError, TypeError):
+                converted_columns[column_name] = column.map(to_text_value).astype(object)
+    if converted_columns:
+        element_df = element_df.assign(**converted_columns)
+    return apply_extraction_schema(element_df)
+
+
+def write_extraction_file(element_df: pd.DataFrame, file_path_base: str,
+                          file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT) -> str:
+    """
+    Writes an element data frame to file_path_base plus the extension of the file format
+    Args:
+        element_df: extracted element data frame
+        file_path_base: file path without extension
+        file_format: one of EXTRACTION_FILE_FORMATS
+
+    Returns:
+        path of the written file
+    """
+    file_path = file_path_base + get_extraction_file_extension(file_format)
+    if file_format == 'csv':
+        element_df.to_csv(file_path, index=False)
+    elif file_format == 'parquet':
+        set_extraction_dtypes(element_df).to_parquet(file_path, index=False)
+    else:
+        set_extraction_dtypes(element_df).to_feather(file_path)
+    return file_path
+
+
+def read_extraction_file(file_path_base: str,
+                         file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT,
+                         columns=None) -> pd.DataFrame:
+    """
+    Reads an element data frame written by write_extraction_file, with the column dtypes of
+    EXTRACTION_COLUMN_DTYPES. Raises FileNotFoundError when the file does not exist
+    Args:
+        file_path_base: file path without extension
+        file_format: one of EXTRACTION_FILE_FORMATS
+        columns: optional list of columns to read
+
+    Returns:
+        element data frame
+    """
+    file_path = file_path_base + get_extraction_file_extension(file_format)
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError("No such file: '{}'".format(file_path))
+    if file_format == 'csv':
+        # round_trip parsing reads back the exact floats that were written
+        element_df = pd.read_csv(file_path, usecols=columns, float_precision='round_trip')
+    elif file_format == 'parquet':
+        element_df = pd.read_parquet(file_path, columns=columns)
+    else:
+        element_df = pd.read_feather(file_path, columns=columns)
+    return apply_extraction_schema(element_df)
+
+
+def partition_element_dataframe(element_df: pd.DataFrame,
+                                partition_column: str = 'schema_instance_id') -> pd.DataFrame:
+    """
+    Orders the rows of an element data frame so that the rows of each partition are stored
+    contiguously. Partitions keep the order of their first row, and the rows keep their order
+    within a partition. Data frames that are already partitioned are returned unchanged
+    Args:
+        element_df: element data frame of a team
+        partition_column: column that identifies the partition of a row
+
+    Returns:
+        partitioned data frame
+    """
+    partition_codes = pd.factorize(element_df[partition_column])[0]
+    if (np.diff(partition_codes) >= 0).all():
+        return element_df
+    return element_df.iloc[np.argsort(partition_codes, kind='stable')].reset_index(drop=True)
+
+
+def get_partition_slices(element_df: pd.DataFrame,
+                         partition_column: str = 'schema_instance_id') -> dict:
+    """
+    Row ranges of the partitions of a partitioned element data frame
+    Args:
+        element_df: element data frame written by write_partitioned_extraction_file
+        partition_column: column that identifies the partition of a row
+
+    Returns:
+        dictionary with the partition value as key and the slice of its rows as value
+    """
+    partition_values = element_df[partition_column].to_numpy()
+    if len(partition_values) == 0:
+        return dict()
+    start_list = np.concatenate([[0], np.flatnonzero(partition_values[1:] !=
+                                                     partition_values[:-1]) + 1])
+    stop_list = np.concatenate([start_list[1:], [len(partition_values)]])
+    partition_slices = dict()
+    for start, stop in zip(start_list, stop_list):
+        partition_value = partition_values[start]
+        if partition_value in partition_slices:
+            raise ValueError("Rows of partition {} are not contiguous".format(partition_value))
+        partition_slices[partition_value] = slice(int(start), int(stop))
+    return partition_slices
+
+
+def get_partition_view(element_df: pd.DataFrame, partition_slice: slice) -> pd.DataFrame:
+    """
+    Rows of one partition as a slice of the team data frame, without copying the data.
+    The view is re-indexed from 0 like a data frame read from its own file
+    """
+    partition_df = element_df.iloc[partition_slice]
+    partition_df.index = pd.RangeIndex(len(partition_df))
+    return partition_df
+
+
+def write_partitioned_extraction_file(element_df: pd.DataFrame, file_path_base: str,
+                                      file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT,
+                                      partition_column: str = 'schema_instance_id') -> None:
+    """
+    Writes the element data frame of a team as a single file partitioned by partition_column.
+    An empty data frame removes any file left by a previous extraction instead
+    Args:
+        element_df: element data frame of a team
+        file_path_base: file path without extension
+        file_format: one of EXTRACTION_FILE_FORMATS
+        partition_column: column that identifies the partition of a row
+    """
+    if len(element_df) > 0:
+        write_extraction_file(partition_element_dataframe(element_df, partition_column),
+                              file_path_base, file_format)
+    elif os.path.isfile(file_path_base + get_extraction_file_extension(file_format)):
+        os.remove(file_path_base + get_extraction_file_extension(file_format))
+
+
+def extraction_file_exists(file_path_base: str,
+                           file_format: str = DEFAULT_EXTRACTION_FILE_FORMAT) -> bool:
+    return os.path.isfile(file_path_base + get_extraction_file_extension(file_format))
+
+
+def read_element_table(file_path_base: str, file_format: str, init_function) -> pd.DataFrame:
+    """
+    Reads an element data frame, or returns the initialized empty data frame of the element
+    when no file was written for it
+    """
+    try:
+        return read_extraction_file(file_path_base, file_format)
+    except FileNotFoundError:
+        return init_function()
+
+
+class LazyElementTable:
+    """
+    Element data frame attribute that is loaded on first access by the loader registered
+    with LazyElementTables.set_table_loader. Assigning a data frame stores it directly
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, owner_object, owner_class=None):
+        if owner_object is None:
+            return self
+        if self.name not in owner_object.__dict__:
+            table_loaders = owner_object.__dict__.get('table_loaders', dict())
+            if self.name not in table_loaders:
+                raise AttributeError("'{}' object has no attribute '{}'".format(
+                    type(owner_object).__name__, self.name))
+            owner_object.__dict__[self.name] = table_loaders[self.name]()
+        return owner_object.__dict__[self.name]
+
+    def __set__(self, owner_object, element_df):
+        owner_object.__dict__[self.name] = element_df
+        # An assigned data frame can no longer be reloaded, so it is never released
+        owner_object.__dict__.get('table_loaders', dict()).pop(self.name, None)
+
+
+class LazyElementTables:
+    """
+    Element data frames shared by TA1Library, TA2Instantiation and TA2CEInstance. Imported
+    tables are only read from file when they are first used, and can be released afterwards
+    """
+    schema_df = LazyElementTable()
+    ev_df = LazyElementTable()
+    arg_df = LazyElementTable()
+    children_df = LazyElementTable()
+    ent_df = LazyElementTable()
+    rel_df = LazyElementTable()
+    temporalrel_df = LazyElementTable()
+    # Column of children_df that holds the child event id
+    child_id_column = 'child_ev_id'
+
+    def set_table_loader(self, attribute_name: str, table_loader) -> None:
+        """
+        Registers the function that loads an element data frame on first access, replacing
+        any loaded data frame
+        Args:
+            attribute_name: element data frame attribute, e.g. 'ev_df'
+            table_loader: function without arguments that returns the data frame. It should
+                be picklable (e.g. a functools.partial of a module level function)
+        """
+        self.__dict__.pop(attribute_name, None)
+        self.__dict__.setdefault('table_loaders', dict())[attribute_name] = table_loader
+
+    @property
+    def event_hierarchy(self) -> EventHierarchy:
+        """
+        Adjacency of the events built from ev_df and children_df. It is built on first access
+        and again whenever either data frame has been replaced
+        """
+        ev_df = self.ev_df
+        children_df = self.children_df
+        cached = self.__dict__.get('_event_hierarchy')
+        if cached is None or cached[0] is not ev_df or cached[1] is not children_df:
+            cached = (ev_df, children_df,
+                      build_event_hierarchy(ev_df, children_df, self.child_id_column))
+            self.__dict__['_event_hierarchy'] = cached
+        return cached[2]
+
+    def is_table_loaded(self, attribute_name: str) -> bool:
+        return attribute_name in self.__dict__
+
+    def __getstate__(self):
+        # A loader bound to another object, such as the team tables an instance is sliced
+        # from, would pickle that whole object. Its table is loaded and pickled on its own
+        # instead, so that an instance sent to a worker process only carries its own rows.
+        # Loaders that read a file are kept, without the tables they can read again
+        state = self.__dict__.copy()
+        state.pop('_event_hierarchy', None)
+        table_loaders = state.pop('table_loaders', None)
+        if table_loaders:
+            file_table_loaders = dict()
+            for attribute_name, table_loader in table_loaders.items():
+                if getattr(getattr(table_loader, 'func', None), '__self__', None) is None:
+                    file_table_loaders[attribute_name] = table_loader
+                    state.pop(attribute_name, None)
+                elif attribute_name not in state:
+                    state[attribute_name] = table_loader()
+            if file_table_loaders:
+                state['table_loaders'] = file_table_loaders
+        return state
+
+    def release_element_tables(self) -> None:
+        """
+        Drops the loaded element data frames that can be loaded again, which frees their
+        memory until the next access
+        """
+        for attribute_name in self.__dict__.get('table_loaders', dict()):
+            self.__dict__.pop(attribute_name, None)
+        self.__dict__.pop('_event_hierarchy', None)
+
+
+def get_sdf_file_entry(file_path: str, extractor_version: str, file_format: str) -> dict:
+    """
+    Manifest entry of an SDF file: the SHA-256 hash and size of its content, plus the
+    extractor version and file format its extraction was written with. A file needs to be
+    extracted again whenever its entry changes
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as sdf_file:
+        for chunk in iter(lambda: sdf_file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return {'sha256': sha256.hexdigest(), 'size': os.path.getsize(file_path),
+            'extractor_version': extractor_version, 'file_format': file_format}
+
+
+def read_extraction_manifest(team_directory: str) -> dict:
+    """
+    Returns:
+        dictionary with the SDF file name as key and its manifest entry as value, empty when
+        the team directory has no readable manifest
+    """
+    try:
+        with open(os.path.join(team_directory, EXTRACTION_MANIFEST_FILE_NAME)) as manifest_file:
+            return json.load(manifest_file)['files']
+    except (FileNotFoundError, ValueError, KeyError):
+        return dict()
+
+
+def write_extraction_manifest(team_directory: str, file_entry_dict: dict) -> None:
+    """
+    Writes the manifest of a team directory. The file is replaced in one step so that an
+    interrupted write leaves the previous manifest
+    """
+    manifest_path = os.path.join(team_directory, EXTRACTION_MANIFEST_FILE_NAME)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump({'files': file_entry_dict}, manifest_file, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
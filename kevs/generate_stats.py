@@ -4,6 +4,7 @@ import pandas as pd
 import typing
 from kevs.TA1Library import TA1Collection
 from kevs.TA2Instantiation import TA2Collection
+from kevs.extraction_files import DEFAULT_EXTRACTION_FILE_FORMAT
 from kevs.produce_event_trees import get_ta2_instantiated_events, get_ta2_predicted_events
 
 
@@ -667,7 +668,8 @@ def compute_ta1_submission_stats(ta1_score_directory: str,
 
 
 def compute_ta2_submission_stats(ta2_score_directory: str, ta2_analysis_directory: str,
-                                 extract_for_graph_g=False) -> \
+                                 extract_for_graph_g=False,
+                                 file_format=DEFAULT_EXTRACTION_FILE_FORMAT) -> \
         typing.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     ta2_stats_df = initiate_ta2_stats_dataframe()
     ta2_ent_ev_df = initiate_ta2_ent_ev_dataframe()
@@ -677,7 +679,8 @@ def compute_ta2_submission_stats(ta2_score_directory: str, ta2_analysis_director
     # First, Import the collection
     ta2_collection = TA2Collection()
     ta2_collection.import_extractions_from_file_collection(ta2_score_directory,
-                                                           extract_for_graph_g=extract_for_graph_g)
+                                                           extract_for_graph_g=extract_for_graph_g,
+                                                           file_format=file_format)
 
     # Return if empty without crashing
     if not ta2_collection.ta2dict:
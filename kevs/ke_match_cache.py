@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+
+# Version of the match results. Changing it invalidates every cached result, so it is raised
+# whenever a change of the matching or scoring code changes the files it writes
+KE_MATCH_CACHE_VERSION = '1'
+KE_MATCH_CACHE_INDEX_FILE_NAME = 'ke_match_cache_index.json'
+# Total size of the cached files above which the least recently used results are evicted
+KE_MATCH_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def update_data_frame_hash(sha256, element_df: pd.DataFrame) -> None:
+    """
+    Adds the column names and cell values of a data frame to a hash. Values are hashed as
+    strings, so that a table read back from csv, parquet or feather has the same hash as the
+    extracted table, whatever dtypes the columns were given
+    """
+    sha256.update(json.dumps([str(column) for column in element_df.columns]).encode())
+    sha256.update(str(element_df.shape[0]).encode())
+    if element_df.shape[0] > 0 and element_df.shape[1] > 0:
+        row_hashes = pd.util.hash_pandas_object(element_df.astype(str), index=False)
+        sha256.update(row_hashes.to_numpy().tobytes())
+
+
+def get_ke_match_cache_key(task1_ceannotation, ta2_ceinstance, match_params: dict) -> str:
+    """
+    Content key of the match results of a TA2 CE instance: a SHA-256 hash of the cache
+    version, the match parameters, the instance name and the element tables the matching reads
+    from the instance and the annotation
+    Args:
+        task1_ceannotation: annotation of the complex event
+        ta2_ceinstance: TA2 CE instance
+        match_params: dictionary of the parameters that change the match results, such as
+            min_confidence_threshold and use_graph_g
+
+    Returns:
+        key as a hex string
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(json.dumps({'version': KE_MATCH_CACHE_VERSION,
+                              'params': {key: str(value) for key, value in match_params.items()},
+                              'schema_instance_id': ta2_ceinstance.schema_instance_id,
+                              'ta1_team_name': ta2_ceinstance.ta1_team_name,
+                              'ta2_team_name': ta2_ceinstance.ta2_team_name},
+                             sort_keys=True).encode())
+    for element_df in [ta2_ceinstance.ev_df, ta2_ceinstance.arg_df, ta2_ceinstance.ent_df,
+                       task1_ceannotation.ep_df, task1_ceannotation.arg_df,
+                       task1_ceannotation.entity_qnode_df]:
+        update_data_frame_hash(sha256, element_df)
+    return sha256.hexdigest()
+
+
+class KEMatchCache:
+    """
+    Match result files of TA2 CE instances stored under their content key, see
+    get_ke_match_cache_key. Each result is a directory named after its key. The index file
+    records the size and last use of every result; when the total size goes over max_bytes, the
+    least recently used results are evicted. The index is written by one process at a time
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = KE_MATCH_CACHE_MAX_BYTES):
+        """
+        Opens the cache, creating its directory if needed. Result directories that are not in
+        the index, such as those of an interrupted run, are removed, and results are evicted
+        if the cache is larger than max_bytes
+        Args:
+            cache_dir: directory of the cache
+            max_bytes: total size of the cached files that is kept
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.entry_dict = self._read_index()
+        for file_name in os.listdir(cache_dir):
+            result_dir = os.path.join(cache_dir, file_name)
+            if os.path.isdir(result_dir) and file_name not in self.entry_dict:
+                shutil.rmtree(result_dir, ignore_errors=True)
+        if self.get_size() > max_bytes:
+            self._evict()
+            self._write_index()
+
+    def restore(self, key: str, file_paths: list) -> bool:
+        """
+        Copies the cached result files of a key to file_paths
+        Args:
+            key: content key
+            file_paths: paths of the result files, in the order they were stored
+
+        Returns:
+            whether the key was cached
+        """
+        entry = self.entry_dict.get(key)
+        if entry is None or len(entry['files']) != len(file_paths):
+            return False
+        result_dir = os.path.join(self.cache_dir, key)
+        try:
+            for cache_file_name, file_path in zip(entry['files'], file_paths):
+                shutil.copyfile(os.path.join(result_dir, cache_file_name), file_path)
+        except FileNotFoundError:
+            print("Warning: Incomplete cached match result {}, computing it again".format(key))
+            self._remove(key)
+            self._write_index()
+            return False
+        entry['last_used'] = time.time()
+        self._write_index()
+        return True
+
+    def store(self, key: str, file_paths: list) -> None:
+        """
+        Copies the result files of a key into the cache and evicts the least recently used
+        results that do not fit
+        """
+        self._remove(key)
+        result_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(result_dir)
+        cache_file_name_list = []
+        size = 0
+        for file_path in file_paths:
+            cache_file_name = os.path.basename(file_path)
+            shutil.copyfile(file_path, os.path.join(result_dir, cache_file_name))
+            cache_file_name_list.append(cache_file_name)
+            size += os.path.getsize(file_path)
+        self.entry_dict[key] = {'files': cache_file_name_list, 'size': size,
+                                'last_used': time.time()}
+        self._evict()
+        self._write_index()
+
+    def get_size(self) -> int:
+        return sum(entry['size'] for entry in self.entry_dict.values())
+
+    def _evict(self):
+        total_size = self.get_size()
+        for key in sorted(self.entry_dict, key=lambda key: self.entry_dict[key]['last_used']):
+            if total_size <= self.max_bytes:
+                break
+            total_size -= self.entry_dict[key]['size']
+            self._remove(key)
+
+    def _remove(self, key):
+        self.entry_dict.pop(key, None)
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _read_index(self):
+        # An index of another cache version is discarded with its results
+        try:
+            with open(os.path.join(self.cache_dir, KE_MATCH_CACHE_INDEX_FILE_NAME)) as index_file:
+                index = json.load(index_file)
+            if index['version'] == KE_MATCH_CACHE_VERSION:
+                return index['entries']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return dict()
+
+    def _write_index(self):
+        # The file is replaced in one step so that an interrupted write leaves the previous index
+        index_path = os.path.join(self.cache_dir, KE_MATCH_CACHE_INDEX_FILE_NAME)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump({'version': KE_MATCH_CACHE_VERSION, 'entries': self.entry_dict},
+                      index_file, indent=2, sort_keys=True)
+        os.replace(index_path + '.tmp', index_path)
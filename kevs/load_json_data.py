@@ -29,3 +29,191 @@ def load_json_directory(team_name: str, output_directory: str):
                 json_dict[file_name] = json_data
 
     return json_dict
+
+
+# SDF files at least this large are parsed incrementally, one instance at a time
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+STREAMING_CHUNK_SIZE = 1024 * 1024
+json_decoder = json.JSONDecoder()
+
+
+class JSONStreamReader:
+    """
+    Incremental reader for a JSON document. Values are decoded one at a time with
+    json.JSONDecoder.raw_decode on a buffer that is refilled from the file when needed, so only
+    the value currently being decoded is held in memory.
+    """
+
+    def __init__(self, json_file, chunk_size=STREAMING_CHUNK_SIZE):
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill_buffer(self, size: int) -> bool:
+        """
+        Drops the consumed part of the buffer and appends the next size characters of the file.
+        Returns False at the end of the file
+        """
+        if self.eof:
+            return False
+        data = self.json_file.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns the next character without consuming it ('' at the end)
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill_buffer(self.chunk_size):
+                return ''
+
+    def expect(self, token: str) -> None:
+        if self.peek() != token:
+            raise ValueError("Malformed JSON: expected '{}' but found '{}'".format(
+                token, self.peek()))
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Decodes and returns the next complete JSON value
+        """
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = json_decoder.raw_decode(self.buffer, self.pos)
+                # A number or literal at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill_buffer(size)
+            size *= 2
+
+    def iter_object_keys(self):
+        """
+        Iterates over the keys of the next JSON object. The caller must consume the value of
+        each key (for example with read_value) before requesting the next key
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError("Malformed JSON: expected ',' or '}}' but found '{}'".format(
+                    separator))
+
+    def iter_array_items(self):
+        """
+        Iterates over the next JSON array, yielding each item as it is decoded
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError("Malformed JSON: expected ',' or ']' but found '{}'".format(
+                    separator))
+
+
+def list_json_directory(team_name: str, output_directory: str) -> list:
+    """
+    Lists the .json files of a team directory in the same order as load_json_directory
+    """
+    if output_directory.endswith('/'):
+        output_directory = output_directory[:-1]
+    directory_path = os.path.join(output_directory, team_name)
+    return [file_name for file_name in os.listdir(directory_path)
+            if file_name.endswith('.json') and (not file_name.startswith('.'))]
+
+
+def iter_json_directory(team_name: str, output_directory: str):
+    """
+    Generator version of load_json_directory that holds one file in memory at a time.
+
+    Yields:
+        file_name, json_data
+    """
+    if output_directory.endswith('/'):
+        output_directory = output_directory[:-1]
+    directory_path = os.path.join(output_directory, team_name)
+    for file_name in list_json_directory(team_name, output_directory):
+        yield file_name, load_json_file(directory_path, file_name)
+
+
+def read_sdf_header(file_path: str) -> dict:
+    """
+    Reads every top-level field of an SDF file except 'instances'. The instances are decoded
+    one at a time and discarded, so fields that come after the instances are also found
+    """
+    schema = dict()
+    with open(file_path) as json_file:
+        reader = JSONStreamReader(json_file)
+        for key in reader.iter_object_keys():
+            if key == 'instances':
+                for _ in reader.iter_array_items():
+                    pass
+            else:
+                schema[key] = reader.read_value()
+    return schema
+
+
+def iter_sdf_instances(directory_path: str, file_name: str,
+                       streaming_threshold=STREAMING_THRESHOLD_BYTES):
+    """
+    Yields the entries of the 'instances' list of an SDF file one at a time. Files smaller than
+    streaming_threshold are loaded at once; larger files are parsed incrementally so that only
+    the top-level fields and a single instance are in memory.
+    Args:
+        directory_path:
+        file_name:
+        streaming_threshold: file size in bytes at which incremental parsing is used
+
+    Yields:
+        schema, instance_schema where schema holds the top-level fields without 'instances'
+    """
+    file_path = os.path.join(directory_path, file_name)
+    if os.path.getsize(file_path) < streaming_threshold:
+        schema = load_json_file(directory_path, file_name)
+        # Release each instance once it has been handed out
+        instance_list = schema.pop('instances', [])
+        instance_list.reverse()
+        while instance_list:
+            yield schema, instance_list.pop()
+        return
+    schema = read_sdf_header(file_path)
+    with open(file_path) as json_file:
+        reader = JSONStreamReader(json_file)
+        for key in reader.iter_object_keys():
+            if key == 'instances':
+                for instance_schema in reader.iter_array_items():
+                    yield schema, instance_schema
+            else:
+                reader.read_value()
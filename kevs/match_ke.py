@@ -3,13 +3,110 @@ import os
 import re
 import numpy as np
 import networkx as nx
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 
-from kevs.qnode_libs import produce_qnode_pair_df, get_bulk_qnode_sim_scores, \
-    process_ta2_qnode_fields, process_annotation_qnode_fields
+from kevs.qnode_libs import produce_qnode_pair_union_df, get_bulk_qnode_sim_scores, \
+    process_ta2_qnode_fields, process_annotation_qnode_fields, select_qnode_sim_scores
+from kevs.qnode_sim_matrix import QnodeSimMatrix, QNODE_SIM_METRICS
+from kevs.ke_match_cache import KEMatchCache, get_ke_match_cache_key, KE_MATCH_CACHE_MAX_BYTES
 
 
-def get_graph_arg_metric_match(edge_df, sim_metric="topsim"):
+# Solvers of the minimum weight full matching of events and arguments
+MATCHING_BACKENDS = ["networkx", "scipy", "scipy_sparse"]
+
+
+def get_assignment_matches(ta2_codes, ann_codes, weights, shape, matching_backend="scipy",
+                           unmatched_weight=None):
+    """
+    Minimum weight full matching of a bipartite graph given by integer node codes, solved with
+    SciPy instead of networkx. Like nx.bipartite.minimum_weight_full_matching, every node of
+    the smaller side is matched, and an error is raised if no such matching exists
+    Args:
+        ta2_codes: TA2 node number of every edge
+        ann_codes: annotation node number of every edge
+        weights: weight of every edge. A repeated edge has the last weight
+        shape: tuple of the number of TA2 nodes and annotation nodes
+        matching_backend: "scipy" solves a dense cost matrix with linear_sum_assignment,
+            "scipy_sparse" solves a sparse biadjacency matrix with
+            min_weight_full_bipartite_matching
+        unmatched_weight: when given, nodes may also stay unmatched, each at this weight.
+            This is the full matching of the graph where every missing edge has this weight,
+            without the matched missing edges
+
+    Returns:
+        tuple of arrays with the TA2 and annotation node numbers of the matched edges
+    """
+    if matching_backend == "scipy":
+        # Missing edges can not be matched
+        cost = np.full(shape, np.inf if unmatched_weight is None else unmatched_weight)
+        cost[ta2_codes, ann_codes] = weights
+        ta2_matches, ann_matches = linear_sum_assignment(cost)
+        if unmatched_weight is not None:
+            has_edge = np.zeros(shape, dtype=bool)
+            has_edge[ta2_codes, ann_codes] = True
+            matched = has_edge[ta2_matches, ann_matches]
+            ta2_matches, ann_matches = ta2_matches[matched], ann_matches[matched]
+        return ta2_matches, ann_matches
+    elif matching_backend == "scipy_sparse":
+        # Keep the last weight of a repeated edge, since a sparse matrix adds them up
+        edge_codes = ta2_codes * shape[1] + ann_codes
+        last_edges = len(edge_codes) - 1 - np.unique(edge_codes[::-1], return_index=True)[1]
+        ta2_edge_codes = ta2_codes[last_edges]
+        ann_edge_codes = ann_codes[last_edges]
+        # Sparse weights must be nonzero. Shifting all weights keeps the same full matching
+        edge_weights = weights[last_edges] + 1
+        biadjacency_shape = shape
+        if unmatched_weight is not None:
+            # Every TA2 node gets an extra annotation node of its own. Matching the two leaves
+            # the TA2 node unmatched, and a full matching of the TA2 nodes always exists
+            ta2_edge_codes = np.r_[ta2_edge_codes, np.arange(shape[0])]
+            ann_edge_codes = np.r_[ann_edge_codes, shape[1] + np.arange(shape[0])]
+            edge_weights = np.r_[edge_weights, np.full(shape[0], unmatched_weight + 1.0)]
+            biadjacency_shape = (shape[0], shape[1] + shape[0])
+        biadjacency = csr_matrix((edge_weights, (ta2_edge_codes, ann_edge_codes)),
+                                 shape=biadjacency_shape)
+        ta2_matches, ann_matches = min_weight_full_bipartite_matching(biadjacency)
+        if unmatched_weight is not None:
+            matched = ann_matches < shape[1]
+            ta2_matches, ann_matches = ta2_matches[matched], ann_matches[matched]
+        return ta2_matches, ann_matches
+    raise ValueError("Unknown matching backend {}, options are {}".format(
+        matching_backend, MATCHING_BACKENDS))
+
+
+def get_assignment_match_df(edge_df, ta2_id_field, ann_id_field, weight_field,
+                            matching_backend="scipy"):
+    """
+    Minimum weight full matching of a bipartite graph given as an edge data frame, see
+    get_assignment_matches
+    Args:
+        edge_df: data frame with one row per edge
+        ta2_id_field: column of the TA2 node of the edges
+        ann_id_field: column of the annotation node of the edges
+        weight_field: column of the edge weights
+        matching_backend: "scipy" or "scipy_sparse"
+
+    Returns:
+        data frame with the ta2_id_field and ann_id_field of the matched edges
+    """
+    ta2_codes, ta2_ids = pd.factorize(edge_df[ta2_id_field])
+    ann_codes, ann_ids = pd.factorize(edge_df[ann_id_field])
+    ta2_matches, ann_matches = get_assignment_matches(
+        ta2_codes, ann_codes, edge_df[weight_field].to_numpy(dtype=np.float64),
+        (len(ta2_ids), len(ann_ids)), matching_backend)
+    return pd.DataFrame({ta2_id_field: ta2_ids[ta2_matches], ann_id_field: ann_ids[ann_matches]})
+
+
+def get_graph_arg_metric_match(edge_df, sim_metric="topsim", matching_backend="networkx"):
     sim_metric_trans = "{}_trans".format(sim_metric)
+    if matching_backend != "networkx":
+        arg_match_df = get_assignment_match_df(edge_df, "ta2_arg_id", "ann_arg_id",
+                                               sim_metric_trans, matching_backend)
+        return pd.merge(arg_match_df, edge_df[["ta2_arg_id", "ann_arg_id", sim_metric]],
+                        on=["ta2_arg_id", "ann_arg_id"], how="inner")
     arg_graph = nx.Graph()
     ta2_args = edge_df['ta2_arg_id'].unique().tolist()
     ann_args = edge_df['ann_arg_id'].unique().tolist()
@@ -49,7 +146,7 @@ def get_graph_arg_metric_match(edge_df, sim_metric="topsim"):
     return arg_match_df
 
 
-def get_graph_metric_match(ev_edge_df, sim_metric="topsim"):
+def get_graph_metric_match(ev_edge_df, sim_metric="topsim", matching_backend="networkx"):
     edge_df = ev_edge_df.copy()
     ev_graph = nx.Graph()
     ta2_ev = edge_df['ta2_ev_id'].unique().tolist()
@@ -63,6 +160,11 @@ def get_graph_metric_match(ev_edge_df, sim_metric="topsim"):
     edge_df.fillna(0, inplace=True)
     # There is only a minimum weight, so use 1-metric to get inverse
     edge_df["sim_metric_trans"] = 1 - edge_df[sim_metric]
+    if matching_backend != "networkx":
+        ev_match_df = get_assignment_match_df(edge_df, "ta2_ev_id", "ann_ev_id",
+                                              "sim_metric_trans", matching_backend)
+        return pd.merge(ev_match_df, edge_df[["ta2_ev_id", "ann_ev_id", sim_metric]],
+                        on=["ta2_ev_id", "ann_ev_id"], how="inner")
     ev_graph.add_weighted_edges_from(
         [(row['ta2_ev_id'], row['ann_ev_id'], row["sim_metric_trans"])
          for idx, row in edge_df.iterrows()],
@@ -94,28 +196,65 @@ def get_graph_metric_match(ev_edge_df, sim_metric="topsim"):
     return ev_match_df
 
 
-def match_graph_ke_elements(ev_edge_df):
-    ev_class_df = get_graph_metric_match(ev_edge_df, sim_metric="class")
-    ev_complex_df = get_graph_metric_match(ev_edge_df, sim_metric="complex")
-    ev_jc_df = get_graph_metric_match(ev_edge_df, sim_metric="jc")
-    ev_text_df = get_graph_metric_match(ev_edge_df, sim_metric="text")
-    ev_topsim_df = get_graph_metric_match(ev_edge_df, sim_metric="topsim")
-    ev_transe_df = get_graph_metric_match(ev_edge_df, sim_metric="transe")
-    ev_match_df = pd.merge(ev_class_df, ev_complex_df, on=["ta2_ev_id", "ann_ev_id"],
-                           how="outer")
-    ev_match_df = pd.merge(ev_match_df, ev_jc_df, on=["ta2_ev_id", "ann_ev_id"],
-                           how="outer")
-    ev_match_df = pd.merge(ev_match_df, ev_text_df, on=["ta2_ev_id", "ann_ev_id"],
-                           how="outer")
-    ev_match_df = pd.merge(ev_match_df, ev_topsim_df, on=["ta2_ev_id", "ann_ev_id"],
-                           how="outer")
-    ev_match_df = pd.merge(ev_match_df, ev_transe_df, on=["ta2_ev_id", "ann_ev_id"],
-                           how="outer")
-    ev_match_df = pd.merge(ev_match_df,
-                           ev_edge_df[["ta2_ev_id", "ann_ev_id", "schema_instance_id",
-                                       "ta2_team_name", "ta1_team_name",
-                                       "task", "ce_id", "ev_confidence"]],
-                           on=["ta2_ev_id", "ann_ev_id"], how="right")
+def match_graph_ke_elements(ev_edge_df, matching_backend="networkx", allow_unmatched=False):
+    """
+    Matches the TA2 events to the annotation events once for every similarity metric. The
+    candidate event pairs are indexed once and the matchings are solved over a stacked
+    (metric x TA2 event x annotation event) cost tensor, with the same results as running
+    get_graph_metric_match for every metric and merging the matches
+    Args:
+        ev_edge_df: data frame with one row per candidate event pair
+        matching_backend: solver of the matchings, one of MATCHING_BACKENDS
+        allow_unmatched: whether events may stay unmatched at the cost of a pair with a
+            similarity of 0, for sparse event graphs that leave out the pairs below a
+            similarity floor. Needs a SciPy matching backend
+
+    Returns:
+        data frame with the rows of ev_edge_df, where the similarity of every metric is kept
+        if the pair is matched for that metric and missing otherwise
+    """
+    ta2_codes, ta2_ev_ids = pd.factorize(ev_edge_df['ta2_ev_id'])
+    ann_codes, ann_ev_ids = pd.factorize(ev_edge_df['ann_ev_id'])
+    shape = (len(ta2_ev_ids), len(ann_ev_ids))
+    # All missing weights have value 0
+    sim_values = ev_edge_df.loc[:, QNODE_SIM_METRICS].fillna(0).to_numpy(dtype=np.float64)
+    # There is only a minimum weight, so use 1-metric to get inverse
+    cost_values = 1 - sim_values
+
+    is_matched = np.zeros((len(QNODE_SIM_METRICS),) + shape, dtype=bool)
+    if matching_backend == "networkx":
+        if allow_unmatched:
+            raise ValueError("Matching with unmatched events needs a SciPy matching backend")
+        ev_graph = nx.Graph()
+        ev_graph.add_nodes_from(range(shape[0]), bipartite=0)
+        ev_graph.add_nodes_from(range(shape[0], shape[0] + shape[1]), bipartite=1)
+        ev_graph.add_edges_from(
+            (ta2_code, shape[0] + ann_code, dict(zip(QNODE_SIM_METRICS, edge_costs)))
+            for ta2_code, ann_code, edge_costs in zip(ta2_codes.tolist(), ann_codes.tolist(),
+                                                      cost_values.tolist()))
+        for metric_index, sim_metric in enumerate(QNODE_SIM_METRICS):
+            ev_matching = nx.bipartite.minimum_weight_full_matching(
+                ev_graph, top_nodes=range(shape[0]), weight=sim_metric)
+            ta2_matches = np.array([node for node in ev_matching if node < shape[0]],
+                                   dtype=np.int64)
+            ann_matches = np.array([ev_matching[node] - shape[0] for node in ta2_matches],
+                                   dtype=np.int64)
+            is_matched[metric_index, ta2_matches, ann_matches] = True
+    else:
+        for metric_index in range(len(QNODE_SIM_METRICS)):
+            ta2_matches, ann_matches = get_assignment_matches(
+                ta2_codes, ann_codes, cost_values[:, metric_index], shape, matching_backend,
+                unmatched_weight=1.0 if allow_unmatched else None)
+            is_matched[metric_index, ta2_matches, ann_matches] = True
+
+    edge_is_matched = is_matched[:, ta2_codes, ann_codes].T
+    ev_match_df = ev_edge_df.loc[:, ["ta2_ev_id", "ann_ev_id"]].reset_index(drop=True)
+    ev_match_df[QNODE_SIM_METRICS] = np.where(edge_is_matched, sim_values, np.nan)
+    ev_match_df = pd.concat([ev_match_df,
+                             ev_edge_df.loc[:, ["schema_instance_id", "ta2_team_name",
+                                                "ta1_team_name", "task", "ce_id",
+                                                "ev_confidence"]].reset_index(drop=True)],
+                            axis=1)
     return ev_match_df
 
 
@@ -137,26 +276,27 @@ def score_ke_elements(ta2_ceinstance, task_str, ev_match_df):
                                   'recall_complex': 0, 'recall_jc': 0, 'recall_text': 0,
                                   'recall_topsim': 0, 'recall_transe': 0}])
     if ev_match_df.shape[0] != 0:
+        # Team, task and ce_id are categorical, only their observed combinations are scored
         ke_precision_pivot = pd.pivot_table(ev_match_df,
                                             values=['class', 'complex', 'jc', 'text',
                                                     'topsim', 'transe'],
                                             index=['schema_instance_id', 'ta1_team_name',
                                                    'ta2_team_name', "task", "ce_id", 'ta2_ev_id'],
-                                            aggfunc=np.max)
+                                            observed=True, aggfunc=np.max)
 
         ke_recall_pivot = pd.pivot_table(ev_match_df,
                                          values=['class', 'complex', 'jc',
                                                  'text', 'topsim', 'transe'],
                                          index=['schema_instance_id', 'ta1_team_name',
                                                 'ta2_team_name', "task", "ce_id", 'ann_ev_id'],
-                                         aggfunc=np.max)
+                                         observed=True, aggfunc=np.max)
 
         ke_precision_df = pd.pivot_table(ke_precision_pivot,
                                          values=['class', 'complex', 'jc',
                                                  'text', 'topsim', 'transe'],
                                          index=['schema_instance_id', 'ta1_team_name',
                                                 'ta2_team_name', "task", "ce_id", ],
-                                         aggfunc=np.sum).reset_index()
+                                         observed=True, aggfunc=np.sum).reset_index()
         # Divide by number of TA2 events
         ke_precision_df.loc[:, ['class', 'complex', 'jc', 'text', 'topsim', 'transe']] = \
             ke_precision_df.loc[:, ['class', 'complex', 'jc', 'text',
@@ -166,7 +306,7 @@ def score_ke_elements(ta2_ceinstance, task_str, ev_match_df):
                                       values=['class', 'complex', 'jc', 'text', 'topsim', 'transe'],
                                       index=['schema_instance_id', 'ta1_team_name',
                                              'ta2_team_name', "task", "ce_id", ],
-                                      aggfunc=np.sum).reset_index()
+                                      observed=True, aggfunc=np.sum).reset_index()
 
         ke_recall_df.loc[:, ['class', 'complex', 'jc', 'text', 'topsim', 'transe']] = \
             ke_recall_df.loc[:, ['class', 'complex', 'jc',
@@ -210,143 +350,406 @@ def score_ke_elements(ta2_ceinstance, task_str, ev_match_df):
     return ke_score_df
 
 
+# Columns of an instance in the KE scores
+KE_SCORE_KEY_COLUMNS = ['schema_instance_id', 'ta1_team_name', 'ta2_team_name', 'task', 'ce_id']
+
+
+def get_id_max_sums(instance_codes, id_codes, metric_values, num_instances):
+    """
+    Sums over the ids of every instance of the maximum metric values of the id, which is what
+    score_ke_elements computes with a max and a sum pivot table. Rows of the ids of an
+    instance are made contiguous in id code order, so that the maxima are reduced with
+    np.fmax.reduceat and summed in the order of the pivot table. Like the pivot tables, ids
+    with no value of any metric are left out, and missing values count as 0 in the sums
+    Args:
+        instance_codes: instance number of every row, -1 for rows without an instance
+        id_codes: id number of every row in sorted id order, -1 for rows without an id
+        metric_values: (num_rows x num_metrics) array of the metric values
+        num_instances: number of instances
+
+    Returns:
+        tuple of a boolean array of the instances that have ids, and a
+        (num_instances x num_metrics) array of the sums
+    """
+    sums = np.zeros((num_instances, metric_values.shape[1]))
+    has_ids = np.zeros(num_instances, dtype=bool)
+    valid = (instance_codes >= 0) & (id_codes >= 0)
+    instance_codes = instance_codes[valid]
+    id_codes = id_codes[valid]
+    order = np.lexsort((id_codes, instance_codes))
+    instance_codes = instance_codes[order]
+    id_codes = id_codes[order]
+    if len(order) == 0:
+        return has_ids, sums
+    starts = np.flatnonzero(np.r_[True, (instance_codes[1:] != instance_codes[:-1]) |
+                                  (id_codes[1:] != id_codes[:-1])])
+    id_max = np.fmax.reduceat(metric_values[valid][order], starts, axis=0)
+    id_instance_codes = instance_codes[starts]
+    has_value = ~np.isnan(id_max).all(axis=1)
+    id_max = np.where(np.isnan(id_max[has_value]), 0, id_max[has_value])
+    id_instance_codes = id_instance_codes[has_value]
+    instance_starts = np.flatnonzero(np.r_[True, id_instance_codes[1:] != id_instance_codes[:-1]])
+    instance_ends = np.r_[instance_starts[1:], len(id_instance_codes)]
+    for start, end in zip(instance_starts, instance_ends):
+        # Each metric is summed as one contiguous row, the order np.sum adds a group in
+        sums[id_instance_codes[start]] = np.ascontiguousarray(id_max[start:end].T).sum(axis=1)
+        has_ids[id_instance_codes[start]] = True
+    return has_ids, sums
+
+
+def score_ke_element_sets(ta2_ceinstance, task_str, ev_match_df_list, id_count_list=None):
+    """
+    Scores several sets of matched events of a TA2 CE instance, with the same results as
+    calling score_ke_elements on each. The event ids are coded as integers and the maxima and
+    sums are reduced with NumPy instead of pivot tables
+    Args:
+        ta2_ceinstance:
+        task_str:
+        ev_match_df_list: list of event match data frames, such as the ev_graph_df,
+            ev_graph_large_df, ev_match_df and ev_match_large_df of match_ke_ce_elements
+        id_count_list: optional list with the numbers of TA2 and annotation events that divide
+            the scores of every event match data frame, for sparse event graphs that leave out
+            event pairs, see get_ke_id_counts. By default the events of the data frame
+
+    Returns:
+        list with the score data frame of every event match data frame
+    """
+    ke_score_df_list = []
+    for list_index, ev_match_df in enumerate(ev_match_df_list):
+        if ev_match_df.shape[0] == 0:
+            # Scores of 0 and the warning
+            ke_score_df_list.append(score_ke_elements(ta2_ceinstance, task_str, ev_match_df))
+            continue
+        instance_grouper = ev_match_df.groupby(KE_SCORE_KEY_COLUMNS, observed=True)
+        instance_codes = instance_grouper.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        instance_key_df = instance_grouper.size().index.to_frame(index=False)
+        metric_values = ev_match_df.loc[:, QNODE_SIM_METRICS].to_numpy(dtype=float,
+                                                                       na_value=np.nan)
+        has_id_list = []
+        score_list = []
+        for id_index, id_field in enumerate(['ta2_ev_id', 'ann_ev_id']):
+            id_codes, id_values = pd.factorize(ev_match_df[id_field], sort=True)
+            has_ids, sums = get_id_max_sums(instance_codes, id_codes, metric_values,
+                                            instance_key_df.shape[0])
+            has_id_list.append(has_ids)
+            # Divide by the number of TA2 or annotation events
+            num_ids = len(id_values) if id_count_list is None \
+                else id_count_list[list_index][id_index]
+            score_list.append(sums / num_ids)
+        precision_columns = ['precision_{}'.format(metric) for metric in QNODE_SIM_METRICS]
+        recall_columns = ['recall_{}'.format(metric) for metric in QNODE_SIM_METRICS]
+        if np.array_equal(has_id_list[0], has_id_list[1]) and np.sum(has_id_list[0]) == 1:
+            # The precision and recall of a single instance are the columns of one row
+            has_ids = has_id_list[0]
+            ke_score_df = pd.concat(
+                [instance_key_df.loc[has_ids, :].reset_index(drop=True),
+                 pd.DataFrame(np.hstack([score_list[0][has_ids], score_list[1][has_ids]]),
+                              columns=precision_columns + recall_columns)], axis=1)
+        else:
+            ke_score_df = pd.merge(
+                pd.concat([instance_key_df.loc[has_id_list[0], :].reset_index(drop=True),
+                           pd.DataFrame(score_list[0][has_id_list[0]],
+                                        columns=precision_columns)], axis=1),
+                pd.concat([instance_key_df.loc[has_id_list[1], :].reset_index(drop=True),
+                           pd.DataFrame(score_list[1][has_id_list[1]],
+                                        columns=recall_columns)], axis=1),
+                how="outer")
+        precision = ke_score_df.loc[:, precision_columns].to_numpy()
+        recall = ke_score_df.loc[:, recall_columns].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            f1 = 2 * (precision * recall) / (precision + recall)
+        ke_score_df = pd.concat(
+            [ke_score_df, pd.DataFrame(f1, columns=['f1_{}'.format(metric)
+                                                    for metric in QNODE_SIM_METRICS])], axis=1)
+        ke_score_df_list.append(ke_score_df)
+    return ke_score_df_list
+
+
+def get_arg_assignment_sums(arg_sim_block, has_edge):
+    """
+    Matches the TA2 arguments of an event to the annotation arguments of an event once per
+    similarity metric, maximizing the summed similarity, like get_graph_arg_metric_match
+    Args:
+        arg_sim_block: (num_metrics x num_ta2_args x num_ann_args) array of similarities
+        has_edge: (num_ta2_args x num_ann_args) boolean array of the candidate argument pairs
+
+    Returns:
+        array with the summed similarity of the matched argument pairs of every metric
+    """
+    arg_sums = np.zeros(arg_sim_block.shape[0])
+    if not has_edge.any():
+        return arg_sums
+    num_matches = min(has_edge.shape)
+    for metric_index, metric_block in enumerate(arg_sim_block):
+        # Missing pairs cost more than any full matching of candidate pairs, so they are only
+        # used where no full matching exists, and add nothing to the sums. Similarities may
+        # be negative, so the bound is taken from the candidate costs
+        edge_costs = 1 - metric_block[has_edge]
+        missing_cost = num_matches * (edge_costs.max() - edge_costs.min()) + \
+            abs(edge_costs.min()) + 1
+        cost = np.where(has_edge, 1 - metric_block, missing_cost)
+        ta2_matches, ann_matches = linear_sum_assignment(cost)
+        matched = has_edge[ta2_matches, ann_matches]
+        arg_sums[metric_index] = metric_block[ta2_matches[matched], ann_matches[matched]].sum()
+    return arg_sums
+
+
 # @profile
-def get_ev_arg_sim(qnode_arg_match_df):
+def get_ev_arg_sim(qnode_arg_match_df, candidate_pair_df=None):
     """
+    Argument similarity of every pair of TA2 and annotation events. The arguments of the two
+    events are matched with a linear assignment for each similarity metric, and the summed
+    similarity of the matched arguments is normalized by the number of argument slots and
+    arguments of the events
+    Args:
+        qnode_arg_match_df: data frame of the candidate argument pairs, with columns
+            ta2_ev_id, ann_ev_id, ta2_arg_id, ann_arg_id, arg_num and the similarity metrics
+        candidate_pair_df: optional data frame with the ta2_ev_id and ann_ev_id of the event
+            pairs to compute, see get_arg_candidate_pair_df. The argument counts of the events
+            are still taken from all of qnode_arg_match_df
 
+    Returns:
+        data frame with ta2_ev_id, ann_ev_id, num_ta2_args, num_ann_args, num_ann_arg_slots
+        and the similarity metrics of the arguments as class_arg, complex_arg, jc_arg,
+        text_arg, topsim_arg and transe_arg
+    """
+    arg_sim_columns = ["{}_arg".format(metric) for metric in QNODE_SIM_METRICS]
+    # Events with id 0 are provided to give the extra arguments that are not linked
+    ta2_ev_ids = pd.unique(qnode_arg_match_df['ta2_ev_id'])
+    ta2_ev_ids = ta2_ev_ids[~(ta2_ev_ids == 0)]
+    ann_ev_ids = pd.unique(qnode_arg_match_df['ann_ev_id'])
+    ann_ev_ids = ann_ev_ids[~(ann_ev_ids == 0)]
+    num_ta2_ev = len(ta2_ev_ids)
+    num_ann_ev = len(ann_ev_ids)
+    if num_ta2_ev == 0 or num_ann_ev == 0:
+        return pd.DataFrame(columns=['ta2_ev_id', 'ann_ev_id', 'num_ta2_args', 'num_ann_args',
+                                     'num_ann_arg_slots'] + arg_sim_columns)
+
+    # Argument counts of every event, and the events of every pair in loop order
+    num_ta2_args = qnode_arg_match_df.groupby('ta2_ev_id', sort=False)['ta2_arg_id'].\
+        nunique().reindex(ta2_ev_ids).to_numpy()
+    ann_count_df = qnode_arg_match_df.groupby('ann_ev_id', sort=False).\
+        agg(num_ann_args=('ann_arg_id', 'nunique'), num_ann_arg_slots=('arg_num', 'nunique')).\
+        reindex(ann_ev_ids)
+    ta2_pair_codes = np.repeat(np.arange(num_ta2_ev), num_ann_ev)
+    ann_pair_codes = np.tile(np.arange(num_ann_ev), num_ta2_ev)
+    arg_sim_df = pd.DataFrame({'ta2_ev_id': ta2_ev_ids[ta2_pair_codes],
+                               'ann_ev_id': ann_ev_ids[ann_pair_codes],
+                               'num_ta2_args': num_ta2_args[ta2_pair_codes],
+                               'num_ann_args':
+                                   ann_count_df['num_ann_args'].to_numpy()[ann_pair_codes],
+                               'num_ann_arg_slots':
+                                   ann_count_df['num_ann_arg_slots'].to_numpy()[ann_pair_codes]})
+
+    is_candidate = np.ones(arg_sim_df.shape[0], dtype=bool)
+    if candidate_pair_df is not None:
+        candidate_ta2_codes = pd.Index(ta2_ev_ids).get_indexer(candidate_pair_df['ta2_ev_id'])
+        candidate_ann_codes = pd.Index(ann_ev_ids).get_indexer(candidate_pair_df['ann_ev_id'])
+        in_pair = (candidate_ta2_codes >= 0) & (candidate_ann_codes >= 0)
+        is_candidate[:] = False
+        is_candidate[candidate_ta2_codes[in_pair] * num_ann_ev +
+                     candidate_ann_codes[in_pair]] = True
+
+    # Group the candidate argument pairs once by event pair
+    edge_df = qnode_arg_match_df.loc[(qnode_arg_match_df['ta2_arg_id'] != 0) &
+                                     (qnode_arg_match_df['ann_arg_id'] != 0), :]
+    ta2_codes = pd.Index(ta2_ev_ids).get_indexer(edge_df['ta2_ev_id'])
+    ann_codes = pd.Index(ann_ev_ids).get_indexer(edge_df['ann_ev_id'])
+    in_pair = (ta2_codes >= 0) & (ann_codes >= 0)
+    edge_pair_codes = ta2_codes[in_pair] * num_ann_ev + ann_codes[in_pair]
+    edge_df = edge_df.loc[in_pair, :].assign(pair_code=edge_pair_codes)
+    edge_df = edge_df.loc[is_candidate[edge_pair_codes], :]
+    edge_df = edge_df.sort_values('pair_code', kind='stable')
+    pair_codes = edge_df['pair_code'].to_numpy()
+    # Argument numbers within an event pair
+    ta2_arg_codes = edge_df.groupby(['pair_code', 'ta2_arg_id'], sort=False).ngroup().to_numpy()
+    ann_arg_codes = edge_df.groupby(['pair_code', 'ann_arg_id'], sort=False).ngroup().to_numpy()
+    arg_sim_values = edge_df.loc[:, QNODE_SIM_METRICS].to_numpy(dtype=np.float64).T
+    pair_starts = np.flatnonzero(np.r_[True, pair_codes[1:] != pair_codes[:-1]]) \
+        if len(pair_codes) > 0 else np.array([], dtype=np.int64)
+    pair_ends = np.r_[pair_starts[1:], len(pair_codes)]
+
+    arg_sums = np.zeros((arg_sim_df.shape[0], len(QNODE_SIM_METRICS)))
+    for pair_start, pair_end in zip(pair_starts, pair_ends):
+        block_ta2_codes = ta2_arg_codes[pair_start:pair_end]
+        block_ta2_codes = block_ta2_codes - block_ta2_codes.min()
+        block_ann_codes = ann_arg_codes[pair_start:pair_end]
+        block_ann_codes = block_ann_codes - block_ann_codes.min()
+        block_shape = (block_ta2_codes.max() + 1, block_ann_codes.max() + 1)
+        arg_sim_block = np.zeros((len(QNODE_SIM_METRICS),) + block_shape)
+        arg_sim_block[:, block_ta2_codes, block_ann_codes] = \
+            arg_sim_values[:, pair_start:pair_end]
+        has_edge = np.zeros(block_shape, dtype=bool)
+        has_edge[block_ta2_codes, block_ann_codes] = True
+        arg_sums[pair_codes[pair_start], :] = get_arg_assignment_sums(arg_sim_block, has_edge)
+
+    arg_sim_df[arg_sim_columns] = get_arg_sims(arg_sums, arg_sim_df['num_ta2_args'].to_numpy(),
+                                               arg_sim_df['num_ann_args'].to_numpy(),
+                                               arg_sim_df['num_ann_arg_slots'].to_numpy())
+    return arg_sim_df.loc[is_candidate, ['ta2_ev_id', 'ann_ev_id', 'num_ta2_args',
+                                         'num_ann_args', 'num_ann_arg_slots', 'class_arg',
+                                         'complex_arg', 'jc_arg', 'text_arg', 'topsim_arg',
+                                         'transe_arg']].reset_index(drop=True)
+
+
+def get_arg_sims(arg_sums, num_ta2, num_ann, num_slots):
+    """
+    Argument similarities of event pairs from the summed similarity of their matched
+    arguments, normalized by the number of argument slots and arguments of the events
     Args:
-        qnode_arg_match_df:
+        arg_sums: (num_pairs x num_metrics) array of the summed similarities
+        num_ta2: number of TA2 arguments of every pair
+        num_ann: number of annotation arguments of every pair
+        num_slots: number of annotation argument slots of every pair
 
     Returns:
+        (num_pairs x num_metrics) array of the argument similarities
+    """
+    # If we have fewer ta2_args than the unique arg, we punish them
+    # Here the ta2 arguments have extra arguments in the last case
+    divisor = np.select([num_ta2 <= num_slots, num_ta2 <= num_ann], [num_slots, num_ta2],
+                        num_ann).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        arg_sims = arg_sums / divisor[:, None]
+        arg_sims = np.where((num_ta2 > num_ann)[:, None],
+                            arg_sims * (num_ann / num_ta2)[:, None], arg_sims)
+    # If no annotation arguments, give a score of 1, and 0 if no ta2_arguments instantiated
+    arg_sims[num_ta2 == 0, :] = 0.0
+    arg_sims[num_ann == 0, :] = 1.0
+    return arg_sims
+
+
+def get_sparse_ev_arg_sim(arg_sim, candidate_pair_df=None):
+    """
+    get_ev_arg_sim of sparse argument similarities. The arguments of an event pair are matched
+    over all of their scored pairs, where the pairs below the similarity floor have a
+    similarity of 0, so that the matched sums are those of get_ev_arg_sim. The argument counts
+    of the events are taken from the scored pairs, like the rows of qnode_arg_match_df
+    Args:
+        arg_sim: SparseSegmentSim of QnodeSimMatrix.get_sparse_segment_sim, with TA2
+            segments keyed by ta2_ev_id and ta2_arg_id, and annotation segments keyed by
+            ann_ev_id, ann_arg_id and arg_num
+        candidate_pair_df: see get_ev_arg_sim
 
+    Returns:
+        data frame with the columns of get_ev_arg_sim, for the event pairs that have an
+        argument pair above the similarity floor. The other pairs have a similarity of 0
+    """
+    arg_sim_columns = ["{}_arg".format(metric) for metric in QNODE_SIM_METRICS]
+    pair_matrix = arg_sim.pair_matrix
+    ta2_segment_df = arg_sim.q1_segment_df
+    ann_segment_df = arg_sim.q2_segment_df
+    # Segments are sorted by event, so the arguments of an event are a range of segments
+    ta2_ev_codes, ta2_ev_ids = pd.factorize(ta2_segment_df['ta2_ev_id'])
+    ann_ev_codes, ann_ev_ids = pd.factorize(ann_segment_df['ann_ev_id'])
+    ta2_ev_starts = np.searchsorted(ta2_ev_codes, np.arange(len(ta2_ev_ids) + 1))
+    ann_ev_starts = np.searchsorted(ann_ev_codes, np.arange(len(ann_ev_ids) + 1))
+    has_ta2_pair = np.diff(pair_matrix.indptr) > 0
+    has_ann_pair = np.bincount(pair_matrix.indices, minlength=ann_segment_df.shape[0]) > 0
+    num_ta2_args = ta2_segment_df.loc[has_ta2_pair, :].groupby('ta2_ev_id', sort=False)[
+        'ta2_arg_id'].nunique().reindex(ta2_ev_ids, fill_value=0).to_numpy()
+    ann_count_df = ann_segment_df.loc[has_ann_pair, :].groupby('ann_ev_id', sort=False).\
+        agg(num_ann_args=('ann_arg_id', 'nunique'), num_ann_arg_slots=('arg_num', 'nunique')).\
+        reindex(ann_ev_ids, fill_value=0)
+
+    # Argument pairs above the floor, grouped by event pair
+    sim_df = arg_sim.sim_df
+    ta2_segments = sim_df['q1_segment'].to_numpy()
+    ann_segments = sim_df['q2_segment'].to_numpy()
+    edge_pair_codes = ta2_ev_codes[ta2_segments] * len(ann_ev_ids) + ann_ev_codes[ann_segments]
+    if candidate_pair_df is not None:
+        candidate_ta2_codes = pd.Index(ta2_ev_ids).get_indexer(candidate_pair_df['ta2_ev_id'])
+        candidate_ann_codes = pd.Index(ann_ev_ids).get_indexer(candidate_pair_df['ann_ev_id'])
+        in_pair = (candidate_ta2_codes >= 0) & (candidate_ann_codes >= 0)
+        is_candidate = np.isin(edge_pair_codes, candidate_ta2_codes[in_pair] * len(ann_ev_ids) +
+                               candidate_ann_codes[in_pair])
+    else:
+        is_candidate = np.ones(len(edge_pair_codes), dtype=bool)
+    edge_order = np.flatnonzero(is_candidate)[
+        np.argsort(edge_pair_codes[is_candidate], kind='stable')]
+    pair_codes = edge_pair_codes[edge_order]
+    ta2_segments = ta2_segments[edge_order]
+    ann_segments = ann_segments[edge_order]
+    # All missing weights have value 0
+    arg_sim_values = np.nan_to_num(
+        sim_df.loc[:, QNODE_SIM_METRICS].to_numpy(dtype=np.float64)[edge_order].T)
+    pair_starts = np.flatnonzero(np.r_[True, pair_codes[1:] != pair_codes[:-1]]) \
+        if len(pair_codes) > 0 else np.array([], dtype=np.int64)
+    pair_ends = np.r_[pair_starts[1:], len(pair_codes)]
+
+    arg_sums = np.zeros((len(pair_starts), len(QNODE_SIM_METRICS)))
+    for pair_index, (pair_start, pair_end) in enumerate(zip(pair_starts, pair_ends)):
+        ta2_code, ann_code = divmod(pair_codes[pair_start], len(ann_ev_ids))
+        ta2_start, ta2_end = ta2_ev_starts[ta2_code], ta2_ev_starts[ta2_code + 1]
+        ann_start, ann_end = ann_ev_starts[ann_code], ann_ev_starts[ann_code + 1]
+        # The scored argument pairs of the events, without the arguments that have none
+        has_edge = pair_matrix[ta2_start:ta2_end, ann_start:ann_end].toarray()
+        arg_sim_block = np.zeros((len(QNODE_SIM_METRICS),) + has_edge.shape)
+        arg_sim_block[:, ta2_segments[pair_start:pair_end] - ta2_start,
+                      ann_segments[pair_start:pair_end] - ann_start] = \
+            arg_sim_values[:, pair_start:pair_end]
+        ta2_rows = has_edge.any(axis=1)
+        ann_columns = has_edge.any(axis=0)
+        arg_sums[pair_index, :] = get_arg_assignment_sums(
+            arg_sim_block[:, ta2_rows, :][:, :, ann_columns],
+            has_edge[ta2_rows, :][:, ann_columns])
+
+    ta2_pair_codes, ann_pair_codes = np.divmod(pair_codes[pair_starts], len(ann_ev_ids))
+    arg_sim_df = pd.DataFrame({'ta2_ev_id': ta2_ev_ids[ta2_pair_codes],
+                               'ann_ev_id': ann_ev_ids[ann_pair_codes],
+                               'num_ta2_args': num_ta2_args[ta2_pair_codes],
+                               'num_ann_args':
+                                   ann_count_df['num_ann_args'].to_numpy()[ann_pair_codes],
+                               'num_ann_arg_slots':
+                                   ann_count_df['num_ann_arg_slots'].to_numpy()[ann_pair_codes]})
+    arg_sim_df[arg_sim_columns] = get_arg_sims(arg_sums, arg_sim_df['num_ta2_args'].to_numpy(),
+                                               arg_sim_df['num_ann_args'].to_numpy(),
+                                               arg_sim_df['num_ann_arg_slots'].to_numpy())
+    return arg_sim_df
+
+
+def get_arg_candidate_pair_df(qnode_match_df, top_k=None, min_similarity=None):
     """
-    # Make data frame with ta2_ev_id, ann_ev_id, each of the six sim scores
+    Event pairs whose arguments are worth matching, judged by the similarity of the events
+    alone. A pair is kept when, for at least one similarity metric, the annotation event is one
+    of the top_k annotation events of the TA2 event (counting ties), and when at least one
+    metric is min_similarity or more. Pairs that are left out get an argument similarity of 0
+    Args:
+        qnode_match_df: data frame with ta2_ev_id, ann_ev_id and the event similarity metrics
+        top_k: number of annotation candidates of a TA2 event, None keeps all
+        min_similarity: similarity floor, None keeps all
 
-    # now loop over each event
-    # If need to speed up, try something else besides a double foor loop
-    rows = []
-    # arg_match_df = pd.DataFrame(columns = df_columns)
-    # qnode_arg_match_df.drop(columns=["q1","q2",'q1_label','q2_label'], inplace=True)
-    for ta2_ev in qnode_arg_match_df['ta2_ev_id'].unique().tolist():
-        # We do not want to deal with the missing events
-        # Which are provided to give the extra arguments that are not linked
-        if ta2_ev == 0:
-            continue
-        for ann_ev in qnode_arg_match_df['ann_ev_id'].unique().tolist():
-            # We do not want to deal with the missing events
-            # Which are provided to give the extra arguments that are not linked
-            if ann_ev == 0:
-                continue
-            filt_df = qnode_arg_match_df.loc[(qnode_arg_match_df['ta2_ev_id'] == ta2_ev) &
-                                             (qnode_arg_match_df['ann_ev_id'] == ann_ev), :]
-            filt_df = filt_df.loc[(filt_df['ta2_arg_id'] != 0) & (filt_df['ann_arg_id'] != 0), :]
-            ta2_args = \
-                qnode_arg_match_df.loc[(qnode_arg_match_df['ta2_ev_id'] == ta2_ev), :][
-                    'ta2_arg_id'].unique().tolist()
-            num_ta2_args = len(ta2_args)
-            ann_arg_df = qnode_arg_match_df.loc[(qnode_arg_match_df['ann_ev_id'] == ann_ev), :]
-            ann_args = ann_arg_df['ann_arg_id'].unique().tolist()
-            num_ann_args = len(ann_args)
-            num_ann_arg_nums = len(ann_arg_df['arg_num'].unique().tolist())
-            # If no annotation arguments, give a score of 1
-            if num_ann_args == 0:
-                row_dict = {'ta2_ev_id': ta2_ev, 'ann_ev_id': ann_ev,
-                            'num_ta2_args': num_ta2_args,
-                            'num_ann_args': num_ann_args,
-                            'num_ann_arg_slots': num_ann_arg_nums,
-                            'class_arg': 1.0,
-                            'complex_arg': 1.0,
-                            'jc_arg': 1.0,
-                            'text_arg': 1.0,
-                            'topsim_arg': 1.0,
-                            'transe_arg': 1.0}
-                rows.append(row_dict)
-                # arg_match_df = pd.concat([arg_match_df, row_df], ignore_index=True)
-                continue
-            # Add all 0's if no ta2_arguments instantiated
-            elif num_ta2_args == 0:
-                row_dict = {'ta2_ev_id': ta2_ev, 'ann_ev_id': ann_ev,
-                            'num_ta2_args': num_ta2_args,
-                            'num_ann_args': num_ann_args,
-                            'num_ann_arg_slots': num_ann_arg_nums,
-                            'class_arg': 0.0,
-                            'complex_arg': 0.0,
-                            'jc_arg': 0.0,
-                            'text_arg': 0.0,
-                            'topsim_arg': 0.0,
-                            'transe_arg': 0.0}
-                rows.append(row_dict)
-                continue
-            # Else, we are here
-            filt_df["class_trans"] = 1 - filt_df["class"]
-            filt_df["complex_trans"] = 1 - filt_df["complex"]
-            filt_df["jc_trans"] = 1 - filt_df["jc"]
-            filt_df["text_trans"] = 1 - filt_df["text"]
-            filt_df["transe_trans"] = 1 - filt_df["transe"]
-            filt_df["topsim_trans"] = 1 - filt_df["topsim"]
-            class_df = get_graph_arg_metric_match(filt_df, sim_metric="class")
-            complex_df = get_graph_arg_metric_match(filt_df, sim_metric="complex")
-            jc_df = get_graph_arg_metric_match(filt_df, sim_metric="jc")
-            text_df = get_graph_arg_metric_match(filt_df, sim_metric="text")
-            topsim_df = get_graph_arg_metric_match(filt_df, sim_metric="topsim")
-            transe_df = get_graph_arg_metric_match(filt_df, sim_metric="transe")
-            match_df = pd.merge(class_df, complex_df, on=["ta2_arg_id", "ann_arg_id"],
-                                how="outer")
-            match_df = pd.merge(match_df, jc_df, on=["ta2_arg_id", "ann_arg_id"],
-                                how="outer")
-            match_df = pd.merge(match_df, text_df, on=["ta2_arg_id", "ann_arg_id"],
-                                how="outer")
-            match_df = pd.merge(match_df, topsim_df, on=["ta2_arg_id", "ann_arg_id"],
-                                how="outer")
-            match_df = pd.merge(match_df, transe_df, on=["ta2_arg_id", "ann_arg_id"],
-                                how="outer")
-            recall_df = match_df.loc[:, ['class', 'complex', 'jc', 'text', 'topsim',
-                                         'transe']].sum()
-            # If we have fewer ta2_args than the unique arg, we punish them
-            if num_ta2_args <= num_ann_arg_nums:
-                recall_df = recall_df / num_ann_arg_nums
-            elif num_ann_arg_nums < num_ta2_args <= num_ann_args:
-                recall_df = recall_df / num_ta2_args
-            # Here the ta2 arguments have extra arguments
-            else:
-                recall_df = recall_df / num_ann_args
-
-            if num_ta2_args > num_ann_args:
-                recall_df = recall_df * (num_ann_args / num_ta2_args)
-
-            row_dict = {'ta2_ev_id': ta2_ev, 'ann_ev_id': ann_ev,
-                        'num_ta2_args': num_ta2_args,
-                        'num_ann_args': num_ann_args,
-                        'num_ann_arg_slots': num_ann_arg_nums,
-                        'class_arg': recall_df['class'],
-                        'complex_arg': recall_df['complex'],
-                        'jc_arg': recall_df['jc'],
-                        'text_arg': recall_df['text'],
-                        'topsim_arg': recall_df['topsim'],
-                        'transe_arg': recall_df['transe']}
-            rows.append(row_dict)
-            del filt_df, match_df, class_df, complex_df, jc_df, text_df, topsim_df, transe_df
-    arg_match_df = pd.DataFrame(rows)
-    return arg_match_df
+    Returns:
+        data frame with the ta2_ev_id and ann_ev_id of the kept pairs
+    """
+    ev_sim_df = qnode_match_df.loc[:, ['ta2_ev_id', 'ann_ev_id'] + QNODE_SIM_METRICS]
+    keep = np.ones(ev_sim_df.shape[0], dtype=bool)
+    if top_k is not None:
+        ranks = ev_sim_df.groupby('ta2_ev_id', sort=False)[QNODE_SIM_METRICS].rank(
+            method='min', ascending=False)
+        keep &= (ranks <= top_k).any(axis=1).to_numpy()
+    if min_similarity is not None:
+        keep &= (ev_sim_df.loc[:, QNODE_SIM_METRICS] >= min_similarity).any(axis=1).to_numpy()
+    return ev_sim_df.loc[keep, ['ta2_ev_id', 'ann_ev_id']].drop_duplicates()
 
 
 def get_ev_sim_score():
     pass
 
 
-def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
-                         qnode_directory, qnode_sim_fp,
-                         is_task2=False,
-                         use_graphg=False,
-                         min_confidence_threshold=0):
-    task_str = "task_1"
-    if is_task2:
-        task_str = "task_2"
-
-    # Incorporate Graph G First
-    if is_task2 and use_graphg:
-        pass
+def get_ce_qnode_fields(task1_ceannotation, ta2_ceinstance):
+    """
+    Processed event and argument qnodes of a TA2 CE instance and its Task 1 annotation, and
+    the qnode pairs whose similarity scores are needed to match them
+    Args:
+        task1_ceannotation: Task 1 annotation of the complex event
+        ta2_ceinstance: TA2CEInstance
 
+    Returns:
+        tuple of ta2_proc_qnode_df, ta2_earg_proc_qnode_df, ann_proc_qnode_df,
+        ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df and qnode_prod_df, the deduplicated
+        data frame of (q1, q2) qnode pairs
+    """
     # Start with event matching
     ta2_ev_df = ta2_ceinstance.ev_df
     # Save graph g variable for later graphg_ev_df = graphg_ceinstance.ev_df
@@ -368,7 +771,7 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
     ann_earg_df['str'] = "|"
     ann_earg_df['argu_id'] = \
         ann_earg_df['arg_id'] + ann_earg_df['str'] + \
-        ann_earg_df['eventprimitive_id'] + + ann_earg_df['str'] + ann_earg_df['arg_num']
+        ann_earg_df['eventprimitive_id'] + ann_earg_df['str'] + ann_earg_df['arg_num']
     ann_earg_df.drop(columns="str", inplace=True)
 
     ta2_proc_qnode_df = process_ta2_qnode_fields(ta2_ev_df, id_field_name="ev_id",
@@ -412,13 +815,96 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
     ann_earg_proc_qnode_df = \
         process_annotation_qnode_fields(ann_earg_df, id_field_name="argu_id",
                                         qnode_field_name="qnode_kb_id_identity")
-    qnode_prod_df = produce_qnode_pair_df(ta2_proc_qnode_df, ann_proc_qnode_df)
-    earg_qnode_prod_df = produce_qnode_pair_df(ta2_earg_proc_qnode_df, ann_earg_proc_qnode_df)
     # Query event and argument qnode similarities in the same file
-    qnode_prod_df = pd.concat([qnode_prod_df, earg_qnode_prod_df], ignore_index=True)
-    qnode_prod_df.drop_duplicates(inplace=True)
+    qnode_prod_df = produce_qnode_pair_union_df(
+        [(ta2_proc_qnode_df, ann_proc_qnode_df),
+         (ta2_earg_proc_qnode_df, ann_earg_proc_qnode_df)])
+    return ta2_proc_qnode_df, ta2_earg_proc_qnode_df, ann_proc_qnode_df, \
+        ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df, qnode_prod_df
+
+
+def get_arg_qnode_dfs(ta2_earg_proc_qnode_df, ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df):
+    """
+    Argument qnodes keyed by their event, for the segments of a QnodeSimMatrix. Arguments
+    average over their distinct qnodes
+    Returns:
+        tuple of the TA2 argument qnodes with columns ta2_arg_id, q1 and ta2_ev_id, and the
+        annotation argument qnodes with columns ann_arg_id, q2, ann_ev_id and arg_num
+    """
+    ta2_arg_qnode_df = pd.merge(ta2_earg_proc_qnode_df,
+                                ta2_earg_df.loc[:, ["arg_id", "ev_id"]].rename(
+                                    columns={"arg_id": "ta2_arg_id", "ev_id": "ta2_ev_id"}),
+                                on="ta2_arg_id", how="inner").drop_duplicates()
+    ann_arg_qnode_df = pd.merge(ann_earg_proc_qnode_df,
+                                ann_earg_df.loc[:, ["argu_id", "eventprimitive_id",
+                                                    "arg_num"]].rename(
+                                    columns={"argu_id": "ann_arg_id",
+                                             "eventprimitive_id": "ann_ev_id"}),
+                                on="ann_arg_id", how="inner").drop_duplicates()
+    return ta2_arg_qnode_df, ann_arg_qnode_df
+
+
+def get_qnode_sim_matrix_match_dfs(qnode_sim_df, ta2_proc_qnode_df, ann_proc_qnode_df,
+                                   ta2_earg_proc_qnode_df, ann_earg_proc_qnode_df,
+                                   ta2_earg_df, ann_earg_df):
+    """
+    Event and argument similarities of match_ke_ce_elements, computed from a QnodeSimMatrix
+    of the qnode similarity scores instead of merging the scores on q1 and q2
+    Args:
+        qnode_sim_df: similarity scores of the qnode pairs
+        ta2_proc_qnode_df: TA2 event qnodes with columns ta2_ev_id and q1
+        ann_proc_qnode_df: annotation event qnodes with columns ann_ev_id and q2
+        ta2_earg_proc_qnode_df: TA2 argument qnodes with columns ta2_arg_id and q1
+        ann_earg_proc_qnode_df: annotation argument qnodes with columns ann_arg_id and q2
+        ta2_earg_df: TA2 arguments with columns arg_id and ev_id
+        ann_earg_df: annotation arguments with columns argu_id, eventprimitive_id and arg_num
 
-    qnode_sim_df = get_bulk_qnode_sim_scores(qnode_prod_df, qnode_directory, qnode_sim_fp)
+    Returns:
+        tuple of qnode_match_df, with the mean similarity of every (ta2_ev_id, ann_ev_id)
+        pair, and qnode_arg_match_df, with the mean similarity of every
+        (ta2_ev_id, ann_ev_id, ta2_arg_id, ann_arg_id, arg_num) argument pair
+    """
+    qnode_sim_matrix = QnodeSimMatrix(qnode_sim_df)
+    # Events average over all of their qnodes, repeated qnodes included
+    qnode_match_df = qnode_sim_matrix.get_segment_sim_df(
+        ta2_proc_qnode_df, ["ta2_ev_id"], ann_proc_qnode_df, ["ann_ev_id"])
+
+    ta2_arg_qnode_df, ann_arg_qnode_df = get_arg_qnode_dfs(
+        ta2_earg_proc_qnode_df, ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df)
+    qnode_arg_match_df = qnode_sim_matrix.get_segment_sim_df(
+        ta2_arg_qnode_df, ["ta2_ev_id", "ta2_arg_id"],
+        ann_arg_qnode_df, ["ann_ev_id", "ann_arg_id", "arg_num"])
+    arg_keys = ["ta2_ev_id", "ann_ev_id", "ta2_arg_id", "ann_arg_id", "arg_num"]
+    qnode_arg_match_df = qnode_arg_match_df.loc[:, arg_keys + QNODE_SIM_METRICS]. \
+        sort_values(arg_keys).reset_index(drop=True)
+    return qnode_match_df, qnode_arg_match_df
+
+
+def get_ce_qnode_sim_dfs(task1_ceannotation, ta2_ceinstance, qnode_directory, qnode_sim_fp,
+                         prefetched_qnode_sim_df=None):
+    """
+    Processed qnodes of a TA2 CE instance and its annotation, with the similarity scores of
+    their qnode pairs
+    Args:
+        task1_ceannotation:
+        ta2_ceinstance:
+        qnode_directory:
+        qnode_sim_fp:
+        prefetched_qnode_sim_df: see match_ke_ce_elements
+
+    Returns:
+        tuple of qnode_sim_df, the TA2 and annotation event qnodes with columns ta2_ev_id, q1
+        and ann_ev_id, q2, the TA2 and annotation argument qnodes with columns ta2_arg_id, q1
+        and ann_arg_id, q2, and the ta2_earg_df and ann_earg_df of get_ce_qnode_fields
+    """
+    ta2_proc_qnode_df, ta2_earg_proc_qnode_df, ann_proc_qnode_df, ann_earg_proc_qnode_df, \
+        ta2_earg_df, ann_earg_df, qnode_prod_df = \
+        get_ce_qnode_fields(task1_ceannotation, ta2_ceinstance)
+
+    if prefetched_qnode_sim_df is None:
+        qnode_sim_df = get_bulk_qnode_sim_scores(qnode_prod_df, qnode_directory, qnode_sim_fp)
+    else:
+        qnode_sim_df = select_qnode_sim_scores(qnode_prod_df, prefetched_qnode_sim_df)
 
     ta2_proc_qnode_df.rename(columns={"id": "ta2_ev_id", "qnode_proc": "q1"},
                              inplace=True)
@@ -429,56 +915,96 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
                                   inplace=True)
     ann_earg_proc_qnode_df.rename(columns={"id": "ann_arg_id", "qnode_proc": "q2"},
                                   inplace=True)
+    return qnode_sim_df, ta2_proc_qnode_df, ann_proc_qnode_df, ta2_earg_proc_qnode_df, \
+        ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df
 
-    # Now, we join with events, and average if there are multiple qnodes
-    # Recall that ta2_events are q1, ann_events are q2
-    qnode_match_df = pd.merge(ann_proc_qnode_df,
-                              qnode_sim_df, on="q2", how="left")
-    qnode_match_df = pd.merge(ta2_proc_qnode_df,
-                              qnode_match_df, on="q1", how="left")
-    qnode_match_df.drop(columns=["q1", "q2", "q1_label", "q2_label"], inplace=True)
-    # Average values with multiple qnodes
-    qnode_match_df['class'] = pd.to_numeric(qnode_match_df['class'], errors="coerce")
-    qnode_match_df['complex'] = pd.to_numeric(qnode_match_df['complex'], errors="coerce")
-    qnode_match_df['jc'] = pd.to_numeric(qnode_match_df['jc'], errors="coerce")
-    qnode_match_df['text'] = pd.to_numeric(qnode_match_df['text'], errors="coerce")
-    qnode_match_df['transe'] = pd.to_numeric(qnode_match_df['transe'], errors="coerce")
-    qnode_match_df['topsim'] = pd.to_numeric(qnode_match_df['topsim'], errors="coerce")
-    qnode_match_df = qnode_match_df.groupby(['ta2_ev_id', "ann_ev_id"]).mean().reset_index()
 
-    qnode_match_df.fillna(0, inplace=True)
-    # qnode_match_df.drop_duplicates(inplace=True)
-    qnode_arg_match_df = pd.merge(ann_earg_proc_qnode_df,
-                                  qnode_sim_df, on="q2", how="right")
-    qnode_arg_match_df = pd.merge(ta2_earg_proc_qnode_df,
-                                  qnode_arg_match_df, on="q1", how="right")
-    # Need to investigate why we have duplicates
-    qnode_arg_match_df.drop_duplicates(inplace=True)
-    qnode_arg_match_df = pd.merge(qnode_arg_match_df, ta2_earg_df.loc[:, ["arg_id", "ev_id"]],
-                                  how="left", left_on="ta2_arg_id", right_on="arg_id")
-    qnode_arg_match_df.drop(columns="arg_id", inplace=True)
-    qnode_arg_match_df.rename(columns={"ev_id": "ta2_ev_id"}, inplace=True)
-    qnode_arg_match_df = pd.merge(qnode_arg_match_df, ann_earg_df.loc[:, ["argu_id",
-                                                                          "eventprimitive_id",
-                                                                          "arg_num"]],
-                                  how="inner", left_on="ann_arg_id", right_on="argu_id")
-    qnode_arg_match_df.drop(columns="argu_id", inplace=True)
-    qnode_arg_match_df.rename(columns={"eventprimitive_id": "ann_ev_id"}, inplace=True)
-    # Need to investigate why we have duplicates
-    qnode_arg_match_df.drop_duplicates(inplace=True)
-    qnode_arg_match_df.drop(columns=["q1", "q2", "q1_label", "q2_label"], inplace=True)
-    qnode_arg_match_df['class'] = pd.to_numeric(qnode_arg_match_df['class'], errors="coerce")
-    qnode_arg_match_df['complex'] = pd.to_numeric(qnode_arg_match_df['complex'], errors="coerce")
-    qnode_arg_match_df['jc'] = pd.to_numeric(qnode_arg_match_df['jc'], errors="coerce")
-    qnode_arg_match_df['text'] = pd.to_numeric(qnode_arg_match_df['text'], errors="coerce")
-    qnode_arg_match_df['transe'] = pd.to_numeric(qnode_arg_match_df['transe'], errors="coerce")
-    qnode_arg_match_df['topsim'] = pd.to_numeric(qnode_arg_match_df['topsim'], errors="coerce")
-    # We have multiple qnodes in an argument, so we average with them
-    qnode_arg_match_df = qnode_arg_match_df.groupby(['ta2_ev_id', "ann_ev_id", "ta2_arg_id",
-                                                     "ann_arg_id", "arg_num"]).mean().reset_index()
+def get_ke_ev_graph_all_df(task1_ceannotation, ta2_ceinstance, qnode_directory, qnode_sim_fp,
+                           use_graphg=False, prefetched_qnode_sim_df=None,
+                           use_qnode_sim_matrix=False, arg_candidate_top_k=None,
+                           arg_candidate_min_similarity=None):
+    """
+    Similarity of every TA2 event and annotation event pair of a CE instance, which does not
+    depend on the confidence threshold or the matching
+    Args:
+        task1_ceannotation:
+        ta2_ceinstance:
+        qnode_directory:
+        qnode_sim_fp:
+        use_graphg:
+        prefetched_qnode_sim_df: see match_ke_ce_elements
+        use_qnode_sim_matrix: see match_ke_ce_elements
+        arg_candidate_top_k: see match_ke_elements
+        arg_candidate_min_similarity: see match_ke_elements
+
+    Returns:
+        data frame with the ta2_ev_id, ann_ev_id, event, argument and combined similarity
+        columns, joined with the TA2 event columns. ev_confidence is numeric
+    """
+    ta2_ev_df = ta2_ceinstance.ev_df
+    qnode_sim_df, ta2_proc_qnode_df, ann_proc_qnode_df, ta2_earg_proc_qnode_df, \
+        ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df = get_ce_qnode_sim_dfs(
+            task1_ceannotation, ta2_ceinstance, qnode_directory, qnode_sim_fp,
+            prefetched_qnode_sim_df)
+
+    if use_qnode_sim_matrix:
+        qnode_match_df, qnode_arg_match_df = get_qnode_sim_matrix_match_dfs(
+            qnode_sim_df, ta2_proc_qnode_df, ann_proc_qnode_df, ta2_earg_proc_qnode_df,
+            ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df)
+    else:
+        # Now, we join with events, and average if there are multiple qnodes
+        # Recall that ta2_events are q1, ann_events are q2
+        qnode_match_df = pd.merge(ann_proc_qnode_df,
+                                  qnode_sim_df, on="q2", how="left")
+        qnode_match_df = pd.merge(ta2_proc_qnode_df,
+                                  qnode_match_df, on="q1", how="left")
+        qnode_match_df.drop(columns=["q1", "q2", "q1_label", "q2_label"], inplace=True)
+        # Average values with multiple qnodes
+        qnode_match_df['class'] = pd.to_numeric(qnode_match_df['class'], errors="coerce")
+        qnode_match_df['complex'] = pd.to_numeric(qnode_match_df['complex'], errors="coerce")
+        qnode_match_df['jc'] = pd.to_numeric(qnode_match_df['jc'], errors="coerce")
+        qnode_match_df['text'] = pd.to_numeric(qnode_match_df['text'], errors="coerce")
+        qnode_match_df['transe'] = pd.to_numeric(qnode_match_df['transe'], errors="coerce")
+        qnode_match_df['topsim'] = pd.to_numeric(qnode_match_df['topsim'], errors="coerce")
+        qnode_match_df = qnode_match_df.groupby(['ta2_ev_id', "ann_ev_id"]).mean().reset_index()
+
+        # qnode_match_df.drop_duplicates(inplace=True)
+        qnode_arg_match_df = pd.merge(ann_earg_proc_qnode_df,
+                                      qnode_sim_df, on="q2", how="right")
+        qnode_arg_match_df = pd.merge(ta2_earg_proc_qnode_df,
+                                      qnode_arg_match_df, on="q1", how="right")
+        # Need to investigate why we have duplicates
+        qnode_arg_match_df.drop_duplicates(inplace=True)
+        qnode_arg_match_df = pd.merge(qnode_arg_match_df,
+                                      ta2_earg_df.loc[:, ["arg_id", "ev_id"]],
+                                      how="left", left_on="ta2_arg_id", right_on="arg_id")
+        qnode_arg_match_df.drop(columns="arg_id", inplace=True)
+        qnode_arg_match_df.rename(columns={"ev_id": "ta2_ev_id"}, inplace=True)
+        qnode_arg_match_df = pd.merge(qnode_arg_match_df,
+                                      ann_earg_df.loc[:, ["argu_id", "eventprimitive_id",
+                                                          "arg_num"]],
+                                      how="inner", left_on="ann_arg_id", right_on="argu_id")
+        qnode_arg_match_df.drop(columns="argu_id", inplace=True)
+        qnode_arg_match_df.rename(columns={"eventprimitive_id": "ann_ev_id"}, inplace=True)
+        # Need to investigate why we have duplicates
+        qnode_arg_match_df.drop_duplicates(inplace=True)
+        qnode_arg_match_df.drop(columns=["q1", "q2", "q1_label", "q2_label"], inplace=True)
+        qnode_arg_match_df['class'] = pd.to_numeric(qnode_arg_match_df['class'], errors="coerce")
+        qnode_arg_match_df['complex'] = pd.to_numeric(qnode_arg_match_df['complex'],
+                                                      errors="coerce")
+        qnode_arg_match_df['jc'] = pd.to_numeric(qnode_arg_match_df['jc'], errors="coerce")
+        qnode_arg_match_df['text'] = pd.to_numeric(qnode_arg_match_df['text'], errors="coerce")
+        qnode_arg_match_df['transe'] = pd.to_numeric(qnode_arg_match_df['transe'],
+                                                     errors="coerce")
+        qnode_arg_match_df['topsim'] = pd.to_numeric(qnode_arg_match_df['topsim'],
+                                                     errors="coerce")
+        # We have multiple qnodes in an argument, so we average with them
+        qnode_arg_match_df = qnode_arg_match_df.groupby(
+            ['ta2_ev_id', "ann_ev_id", "ta2_arg_id", "ann_arg_id", "arg_num"]).mean().reset_index()
 
     # Now that we have this, we can join on ta2 event information and filter by primitive events
     # Or thresholds
+    qnode_match_df.fillna(0, inplace=True)
     qnode_arg_match_df.fillna(0, inplace=True)
 
     # We need to filter out to get only the largest set of events we need to save on time
@@ -495,7 +1021,14 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
             (pd.notna(qnode_arg_match_df['ev_ta1ref'])), :]
         qnode_arg_match_df.drop(columns=["ev_id", "ev_ta1ref",
                                          "ev_provenance", "ev_prediction_provenance"], inplace=True)
-    ev_arg_sim_df = get_ev_arg_sim(qnode_arg_match_df)
+    candidate_pair_df = None
+    if arg_candidate_top_k is not None or arg_candidate_min_similarity is not None:
+        candidate_pair_df = get_arg_candidate_pair_df(qnode_match_df, arg_candidate_top_k,
+                                                      arg_candidate_min_similarity)
+        print("Pruned {} of {} event pairs of {} before argument matching".format(
+            qnode_match_df.shape[0] - candidate_pair_df.shape[0], qnode_match_df.shape[0],
+            ta2_ceinstance.schema_instance_id))
+    ev_arg_sim_df = get_ev_arg_sim(qnode_arg_match_df, candidate_pair_df)
 
     # Pivot to averge qnodes
     qnode_match_df['class'] = pd.to_numeric(qnode_match_df['class'])
@@ -535,6 +1068,21 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
         ev_graph_all_df['topsim_arg'] = 0.0
         ev_graph_all_df['text_arg'] = 0.0
 
+    return add_ke_combined_sims(ev_graph_all_df, ta2_ev_df)
+
+
+def add_ke_combined_sims(ev_graph_all_df, ta2_ev_df):
+    """
+    Adds the similarities used to match, which weigh the event and argument similarities,
+    and joins the TA2 event columns
+    Args:
+        ev_graph_all_df: data frame with ta2_ev_id, ann_ev_id and the event and argument
+            similarity columns
+        ta2_ev_df: TA2 events
+
+    Returns:
+        data frame with the combined similarity and TA2 event columns. ev_confidence is numeric
+    """
     weight_ev = 0.5
     weight_arg = 0.5
     ev_graph_all_df['class'] = \
@@ -556,35 +1104,192 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
     # For now, ignore confidence values that are lists since we should have a number
     ev_graph_all_df['ev_confidence'] = pd.to_numeric(ev_graph_all_df['ev_confidence'],
                                                      errors='coerce')
-    ev_graph_large_df = ev_graph_all_df
+    return ev_graph_all_df
+
+
+def get_sparse_ke_ev_graph_all_df(task1_ceannotation, ta2_ceinstance, qnode_directory,
+                                  qnode_sim_fp, sparse_similarity_floor, use_graphg=False,
+                                  prefetched_qnode_sim_df=None, arg_candidate_top_k=None,
+                                  arg_candidate_min_similarity=None):
+    """
+    get_ke_ev_graph_all_df of the sparse similarity mode. Event and argument similarities are
+    kept only for the pairs above the similarity floor, see
+    QnodeSimMatrix.get_sparse_segment_sim, and event pairs are kept when one of their combined
+    similarities is above the floor. With non-negative similarities and a floor of 0, the
+    pairs that are left out have similarities of 0, and the matching and scores are those of
+    the dense mode
+    Args:
+        task1_ceannotation:
+        ta2_ceinstance:
+        qnode_directory:
+        qnode_sim_fp:
+        sparse_similarity_floor: see match_ke_ce_elements
+        use_graphg:
+        prefetched_qnode_sim_df: see match_ke_ce_elements
+        arg_candidate_top_k: see match_ke_elements, ranked among the kept event pairs
+        arg_candidate_min_similarity: see match_ke_elements
+
+    Returns:
+        tuple of the ev_graph_all_df of the kept event pairs, and the SparseSegmentSim of the
+        events, which records all event pairs with scored qnode pairs for get_ke_id_counts
+    """
+    ta2_ev_df = ta2_ceinstance.ev_df
+    qnode_sim_df, ta2_proc_qnode_df, ann_proc_qnode_df, ta2_earg_proc_qnode_df, \
+        ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df = get_ce_qnode_sim_dfs(
+            task1_ceannotation, ta2_ceinstance, qnode_directory, qnode_sim_fp,
+            prefetched_qnode_sim_df)
+    qnode_sim_matrix = QnodeSimMatrix(qnode_sim_df)
+    ev_sim = qnode_sim_matrix.get_sparse_segment_sim(
+        ta2_proc_qnode_df, ["ta2_ev_id"], ann_proc_qnode_df, ["ann_ev_id"],
+        sparse_similarity_floor)
+    ta2_arg_qnode_df, ann_arg_qnode_df = get_arg_qnode_dfs(
+        ta2_earg_proc_qnode_df, ann_earg_proc_qnode_df, ta2_earg_df, ann_earg_df)
+    arg_sim = qnode_sim_matrix.get_sparse_segment_sim(
+        ta2_arg_qnode_df, ["ta2_ev_id", "ta2_arg_id"],
+        ann_arg_qnode_df, ["ann_ev_id", "ann_arg_id", "arg_num"], sparse_similarity_floor)
+    # We need to filter out to get only the largest set of events we need to save on time
     if not use_graphg:
-        ev_graph_large_df = \
-            ev_graph_all_df.loc[((pd.notna(ev_graph_all_df['ev_provenance'])) |
-                                 (pd.notna(ev_graph_all_df['ev_prediction_provenance']))) &
-                                (ev_graph_all_df['ev_ta1ref'] != "kairos:NULL") &
-                                (pd.notna(ev_graph_all_df['ev_ta1ref'])), :]
+        instantiated_ev_ids = ta2_ev_df.loc[is_instantiated_ta2_ev(ta2_ev_df), 'ev_id']
+        arg_sim = arg_sim.select_q1_segments(
+            arg_sim.q1_segment_df['ta2_ev_id'].isin(instantiated_ev_ids).to_numpy())
+
+    ev_sim_df = ev_sim.sim_df.loc[:, ['ta2_ev_id', 'ann_ev_id'] + QNODE_SIM_METRICS].fillna(0)
+    candidate_pair_df = None
+    if arg_candidate_top_k is not None or arg_candidate_min_similarity is not None:
+        candidate_pair_df = get_arg_candidate_pair_df(ev_sim_df, arg_candidate_top_k,
+                                                      arg_candidate_min_similarity)
+        print("Pruned {} of {} event pairs of {} before argument matching".format(
+            ev_sim_df.shape[0] - candidate_pair_df.shape[0], ev_sim_df.shape[0],
+            ta2_ceinstance.schema_instance_id))
+    ev_arg_sim_df = get_sparse_ev_arg_sim(arg_sim, candidate_pair_df)
+    # Like the dense mode, only event pairs with scored event qnode pairs are matched
+    ta2_ev_codes = pd.Index(ev_sim.q1_segment_df['ta2_ev_id']).get_indexer(
+        ev_arg_sim_df['ta2_ev_id'])
+    ann_ev_codes = pd.Index(ev_sim.q2_segment_df['ann_ev_id']).get_indexer(
+        ev_arg_sim_df['ann_ev_id'])
+    has_ev_pair = (ta2_ev_codes >= 0) & (ann_ev_codes >= 0)
+    has_ev_pair[has_ev_pair] = np.asarray(
+        ev_sim.pair_matrix[ta2_ev_codes[has_ev_pair], ann_ev_codes[has_ev_pair]]).ravel()
+    ev_arg_sim_df = ev_arg_sim_df.loc[has_ev_pair, :]
+
+    ev_graph_all_df = ev_sim_df.rename(columns={'class': 'class_ev', 'complex': 'complex_ev',
+                                                'jc': 'jc_ev', 'text': 'text_ev',
+                                                'topsim': 'topsim_ev', 'transe': 'transe_ev'})
+    ev_graph_all_df = ev_graph_all_df.merge(ev_arg_sim_df, how="outer",
+                                            on=["ta2_ev_id", "ann_ev_id"])
+    ev_graph_all_df.fillna(0, inplace=True)
+    ev_graph_all_df = add_ke_combined_sims(ev_graph_all_df, ta2_ev_df)
+    ev_graph_all_df = ev_graph_all_df.loc[
+        (ev_graph_all_df.loc[:, QNODE_SIM_METRICS] > sparse_similarity_floor).any(axis=1), :]
+    return ev_graph_all_df.reset_index(drop=True), ev_sim
 
-    # Now we can filter events how we like
+
+def get_ke_id_counts(ev_sim, ta2_ev_ids):
+    """
+    Numbers of TA2 and annotation events that a dense event graph of the TA2 events would
+    have, which are the denominators of the KE scores of a sparse event graph
+    Args:
+        ev_sim: SparseSegmentSim of the events, see get_sparse_ke_ev_graph_all_df
+        ta2_ev_ids: ids of the TA2 events of the event graph
+
+    Returns:
+        tuple of the number of TA2 events and the number of annotation events that have a
+        pair with scored qnode pairs
+    """
+    ta2_ev_codes = pd.Index(ev_sim.q1_segment_df['ta2_ev_id']).get_indexer(
+        pd.unique(pd.Series(ta2_ev_ids)))
+    pair_matrix = ev_sim.pair_matrix[ta2_ev_codes[ta2_ev_codes >= 0]]
+    return int((np.diff(pair_matrix.indptr) > 0).sum()), len(np.unique(pair_matrix.indices))
+
+
+def is_instantiated_ta2_ev(ev_df):
+    """
+    Whether the TA2 events are instantiated or predicted, with a TA1 reference
+    """
+    return ((pd.notna(ev_df['ev_provenance'])) |
+            (pd.notna(ev_df['ev_prediction_provenance']))) & \
+        (ev_df['ev_ta1ref'] != "kairos:NULL") & (pd.notna(ev_df['ev_ta1ref']))
+
+
+def get_ke_candidate_df(ev_graph_all_df, ta2_team_name):
+    """
+    Event pairs that take part in the matching at every confidence threshold: primitive,
+    instantiated TA2 events with a TA1 reference
+    """
     ev_graph_df = \
         ev_graph_all_df.loc[(ev_graph_all_df['ev_child_list'] == "[]") &
-                            (ev_graph_all_df['ev_confidence'] >= min_confidence_threshold) &
                             (ev_graph_all_df['ev_ta1ref'] != "kairos:NULL") &
                             (pd.notna(ev_graph_all_df['ev_ta1ref'])) &
                             ((pd.notna(ev_graph_all_df['ev_provenance'])) |
                              (pd.notna(ev_graph_all_df['ev_prediction_provenance']))), :]
 
     # We want to filter all of the obligated events out
-    if ta2_ceinstance.ta2_team_name == "RESIN":
+    if ta2_team_name == "RESIN":
         ev_graph_df = ev_graph_df.loc[(ev_graph_df['ev_confidence'] > 0.01), :]
-    if ta2_ceinstance.ta2_team_name == "CMU":
+    if ta2_team_name == "CMU":
         ev_graph_df = ev_graph_df.loc[(ev_graph_df['ev_confidence'] > 0.0), :]
+    return ev_graph_df
+
+
+def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
+                         qnode_directory, qnode_sim_fp,
+                         is_task2=False,
+                         use_graphg=False,
+                         min_confidence_threshold=0,
+                         prefetched_qnode_sim_df=None,
+                         use_qnode_sim_matrix=False,
+                         matching_backend="networkx",
+                         arg_candidate_top_k=None,
+                         arg_candidate_min_similarity=None,
+                         validate_arg_candidate_pruning=False,
+                         sparse_similarity_floor=None,
+                         confidence_threshold_list=None):
+    """
+    Matches the events of a TA2 CE instance to the events of its annotation and scores them.
+    When sparse_similarity_floor is set, only the event and argument similarities above the
+    floor are kept, so that memory grows with the similar pairs rather than with the product
+    of the numbers of TA2 and annotation events, and the events are matched on the sparse
+    event graph, where events may stay unmatched. This needs a SciPy matching_backend.
+    When confidence_threshold_list is given, the scores at every threshold of the list are
+    also computed from the same event graph, see sweep_ke_ev_graph_confidence_thresholds,
+    and added to the returned tuple
+    """
+    task_str = "task_1"
+    if is_task2:
+        task_str = "task_2"
+
+    # Incorporate Graph G First
+    if is_task2 and use_graphg:
+        pass
+
+    ev_sim = None
+    if sparse_similarity_floor is None:
+        ev_graph_all_df = get_ke_ev_graph_all_df(task1_ceannotation, ta2_ceinstance,
+                                                 qnode_directory, qnode_sim_fp, use_graphg,
+                                                 prefetched_qnode_sim_df, use_qnode_sim_matrix,
+                                                 arg_candidate_top_k,
+                                                 arg_candidate_min_similarity)
+    else:
+        ev_graph_all_df, ev_sim = get_sparse_ke_ev_graph_all_df(
+            task1_ceannotation, ta2_ceinstance, qnode_directory, qnode_sim_fp,
+            sparse_similarity_floor, use_graphg, prefetched_qnode_sim_df, arg_candidate_top_k,
+            arg_candidate_min_similarity)
+    ev_graph_large_df = ev_graph_all_df
+    if not use_graphg:
+        ev_graph_large_df = ev_graph_all_df.loc[is_instantiated_ta2_ev(ev_graph_all_df), :]
+
+    # Now we can filter events how we like
+    ev_graph_df = get_ke_candidate_df(ev_graph_all_df, ta2_ceinstance.ta2_team_name)
+    ev_graph_df = ev_graph_df.loc[(ev_graph_df['ev_confidence'] >= min_confidence_threshold), :]
 
     ev_match_df = ev_graph_df
     ev_match_large_df = ev_graph_large_df
+    allow_unmatched = sparse_similarity_floor is not None
     if ev_graph_df.shape[0] > 0:
-        ev_match_df = match_graph_ke_elements(ev_graph_df)
+        ev_match_df = match_graph_ke_elements(ev_graph_df, matching_backend, allow_unmatched)
     if ev_graph_large_df.shape[0] > 0:
-        ev_match_large_df = match_graph_ke_elements(ev_graph_large_df)
+        ev_match_large_df = match_graph_ke_elements(ev_graph_large_df, matching_backend,
+                                                    allow_unmatched)
 
     # Now just return the subset of filtered events
     ev_graph_return_df = ev_graph_large_df.loc[:, ["schema_instance_id", "ta2_team_name",
@@ -604,22 +1309,332 @@ def match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graphg_ceinstance,
     ev_match_df.fillna(0, inplace=True)
     ev_match_large_df.fillna(0, inplace=True)
 
-    ke_score_df = score_ke_elements(ta2_ceinstance, task_str, ev_graph_df)
-    ke_score_large_df = score_ke_elements(ta2_ceinstance, task_str, ev_graph_large_df)
-    ke_score_match_df = score_ke_elements(ta2_ceinstance, task_str, ev_match_df)
-    ke_score_match_large_df = score_ke_elements(ta2_ceinstance, task_str, ev_match_large_df)
-
+    id_count_list = None
+    if ev_sim is not None:
+        # Events of the dense event graphs, which keep the pairs below the floor
+        ta2_ev_df = get_ta2_ke_ev_df(ta2_ceinstance)
+        ta2_large_df = ta2_ev_df
+        if not use_graphg:
+            ta2_large_df = ta2_ev_df.loc[is_instantiated_ta2_ev(ta2_ev_df), :]
+        ta2_graph_df = get_ke_candidate_df(ta2_ev_df, ta2_ceinstance.ta2_team_name)
+        ta2_graph_df = ta2_graph_df.loc[
+            (ta2_graph_df['ev_confidence'] >= min_confidence_threshold), :]
+        graph_id_counts = get_ke_id_counts(ev_sim, ta2_graph_df['ta2_ev_id'])
+        large_id_counts = get_ke_id_counts(ev_sim, ta2_large_df['ta2_ev_id'])
+        id_count_list = [graph_id_counts, large_id_counts, graph_id_counts, large_id_counts]
+
+    ke_score_df, ke_score_large_df, ke_score_match_df, ke_score_match_large_df = \
+        score_ke_element_sets(ta2_ceinstance, task_str, [ev_graph_df, ev_graph_large_df,
+                                                         ev_match_df, ev_match_large_df],
+                              id_count_list)
+
+    if validate_arg_candidate_pruning and \
+            (arg_candidate_top_k is not None or arg_candidate_min_similarity is not None):
+        # Match again without pruning and compare the matched event pairs
+        full_ev_match_return_df = match_ke_ce_elements(
+            task1_ceannotation, ta2_ceinstance, graphg_ceinstance, qnode_directory,
+            qnode_sim_fp, is_task2=is_task2, use_graphg=use_graphg,
+            min_confidence_threshold=min_confidence_threshold,
+            prefetched_qnode_sim_df=prefetched_qnode_sim_df,
+            use_qnode_sim_matrix=use_qnode_sim_matrix, matching_backend=matching_backend,
+            sparse_similarity_floor=sparse_similarity_floor)[1]
+        num_changed = count_changed_matches(ev_match_return_df, full_ev_match_return_df)
+        if num_changed == 0:
+            print("Argument candidate pruning left the event matching of {} unchanged".format(
+                ta2_ceinstance.schema_instance_id))
+        else:
+            print("Warning: Argument candidate pruning changed {} matched event pairs of {}".
+                  format(num_changed, ta2_ceinstance.schema_instance_id))
+
+    if confidence_threshold_list is not None:
+        return (ev_graph_return_df, ev_match_return_df, ke_score_df, ke_score_large_df,
+                ke_score_match_df, ke_score_match_large_df) + \
+            sweep_ke_ev_graph_confidence_thresholds(ev_graph_all_df, ta2_ceinstance, task_str,
+                                                    confidence_threshold_list,
+                                                    matching_backend, ev_sim)
     return ev_graph_return_df, ev_match_return_df, ke_score_df, \
         ke_score_large_df, ke_score_match_df, ke_score_match_large_df
 
 
+def count_changed_matches(ev_match_df, other_ev_match_df):
+    """
+    Number of event pairs that are matched, for some similarity metric, in only one of two
+    event matchings, or matched with a different similarity
+    """
+    match_column_list = ['ta2_ev_id', 'ann_ev_id'] + QNODE_SIM_METRICS
+    match_df = ev_match_df.loc[:, match_column_list].merge(
+        other_ev_match_df.loc[:, match_column_list], how="outer", on=['ta2_ev_id', 'ann_ev_id'],
+        indicator=True)
+    changed = match_df['_merge'].to_numpy() != 'both'
+    for metric in QNODE_SIM_METRICS:
+        values = match_df[metric + '_x'].to_numpy(dtype=float, na_value=np.nan)
+        other_values = match_df[metric + '_y'].to_numpy(dtype=float, na_value=np.nan)
+        changed |= ~((values == other_values) | (np.isnan(values) & np.isnan(other_values)))
+    return int(changed.sum())
+
+
+def get_ta2_ke_ev_df(ta2_ceinstance):
+    """
+    Events of a TA2 CE instance with the columns of an event graph, used to count the events
+    that have no pair in a sparse event graph
+    """
+    ta2_ev_df = ta2_ceinstance.ev_df.rename(columns={'ev_id': 'ta2_ev_id'})
+    ta2_ev_df['ev_confidence'] = pd.to_numeric(ta2_ev_df['ev_confidence'], errors='coerce')
+    return ta2_ev_df
+
+
+def get_sorted_confidences(candidate_df):
+    """
+    Sorted confidences of candidate events or event pairs. Those without a confidence are
+    dropped, as they are candidates at no threshold
+    """
+    confidences = candidate_df['ev_confidence'].to_numpy(dtype=float, na_value=np.nan)
+    return np.sort(confidences[~np.isnan(confidences)])
+
+
+def sweep_ke_ev_graph_confidence_thresholds(ev_graph_all_df, ta2_ceinstance, task_str,
+                                            confidence_threshold_list,
+                                            matching_backend="networkx", ev_sim=None):
+    """
+    Scores the event graph of a TA2 CE instance at many confidence thresholds. The events are
+    only matched again when a threshold changes the set of candidate events
+    Args:
+        ev_graph_all_df: event graph of get_ke_ev_graph_all_df, or of
+            get_sparse_ke_ev_graph_all_df
+        ta2_ceinstance:
+        task_str:
+        confidence_threshold_list: list of min_confidence_threshold values
+        matching_backend: see match_ke_ce_elements
+        ev_sim: the SparseEvSim of a sparse event graph, None for a dense event graph
+
+    Returns:
+        tuple of the ke_score_df and ke_score_match_df scores, with one row per threshold in
+        confidence_threshold_list and the threshold in column min_confidence_threshold
+    """
+    candidate_df = get_ke_candidate_df(ev_graph_all_df, ta2_ceinstance.ta2_team_name)
+    # The candidates of a threshold are those with at least that confidence, so the number of
+    # candidate pairs identifies the candidate set. A sparse event graph lacks the pairs
+    # below the floor, so the number of candidate TA2 events is counted as well
+    sorted_confidences = get_sorted_confidences(candidate_df)
+    ta2_sorted_confidences = None
+    if ev_sim is not None:
+        ta2_ev_df = get_ta2_ke_ev_df(ta2_ceinstance)
+        ta2_candidate_df = get_ke_candidate_df(ta2_ev_df, ta2_ceinstance.ta2_team_name)
+        ta2_sorted_confidences = get_sorted_confidences(ta2_candidate_df)
+    score_dict = dict()
+    ke_score_df_list = []
+    ke_score_match_df_list = []
+    for min_confidence_threshold in confidence_threshold_list:
+        candidate_key = len(sorted_confidences) - np.searchsorted(
+            sorted_confidences, min_confidence_threshold, side='left')
+        if ta2_sorted_confidences is not None:
+            candidate_key = (candidate_key, len(ta2_sorted_confidences) - np.searchsorted(
+                ta2_sorted_confidences, min_confidence_threshold, side='left'))
+        if candidate_key not in score_dict:
+            ev_graph_df = candidate_df.loc[
+                (candidate_df['ev_confidence'] >= min_confidence_threshold), :]
+            ev_match_df = ev_graph_df
+            if ev_graph_df.shape[0] > 0:
+                ev_match_df = match_graph_ke_elements(ev_graph_df, matching_backend,
+                                                      ev_sim is not None)
+            ev_match_df = ev_match_df.fillna(0)
+            id_count_list = None
+            if ev_sim is not None:
+                ta2_graph_df = ta2_candidate_df.loc[
+                    (ta2_candidate_df['ev_confidence'] >= min_confidence_threshold), :]
+                graph_id_counts = get_ke_id_counts(ev_sim, ta2_graph_df['ta2_ev_id'])
+                id_count_list = [graph_id_counts, graph_id_counts]
+            score_dict[candidate_key] = score_ke_element_sets(
+                ta2_ceinstance, task_str, [ev_graph_df, ev_match_df], id_count_list)
+        # The threshold goes after the instance columns of the scores
+        for ke_sweep_df_list, ke_score_df in zip([ke_score_df_list, ke_score_match_df_list],
+                                                 score_dict[candidate_key]):
+            ke_score_df = ke_score_df.copy()
+            ke_score_df.insert(5, 'min_confidence_threshold', min_confidence_threshold)
+            ke_sweep_df_list.append(ke_score_df)
+    return pd.concat(ke_score_df_list, ignore_index=True), \
+        pd.concat(ke_score_match_df_list, ignore_index=True)
+
+
+def get_task1_ceannotation(annotation_collection, ce, is_task2=False):
+    task1_ce = ce
+    # Get the relevant task1 annotaiton from the graphG task 2 event
+    if is_task2:
+        task1_ce = ce[0:re.search("[0-9]+", ce).end()]
+    return annotation_collection.annotation_dict['task1|{}'.format(task1_ce)]
+
+
+def get_ke_match_file_paths(output_dir, ta2_team_name, base_filename,
+                            confidence_threshold_sweep=False):
+    """
+    Paths of the files match_ke_elements writes for a TA2 CE instance, in the order
+    ev_graph, ev_match, ke_score, ke_score_large, ke_score_match and ke_score_match_large,
+    followed by the ke_score and ke_score_match threshold sweeps if confidence_threshold_sweep
+    """
+    file_suffix_list = ["event_similarities.csv", "matched_events.csv",
+                        "ke_score_df.csv", "ke_score_large_df.csv",
+                        "ke_score_match_df.csv", "ke_score_match_large_df.csv"]
+    if confidence_threshold_sweep:
+        file_suffix_list += ["ke_score_threshold_sweep.csv",
+                             "ke_score_match_threshold_sweep.csv"]
+    return [os.path.join(output_dir, ta2_team_name, "{}_{}".format(base_filename, file_suffix))
+            for file_suffix in file_suffix_list]
+
+
+def prefetch_qnode_sim_scores(ce_instance_list, qnode_directory, qnode_sim_fp):
+    """
+    Planning pass for matching many TA2 CE instances. Collects the deduplicated union of the
+    qnode pairs of all instances and fetches their similarity scores in one run, so that each
+    pair is looked up or queried once instead of once per instance. The result is passed to
+    match_ke_ce_elements as prefetched_qnode_sim_df
+    Args:
+        ce_instance_list: list of (task1_ceannotation, ta2_ceinstance) tuples
+        qnode_directory:
+        qnode_sim_fp:
+
+    Returns:
+        data frame with the similarity scores of all qnode pairs
+    """
+    qnode_prod_df_list = [get_ce_qnode_fields(task1_ceannotation, ta2_ceinstance)[-1]
+                          for task1_ceannotation, ta2_ceinstance in ce_instance_list]
+    if not qnode_prod_df_list:
+        return None
+    qnode_prod_df = pd.concat(qnode_prod_df_list, ignore_index=True)
+    qnode_prod_df.drop_duplicates(inplace=True)
+    print("Prefetching similarity scores of {} qnode pairs for {} instances".format(
+        qnode_prod_df.shape[0], len(ce_instance_list)))
+    return get_bulk_qnode_sim_scores(qnode_prod_df, qnode_directory, qnode_sim_fp)
+
+
+def get_ke_match_size(task1_ceannotation, ta2_ceinstance):
+    """
+    Number of event and argument pairs of a TA2 CE instance and its annotation, used to
+    schedule the largest matches first
+    """
+    return ta2_ceinstance.ev_df.shape[0] * task1_ceannotation.ep_df.shape[0] + \
+        ta2_ceinstance.arg_df.shape[0] * task1_ceannotation.arg_df.shape[0]
+
+
+def match_ke_ce_instance(task1_ceannotation, ta2_ceinstance, graph_g_ce, ke_match_file_paths,
+                         **match_kwargs):
+    """
+    Matches a TA2 CE instance with match_ke_ce_elements and writes its files
+    Args:
+        task1_ceannotation:
+        ta2_ceinstance:
+        graph_g_ce:
+        ke_match_file_paths: file paths from get_ke_match_file_paths
+        **match_kwargs: keyword arguments of match_ke_ce_elements
+
+    Returns:
+        list of ke_score_df, ke_score_large_df, ke_score_match_df and ke_score_match_large_df,
+        followed by the threshold sweeps when confidence_threshold_list is in match_kwargs
+    """
+    ke_match_df_list = match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, graph_g_ce,
+                                            **match_kwargs)
+    for ke_match_df, file_path in zip(ke_match_df_list, ke_match_file_paths):
+        ke_match_df.to_csv(file_path, index=False)
+    return list(ke_match_df_list[2:])
+
+
+# Similarity scores shared by the instances matched in a worker process
+worker_qnode_sim_df = None
+
+
+def set_worker_qnode_sim_df(qnode_sim_df):
+    global worker_qnode_sim_df
+    worker_qnode_sim_df = qnode_sim_df
+
+
+def match_ke_ce_instance_in_worker(task1_ceannotation, ta2_ceinstance, graph_g_ce,
+                                   ke_match_file_paths, **match_kwargs):
+    """
+    match_ke_ce_instance for a ProcessPoolExecutor worker, using the similarity scores set
+    by set_worker_qnode_sim_df when the worker started
+    """
+    return match_ke_ce_instance(task1_ceannotation, ta2_ceinstance, graph_g_ce,
+                                ke_match_file_paths, prefetched_qnode_sim_df=worker_qnode_sim_df,
+                                **match_kwargs)
+
+
 # @profile
 
 
+def get_ke_match_instance_list(output_dir, annotation_collection, ta2_collection,
+                               graph_g_collection, is_task2=False,
+                               confidence_threshold_sweep=False):
+    """
+    Plans the TA2 CE instances of a collection in team, ce and instance order, which is the
+    order of their scores, and creates the team directories of output_dir
+    Args:
+        output_dir:
+        annotation_collection:
+        ta2_collection:
+        graph_g_collection:
+        is_task2:
+        confidence_threshold_sweep: see get_ke_match_file_paths
+
+    Returns:
+        list of (task1_ceannotation, ta2_ceinstance, graph_g_ce, ke_match_file_paths) tuples
+    """
+    instance_list = []
+    ta2_team_list = ta2_collection.ta2dict.keys()
+
+    for ta2_team in ta2_team_list:
+        ta2_instance = ta2_collection.ta2dict[ta2_team]
+        # it is possible by being
+        ce_list = pd.Series([key.split('.')[0].split('|')[2].lower()
+                             for key in ta2_instance.ta2dict.keys()]).unique().tolist()
+        # ce_list = ["ce2104"]
+        for ce in ce_list:
+            ta2_ce_items = [(key, value) for key, value
+                            in ta2_instance.ta2dict.items()
+                            if (ce == key.split('.')[0].split('|')[2].lower())]
+            # Now get all of the items in a ce
+            # As there are multiple instances per (ta1, ta2, ce), we want to cover them all
+            for key, value in ta2_ce_items:
+                ta2_ceinstance = value
+                instance_split = key.split('.')[0].split('|')
+                ta2_team_name = ta2_ceinstance.ta2_team_name
+                ce_item = instance_split[2].lower()
+                if ce != ce_item:
+                    print("Inconsistent: Finding ce item {} with loop of ce {}".format(ce_item, ce))
+                task1_ceannotation = get_task1_ceannotation(annotation_collection, ce, is_task2)
+                graph_g_ce_list = [value for key, value
+                                   in graph_g_collection.ta2dict['GRAPHG'].ta2dict.items()
+                                   if (ce == key.split("|")[2])]
+                # If empty, use the exposed version
+                if not graph_g_ce_list:
+                    graph_g_ce_list = [value for key, value
+                                       in graph_g_collection.ta2dict['GRAPHG'].ta2dict.items()
+                                       if (ce + "exposed" == key.split("|")[2])]
+                # There is only one Graph G instance per event
+                if len(graph_g_ce_list) > 1:
+                    print("Warning: Multiple Graph G instances of the same complex event")
+                    print("Using First of these")
+                print("graph g ce list for {}: ".format(ce), graph_g_ce_list)
+                graph_g_ce = graph_g_ce_list[0]
+                base_filename = ta2_ceinstance.ce_instance_file_name_base
+                if not os.path.isdir(output_dir):
+                    os.makedirs(output_dir)
+                if not os.path.isdir(os.path.join(output_dir, ta2_team_name)):
+                    os.makedirs(os.path.join(output_dir, ta2_team_name))
+                instance_list.append((task1_ceannotation, ta2_ceinstance, graph_g_ce,
+                                      get_ke_match_file_paths(output_dir, ta2_team_name,
+                                                              base_filename,
+                                                              confidence_threshold_sweep)))
+    return instance_list
+
+
 def match_ke_elements(output_dir, annotation_collection, ta2_collection, graph_g_collection,
                       qnode_directory, qnode_sim_fp,
                       is_task2=False, use_graph_g=False,
-                      min_confidence_threshold=0):
+                      min_confidence_threshold=0, prefetch_qnode_sim=True,
+                      use_qnode_sim_matrix=False, matching_backend="networkx", workers=1,
+                      ke_match_cache_dir=None, ke_match_cache_max_bytes=KE_MATCH_CACHE_MAX_BYTES,
+                      arg_candidate_top_k=None, arg_candidate_min_similarity=None,
+                      validate_arg_candidate_pruning=False, sparse_similarity_floor=None,
+                      confidence_threshold_list=None):
     """
 
     Args:
@@ -632,10 +1647,39 @@ def match_ke_elements(output_dir, annotation_collection, ta2_collection, graph_g
         use_graph_g:
         sim_metric_list: List of similarity metrics. Options for isi metrics are
             ["class", "jc", "complex", "transe", "text", "topsim"]
+        prefetch_qnode_sim: whether to fetch the qnode similarity scores of all instances
+            that need matching in one run before matching, see prefetch_qnode_sim_scores
+        use_qnode_sim_matrix: whether to compute event and argument similarities from a dense
+            float32 QnodeSimMatrix of the scores instead of merging data frames
+        matching_backend: solver of the event matching, one of MATCHING_BACKENDS
+        workers: number of worker processes. With more than one worker, the instances are
+            matched in parallel, largest first, and their scores are added in instance order
+        ke_match_cache_dir: optional directory of a KEMatchCache. When given, the files of an
+            instance are restored from the cache if its tables and the match parameters are
+            unchanged, and computed again otherwise, whether or not they exist in output_dir
+        ke_match_cache_max_bytes: size above which the least recently used cached results
+            are evicted
+        arg_candidate_top_k: when given, the arguments of a TA2 event are only matched with
+            those of its top k annotation events by event similarity, see
+            get_arg_candidate_pair_df. The other pairs get an argument similarity of 0
+        arg_candidate_min_similarity: when given, the arguments of an event pair are only
+            matched if an event similarity metric of the pair is at least this value
+        validate_arg_candidate_pruning: whether to also match every instance without pruning
+            and report if the pruning changed the matched event pairs
+        sparse_similarity_floor: when given, only the event and argument similarities above
+            this floor are kept, in sparse tables and CSR matrices, and the events are matched
+            on the sparse event graph, see match_ke_ce_elements. With a floor of 0 the scores
+            are those of the dense mode. Needs a SciPy matching_backend
+        confidence_threshold_list: optional list of min_confidence_threshold values. When
+            given, every instance is also scored at each threshold from the event graph of its
+            match, and the scores of every instance and the mean scores of every TA1 and TA2
+            team pair at every threshold are written, see sweep_ke_ev_graph_confidence_thresholds
 
     Returns:
 
     """
+    if sparse_similarity_floor is not None and matching_backend == "networkx":
+        raise ValueError("The sparse similarity mode needs a SciPy matching backend")
     task_str = "task_1"
     if is_task2:
         task_str = "task_2"
@@ -686,109 +1730,110 @@ def match_ke_elements(output_dir, annotation_collection, ta2_collection, graph_g
                                                      "f1_text", "f1_topsim", "f1_transe"
                                                      ])
 
-    ta2_team_list = ta2_collection.ta2dict.keys()
-
-    for ta2_team in ta2_team_list:
-        ta2_instance = ta2_collection.ta2dict[ta2_team]
-        # it is possible by being
-        ce_list = pd.Series([key.split('.')[0].split('|')[2].lower()
-                             for key in ta2_instance.ta2dict.keys()]).unique().tolist()
-        # ce_list = ["ce2104"]
-        for ce in ce_list:
-            ta2_ce_items = [(key, value) for key, value
-                            in ta2_instance.ta2dict.items()
-                            if (ce == key.split('.')[0].split('|')[2].lower())]
-            # Now get all of the items in a ce
-            # As there are multiple instances per (ta1, ta2, ce), we want to cover them all
-            for key, value in ta2_ce_items:
-                ta2_ceinstance = value
-                instance_split = key.split('.')[0].split('|')
-                ta2_team_name = ta2_ceinstance.ta2_team_name
-                ce_item = instance_split[2].lower()
-                if ce != ce_item:
-                    print("Inconsistent: Finding ce item {} with loop of ce {}".format(ce_item, ce))
-                task1_ce = ce
-                # Get the relevant task1 annotaiton from the graphG task 2 event
-                if is_task2:
-                    task1_ce = ce[0:re.search("[0-9]+", ce).end()]
-                task1_ceannotation = annotation_collection.annotation_dict['task1|{}'.format(
-                    task1_ce)]
-                graph_g_ce_list = [value for key, value
-                                   in graph_g_collection.ta2dict['GRAPHG'].ta2dict.items()
-                                   if (ce == key.split("|")[2])]
-                # If empty, use the exposed version
-                if not graph_g_ce_list:
-                    graph_g_ce_list = [value for key, value
-                                       in graph_g_collection.ta2dict['GRAPHG'].ta2dict.items()
-                                       if (ce + "exposed" == key.split("|")[2])]
-                # There is only one Graph G instance per event
-                if len(graph_g_ce_list) > 1:
-                    print("Warning: Multiple Graph G instances of the same complex event")
-                    print("Using First of these")
-                print("graph g ce list for {}: ".format(ce), graph_g_ce_list)
-                graph_g_ce = graph_g_ce_list[0]
-                base_filename = ta2_ceinstance.ce_instance_file_name_base
-                if not os.path.isdir(output_dir):
-                    os.makedirs(output_dir)
-                if not os.path.isdir(os.path.join(output_dir, ta2_team_name)):
-                    os.makedirs(os.path.join(output_dir, ta2_team_name))
-
-                # Check for the files:
-                ev_graph_fpath = os.path.join(output_dir, ta2_team_name,
-                                              "{}_event_similarities.csv".format(base_filename))
-                ev_match_fpath = os.path.join(output_dir, ta2_team_name,
-                                              "{}_matched_events.csv".format(base_filename))
-                ke_score_fpath = os.path.join(output_dir, ta2_team_name,
-                                              "{}_ke_score_df.csv".format(base_filename))
-                ke_score_large_fpath = os.path.join(output_dir, ta2_team_name,
-                                                    "{}_ke_score_large_df.csv".format(
-                                                        base_filename))
-                ke_score_match_fpath = os.path.join(output_dir, ta2_team_name,
-                                                    "{}_ke_score_match_df.csv".format(
-                                                        base_filename))
-                ke_score_match_large_fpath = os.path.join(output_dir, ta2_team_name,
-                                                          "{}_ke_score_match_large_df.csv".format(
-                                                              base_filename))
-                if os.path.exists(ev_graph_fpath) and os.path.exists(
-                        ev_match_fpath) and os.path.exists(
-                    ke_score_fpath) and os.path.exists(ke_score_large_fpath) and \
-                        os.path.exists(ke_score_match_fpath) and \
-                        os.path.exists(ke_score_match_large_fpath):
-                    print("Importing Precomputed Data from {}".format(base_filename))
-                    ev_graph_df = pd.read_csv(ev_graph_fpath)
-                    ev_match_df = pd.read_csv(ev_match_fpath)
-                    ke_score_df = pd.read_csv(ke_score_fpath)
-                    ke_score_large_df = pd.read_csv(ke_score_large_fpath)
-                    ke_score_match_df = pd.read_csv(ke_score_match_fpath)
-                    ke_score_match_large_df = pd.read_csv(ke_score_match_large_fpath)
-                else:
-                    print("-- Computing Matches for {}".format(base_filename))
-                    ev_graph_df, ev_match_df, ke_score_df, ke_score_large_df, \
-                        ke_score_match_df, ke_score_match_large_df = \
-                        match_ke_ce_elements(
-                            task1_ceannotation, ta2_ceinstance,
-                            graph_g_ce, is_task2=is_task2,
-                            qnode_directory=qnode_directory,
-                            qnode_sim_fp=qnode_sim_fp,
-                            use_graphg=use_graph_g,
-                            min_confidence_threshold=min_confidence_threshold)
-                    ev_graph_df.to_csv(ev_graph_fpath, index=False)
-                    ev_match_df.to_csv(ev_match_fpath, index=False)
-                    ke_score_df.to_csv(ke_score_fpath, index=False)
-                    ke_score_large_df.to_csv(ke_score_large_fpath, index=False)
-                    ke_score_match_df.to_csv(ke_score_match_fpath, index=False)
-                    ke_score_match_large_df.to_csv(ke_score_match_large_fpath, index=False)
-                # Add the current score
-                ta2_score_df = pd.concat([ta2_score_df, ke_score_df], ignore_index=True)
-                ta2_score_large_df = pd.concat(
-                    [ta2_score_large_df, ke_score_large_df], ignore_index=True)
-                ta2_score_match_df = pd.concat([ta2_score_match_df, ke_score_match_df],
-                                               ignore_index=True)
-                ta2_score_match_large_df = pd.concat([ta2_score_match_large_df,
-                                                      ke_score_match_large_df],
-                                                     ignore_index=True)
-                del ev_graph_df, ev_match_df, ke_score_df, ke_score_large_df, \
-                    ke_score_match_df, ke_score_match_large_df
+    confidence_threshold_sweep = bool(confidence_threshold_list)
+    if not confidence_threshold_sweep:
+        confidence_threshold_list = None
+    instance_list = get_ke_match_instance_list(output_dir, annotation_collection,
+                                               ta2_collection, graph_g_collection, is_task2,
+                                               confidence_threshold_sweep)
+
+    ke_match_cache = None
+    ke_match_key_list = [None] * len(instance_list)
+    if ke_match_cache_dir is None:
+        # Check for the files:
+        compute_index_list = [index for index, (_, _, _, ke_match_file_paths)
+                              in enumerate(instance_list)
+                              if not all(os.path.exists(file_path)
+                                         for file_path in ke_match_file_paths)]
+    else:
+        # Restore the results of unchanged instances from the cache
+        ke_match_cache = KEMatchCache(ke_match_cache_dir, ke_match_cache_max_bytes)
+        match_params = dict(is_task2=is_task2, use_graph_g=use_graph_g,
+                            min_confidence_threshold=min_confidence_threshold,
+                            use_qnode_sim_matrix=use_qnode_sim_matrix,
+                            matching_backend=matching_backend,
+                            arg_candidate_top_k=arg_candidate_top_k,
+                            arg_candidate_min_similarity=arg_candidate_min_similarity,
+                            sparse_similarity_floor=sparse_similarity_floor)
+        if confidence_threshold_sweep:
+            match_params['confidence_threshold_list'] = list(confidence_threshold_list)
+        compute_index_list = []
+        for index, (task1_ceannotation, ta2_ceinstance, _, ke_match_file_paths) \
+                in enumerate(instance_list):
+            ke_match_key_list[index] = get_ke_match_cache_key(task1_ceannotation,
+                                                              ta2_ceinstance, match_params)
+            if not ke_match_cache.restore(ke_match_key_list[index], ke_match_file_paths):
+                compute_index_list.append(index)
+    prefetched_qnode_sim_df = None
+    if prefetch_qnode_sim:
+        prefetched_qnode_sim_df = prefetch_qnode_sim_scores(
+            [instance_list[index][0:2] for index in compute_index_list], qnode_directory,
+            qnode_sim_fp)
+    match_kwargs = dict(is_task2=is_task2, qnode_directory=qnode_directory,
+                        qnode_sim_fp=qnode_sim_fp, use_graphg=use_graph_g,
+                        min_confidence_threshold=min_confidence_threshold,
+                        use_qnode_sim_matrix=use_qnode_sim_matrix,
+                        matching_backend=matching_backend,
+                        arg_candidate_top_k=arg_candidate_top_k,
+                        arg_candidate_min_similarity=arg_candidate_min_similarity,
+                        validate_arg_candidate_pruning=validate_arg_candidate_pruning,
+                        sparse_similarity_floor=sparse_similarity_floor,
+                        confidence_threshold_list=confidence_threshold_list)
+
+    ke_score_df_list = [None] * len(instance_list)
+    parallel = workers > 1 and len(compute_index_list) > 1
+    for index, (task1_ceannotation, ta2_ceinstance, graph_g_ce, ke_match_file_paths) \
+            in enumerate(instance_list):
+        base_filename = ta2_ceinstance.ce_instance_file_name_base
+        if index not in compute_index_list:
+            print("Importing Precomputed Data from {}".format(base_filename))
+            # Only the scores are needed, the event files stay on disk
+            ke_score_df_list[index] = [pd.read_csv(file_path)
+                                       for file_path in ke_match_file_paths[2:]]
+        elif not parallel:
+            print("-- Computing Matches for {}".format(base_filename))
+            ke_score_df_list[index] = match_ke_ce_instance(
+                task1_ceannotation, ta2_ceinstance, graph_g_ce, ke_match_file_paths,
+                prefetched_qnode_sim_df=prefetched_qnode_sim_df, **match_kwargs)
+            if ke_match_cache is not None:
+                ke_match_cache.store(ke_match_key_list[index], ke_match_file_paths)
+
+    if parallel:
+        # Largest instances first, so that a large instance does not start last
+        compute_index_list.sort(key=lambda index: get_ke_match_size(*instance_list[index][0:2]),
+                                reverse=True)
+        # The similarity scores are sent to every worker once, when it starts
+        with ProcessPoolExecutor(max_workers=min(workers, len(compute_index_list)),
+                                 initializer=set_worker_qnode_sim_df,
+                                 initargs=(prefetched_qnode_sim_df,)) as executor:
+            future_dict = dict()
+            for index in compute_index_list:
+                task1_ceannotation, ta2_ceinstance, graph_g_ce, ke_match_file_paths = \
+                    instance_list[index]
+                print("-- Computing Matches for {}".format(
+                    ta2_ceinstance.ce_instance_file_name_base))
+                future_dict[executor.submit(match_ke_ce_instance_in_worker, task1_ceannotation,
+                                            ta2_ceinstance, graph_g_ce, ke_match_file_paths,
+                                            **match_kwargs)] = index
+            for future in as_completed(future_dict):
+                index = future_dict[future]
+                ke_score_df_list[index] = future.result()
+                if ke_match_cache is not None:
+                    ke_match_cache.store(ke_match_key_list[index], instance_list[index][3])
+                print("-- Finished Matches for {}".format(
+                    instance_list[index][1].ce_instance_file_name_base))
+
+    # Add the scores in instance order
+    for ke_score_df, ke_score_large_df, ke_score_match_df, ke_score_match_large_df \
+            in [ke_score_dfs[0:4] for ke_score_dfs in ke_score_df_list]:
+        ta2_score_df = pd.concat([ta2_score_df, ke_score_df], ignore_index=True)
+        ta2_score_large_df = pd.concat(
+            [ta2_score_large_df, ke_score_large_df], ignore_index=True)
+        ta2_score_match_df = pd.concat([ta2_score_match_df, ke_score_match_df],
+                                       ignore_index=True)
+        ta2_score_match_large_df = pd.concat([ta2_score_match_large_df,
+                                              ke_score_match_large_df],
+                                             ignore_index=True)
     # Write scores to file
     ta2_score_df.to_csv(
         os.path.join(output_dir, "TA2_{}_automated_instance_ke_scores.csv".format(task_str)),
@@ -808,6 +1853,31 @@ def match_ke_elements(output_dir, annotation_collection, ta2_collection, graph_g
                      "TA2_{}_automated_instance_matched_ke_scores_large.csv".format(
                          task_str)),
         index=False)
+    if confidence_threshold_sweep and ke_score_df_list:
+        write_ke_threshold_sweep_scores(
+            output_dir, task_str, [ke_score_dfs[4] for ke_score_dfs in ke_score_df_list],
+            [ke_score_dfs[5] for ke_score_dfs in ke_score_df_list])
+
+
+def write_ke_threshold_sweep_scores(output_dir, task_str, ke_sweep_df_list,
+                                    ke_sweep_match_df_list):
+    """
+    Writes the threshold sweeps of the instances of match_ke_elements, and the mean scores of
+    every TA1 and TA2 team pair at every threshold
+    """
+    for file_infix, ke_sweep_df_list in [("ke", ke_sweep_df_list),
+                                         ("matched_ke", ke_sweep_match_df_list)]:
+        ke_sweep_df = pd.concat(ke_sweep_df_list, ignore_index=True)
+        ke_sweep_df.to_csv(os.path.join(
+            output_dir, "TA2_{}_automated_instance_{}_threshold_sweep.csv".format(
+                task_str, file_infix)), index=False)
+        score_columns = ke_sweep_df.columns[6:].tolist()
+        ke_team_sweep_df = ke_sweep_df.groupby(
+            ['ta1_team_name', 'ta2_team_name', 'task', 'min_confidence_threshold'],
+            observed=True, sort=False)[score_columns].mean().reset_index()
+        ke_team_sweep_df.to_csv(os.path.join(
+            output_dir, "TA2_{}_automated_team_{}_threshold_sweep.csv".format(
+                task_str, file_infix)), index=False)
 
 
 # @profile
@@ -1,7 +1,6 @@
 import os
 import pandas as pd
 import yaml
-import ast
 import typing
 from collections import deque
 
@@ -124,14 +123,9 @@ def get_ta1_full_name(ev_id: str, ta1_library) -> str:
 
 def create_ta1_event_tree(ta1_library, output_dir):
     output_file = os.path.join(output_dir, "{}_event_tree.yml".format(ta1_library.ta1_team_name))
-    dforig = ta1_library.ev_df.copy(deep=True)
-    dfin = ta1_library.ev_df.copy(deep=True)
-    dfin['ev_child_list'] = dfin['ev_child_list'].apply(ast.literal_eval)
-    dfin = dfin.explode("ev_child_list")[["ev_id", "ev_child_list"]]
-    dfin = dfin.loc[pd.notnull(dfin["ev_child_list"]), :]
+    ev_hierarchy = ta1_library.event_hierarchy
     # Use all nodes with no parents as roots
-    child_list = pd.unique(dfin['ev_child_list']).tolist()
-    top_nodes = pd.unique(dforig.loc[~dforig['ev_id'].isin(child_list), 'ev_id']).tolist()
+    top_nodes = ev_hierarchy.root_ids
     yaml_tree_list = []
     for root in top_nodes:
         children_to_search = deque([root])
@@ -142,7 +136,7 @@ def create_ta1_event_tree(ta1_library, output_dir):
             parent = children_to_search.pop()
             parent_name = get_ta1_full_name(parent, ta1_library)
             searched_list.append(parent)
-            child_list = dfin.loc[dfin["ev_id"] == parent, 'ev_child_list'].tolist()
+            child_list = ev_hierarchy.get_children(parent)
             if len(child_list) > 0 and (child_list != ['']):
                 for child in child_list:
                     child_name = get_ta1_full_name(child, ta1_library)
@@ -150,11 +144,11 @@ def create_ta1_event_tree(ta1_library, output_dir):
                         children_to_search.append(child)
                         childnode = {child_name: []}
                         # If child is a leaf node, omit the '[]' for a leaf node
-                        if all(dforig.loc[dforig['ev_id'] == child, 'ev_child_list'] == "[]"):
+                        if ev_hierarchy.is_leaf(child):
                             childnode = child_name
                         children = node2children[parent_name]
                         children.append(childnode)
-                        if all(dforig.loc[dforig['ev_id'] == child, 'ev_child_list'] == "[]"):
+                        if ev_hierarchy.is_leaf(child):
                             node2children[child_name] = childnode
                         else:
                             node2children[child_name] = childnode[child_name]
@@ -239,9 +233,7 @@ def get_ta2_nearest_parent(child_id, parent_id, root_id, searched_list, ta2_ce_i
     """
     if include_all_events:
         return parent_id
-    dfin = ta2_ce_instance.ev_df.copy(deep=True)
-    dfin['ev_child_list'] = dfin['ev_child_list'].apply(ast.literal_eval)
-    dfin = dfin.explode("ev_child_list")[["ev_id", "ev_child_list"]]
+    ev_hierarchy = ta2_ce_instance.event_hierarchy
     if child_id == root_id:
         return root_id
     is_parent_ins, is_parent_pred = is_event_ins_or_pred(parent_id, ta2_ce_instance)
@@ -249,7 +241,7 @@ def get_ta2_nearest_parent(child_id, parent_id, root_id, searched_list, ta2_ce_i
         return parent_id
     ancestor_id = parent_id
     ancestor_searched_list = []
-    ancestors_to_search = dfin.loc[dfin["ev_child_list"] == ancestor_id, "ev_id"].tolist()
+    ancestors_to_search = ev_hierarchy.get_parents(ancestor_id)
     # We only check ancestors that have appeared in this tree already. The tree is depth-first
     # so we know that the root or a valid ancestor has been searched
     ancestors_to_examine = deque([x for x in ancestors_to_search if x in searched_list])
@@ -260,7 +252,7 @@ def get_ta2_nearest_parent(child_id, parent_id, root_id, searched_list, ta2_ce_i
         if is_ins or is_pred:
             return ancestor_id
         else:
-            ancestors_to_add = dfin.loc[dfin["ev_child_list"] == ancestor_id, "ev_id"].tolist()
+            ancestors_to_add = ev_hierarchy.get_parents(ancestor_id)
             for new_ancestor in ancestors_to_add:
                 if (new_ancestor in searched_list) and \
                    (not (new_ancestor in ancestor_searched_list)):
@@ -282,15 +274,10 @@ def create_ta2_event_tree(ta2_ce_instance, output_dir, include_all_events):
                                        ta2_ce_instance.ta2_team_name,
                                        ta2_ce_instance.ce_name))
 
-    dforig = ta2_ce_instance.ev_df.copy(deep=True)
-    dfin = ta2_ce_instance.ev_df.copy(deep=True)
-    dfin['ev_child_list'] = dfin['ev_child_list'].apply(ast.literal_eval)
-    dfin = dfin.explode("ev_child_list")[["ev_id", "ev_child_list"]]
-    dfin = dfin.loc[pd.notnull(dfin["ev_child_list"]), :]
+    ev_hierarchy = ta2_ce_instance.event_hierarchy
     # Use all nodes with no parents as roots
-    child_list = pd.unique(dfin['ev_child_list']).tolist()
     # Include all root nodes regardless of whether they are instantiated or not
-    top_nodes = pd.unique(dforig.loc[~dforig['ev_id'].isin(child_list), 'ev_id']).tolist()
+    top_nodes = ev_hierarchy.root_ids
     yaml_tree_list = []
     for root in top_nodes:
         children_to_search = deque([root])
@@ -300,7 +287,7 @@ def create_ta2_event_tree(ta2_ce_instance, output_dir, include_all_events):
         while len(children_to_search) > 0:
             parent = children_to_search.pop()
             searched_list.append(parent)
-            child_list = dfin.loc[dfin["ev_id"] == parent, 'ev_child_list'].tolist()
+            child_list = ev_hierarchy.get_children(parent)
             if len(child_list) > 0 and (child_list != ['']):
                 for child in child_list:
                     child_name = get_ta2_full_name(child, ta2_ce_instance)
@@ -315,12 +302,12 @@ def create_ta2_event_tree(ta2_ce_instance, output_dir, include_all_events):
                         children_to_search.append(child)
                         childnode = {child_name: []}
                         # If child is a leaf node, omit the '[]' for a leaf node
-                        if all(dforig.loc[dforig['ev_id'] == child, 'ev_child_list'] == "[]"):
+                        if ev_hierarchy.is_leaf(child):
                             childnode = child_name
                         if is_child_ins or is_child_pred or include_all_events:
                             children = node2children[nearest_parent_name]
                             children.append(childnode)
-                            if all(dforig.loc[dforig['ev_id'] == child, 'ev_child_list'] == "[]"):
+                            if ev_hierarchy.is_leaf(child):
                                 node2children[child_name] = childnode
                             else:
                                 node2children[child_name] = childnode[child_name]
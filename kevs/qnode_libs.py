@@ -1,77 +1,226 @@
 import pandas as pd
+import numpy as np
 import os
 import ast
 
+import io
 import json
+import asyncio
 import requests
-import itertools
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kevs.qnode_sim_cache import QNODE_SIM_COLUMNS, QnodeSimCache, get_qnode_sim_cache_path
+
+QNODE_SIM_API_URL = 'https://kgtk.isi.edu/similarity_api'
+# Qnode pairs per request, the API compares at most 100 pairs in a single request
+QNODE_SIM_BATCH_SIZE = 20
+# Requests that are sent to the similarity API at the same time
+QNODE_SIM_MAX_IN_FLIGHT = 4
+# Requests that are started per second, so we do not spam the query server
+QNODE_SIM_MAX_REQUESTS_PER_SECOND = 20
+QNODE_SIM_MAX_RETRIES = 3
+# Seconds to wait before the first retry of a failed request, doubled on every retry
+QNODE_SIM_BACKOFF_SECONDS = 0.5
+QNODE_SIM_REQUEST_TIMEOUT = 300
+
+# List literals of quoted strings without commas, quotes or escapes, which are split on the
+# commas instead of parsed with ast.literal_eval
+QNODE_LIST_ITEM_PATTERN = r'''(?:'[^'",\\]*'|"[^'",\\]*")'''
+QNODE_LIST_PATTERN = r'^\[\s*(?:{0}\s*,\s*)*{0}?\s*\]$'.format(QNODE_LIST_ITEM_PATTERN)
+# Normalized qnode field strings kept across instances, the cache is emptied when it is full
+QNODE_FIELD_CACHE_MAX_SIZE = 100000
+qnode_field_cache = dict()
 
 # code taken from https://github.com/usc-isi-i2/kgtk-similarity
 
 
-def call_semantic_similarity(input_file, url):
+def call_semantic_similarity(input_file, url, session=None):
     file_name = os.path.basename(input_file)
+    with open(input_file, mode='rb') as input_stream:
+        return post_semantic_similarity(file_name, input_stream, url, session)
+
+
+def post_semantic_similarity(file_name, input_stream, url, session=None):
+    """
+    Posts a tsv file of qnode pairs with columns q1 and q2 to the similarity API
+    Args:
+        file_name: file name sent with the upload
+        input_stream: binary file object with the tsv content
+        url: similarity API url
+        session: optional requests.Session, whose open connections are reused
+
+    Returns:
+        data frame with the similarity scores of the qnode pairs
+    """
     files = {
-        'file': (file_name, open(input_file, mode='rb'), 'application/octet-stream')
+        'file': (file_name, input_stream, 'application/octet-stream')
     }
-    resp = requests.post(url, files=files, params={'similarity_types': 'all'})
+    if session is None:
+        session = requests
+    resp = session.post(url, files=files, params={'similarity_types': 'all'},
+                        timeout=QNODE_SIM_REQUEST_TIMEOUT)
+    resp.raise_for_status()
     s = json.loads(resp.json())
     return pd.DataFrame(s)
 
 
+class RateLimiter:
+    """
+    Spaces the start of requests at least 1 / max_requests_per_second seconds apart
+    """
+
+    def __init__(self, max_requests_per_second: float):
+        self.interval = 1.0 / max_requests_per_second if max_requests_per_second else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+            self.next_start = max(now, self.next_start) + self.interval
+
+
+async def fetch_qnode_sim_batches(qnode_pair_df, url, on_batch_result=None,
+                                  batch_size=QNODE_SIM_BATCH_SIZE,
+                                  max_in_flight=QNODE_SIM_MAX_IN_FLIGHT,
+                                  max_requests_per_second=QNODE_SIM_MAX_REQUESTS_PER_SECOND,
+                                  max_retries=QNODE_SIM_MAX_RETRIES,
+                                  backoff_seconds=QNODE_SIM_BACKOFF_SECONDS):
+    """
+    Queries the similarity API for batches of qnode pairs, with up to max_in_flight requests
+    at the same time over a pool of kept-alive connections. Request bodies are written in
+    memory. Failed requests are retried with exponential backoff
+    Args:
+        qnode_pair_df: data frame with columns q1 and q2
+        url: similarity API url
+        on_batch_result: optional function that is called with the data frame of every batch
+            as soon as it arrives
+        batch_size: qnode pairs per request
+        max_in_flight: maximum number of concurrent requests
+        max_requests_per_second: maximum number of requests started per second, 0 for no limit
+        max_retries: retries of a failed request before the error is raised
+        backoff_seconds: wait before the first retry, doubled on every retry
+
+    Returns:
+        list of the data frames of the batches, in the order of qnode_pair_df
+    """
+    qnode_pair_df = qnode_pair_df.loc[:, ["q1", "q2"]]
+    batch_df_list = [qnode_pair_df.iloc[start:start + batch_size]
+                     for start in range(0, qnode_pair_df.shape[0], batch_size)]
+    if not batch_df_list:
+        return []
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    rate_limiter = RateLimiter(max_requests_per_second)
+
+    with requests.Session() as session, \
+            ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        async def fetch_batch(batch_index, batch_df):
+            body = batch_df.to_csv(index=False, sep='\t').encode()
+            async with semaphore:
+                for attempt in range(max_retries + 1):
+                    await rate_limiter.wait()
+                    try:
+                        qnode_temp_df = await loop.run_in_executor(
+                            executor, post_semantic_similarity,
+                            "nist_sim_api_input_{}.tsv".format(batch_index), io.BytesIO(body),
+                            url, session)
+                        return batch_index, qnode_temp_df
+                    except requests.RequestException as error:
+                        if attempt == max_retries:
+                            raise
+                        print("Similarity API request failed ({}), retrying".format(error))
+                        await asyncio.sleep(backoff_seconds * 2 ** attempt)
+
+        tasks = [asyncio.ensure_future(fetch_batch(batch_index, batch_df))
+                 for batch_index, batch_df in enumerate(batch_df_list)]
+        result_df_list = [None] * len(tasks)
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                batch_index, qnode_temp_df = await next_result
+                if on_batch_result is not None:
+                    on_batch_result(qnode_temp_df)
+                result_df_list[batch_index] = qnode_temp_df
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return result_df_list
+
+
 # adapted from https://github.com/usc-isi-i2/kgtk-similarity
 # See note: (to limit CPU resources, at most 100 pairs will be compared in a single request)
 def get_bulk_qnode_sim_scores(qnode_in_pair_df, qnode_directory, qnode_sim_fp,
-                              use_cached_queries=True):
+                              use_cached_queries=True, url=QNODE_SIM_API_URL,
+                              max_in_flight=QNODE_SIM_MAX_IN_FLIGHT):
+    """
+    Similarity scores of qnode pairs. Cached scores are looked up in the SQLite cache that
+    belongs to qnode_sim_fp (see get_qnode_sim_cache_path), and the remaining pairs are
+    queried from the similarity API with fetch_qnode_sim_batches and added to the cache
+    Args:
+        qnode_in_pair_df: data frame with columns q1 and q2
+        qnode_directory: qnode directory, not used since API requests are built in memory
+        qnode_sim_fp: qnode similarity cache file. A tsv file seeds a new SQLite cache
+        use_cached_queries: whether to use cached scores, otherwise all pairs are queried
+        url: similarity API url, for instance the url of a MockQnodeSimServer
+        max_in_flight: maximum number of concurrent API requests
+
+    Returns:
+        data frame with the similarity scores of the qnode pairs
+    """
     qnode_pair_df = qnode_in_pair_df.copy(deep=True)
-    qnode_sim_cached_df = pd.read_csv(qnode_sim_fp, sep='\t')
-    url = 'https://kgtk.isi.edu/similarity_api'
-    temp_fp = os.path.join(qnode_directory, "temp_nist_sim_api_input_file.tsv")
-    qnode_sim_df = pd.DataFrame(columns=['q1', 'q2', 'complex', 'q1_label', 'q2_label',
-                                         'transe', 'text', 'class', 'jc', 'topsim'])
-    added_entries = False
+    qnode_sim_df = pd.DataFrame(columns=QNODE_SIM_COLUMNS)
     # To avoid repeat computations for debugging, use cached queries whenever possible
 
     # Remove EMPTY_TBD Queries from cache since they are stored as a blank
     qnode_pair_df = qnode_pair_df.loc[qnode_pair_df['q2'] != "EMPTY_TBD", :]
 
-    # To DO: Fix a caching bug to make qnode_pair_df empty as there seems to be an error
-    # outside of the coding
-    if use_cached_queries:
-        qnode_sim_df = pd.merge(qnode_pair_df, qnode_sim_cached_df, how="left")
-        qnode_check_df = qnode_sim_df.loc[pd.isna(qnode_sim_df['topsim']), ["q1", "q2"]]
-        qnode_check_df.reset_index(drop=True, inplace=True)
-        qnode_sim_df = qnode_sim_df.loc[pd.notna(qnode_sim_df['topsim']), :]
-    else:
-        qnode_check_df = qnode_pair_df
-
-    curr_start = 0
-    while curr_start < qnode_check_df.shape[0]:
-        # So we do not spam the query server
-        time.sleep(0.01)
-        if curr_start + 19 <= qnode_check_df.shape[0]:
-            temp_df = qnode_check_df.loc[curr_start:curr_start+19, ]
+    with QnodeSimCache(get_qnode_sim_cache_path(qnode_sim_fp), qnode_sim_fp) as qnode_sim_cache:
+        if use_cached_queries:
+            qnode_sim_df = qnode_sim_cache.lookup(qnode_pair_df)
+            qnode_check_df = pd.merge(qnode_pair_df.loc[:, ["q1", "q2"]],
+                                      qnode_sim_df.loc[:, ["q1", "q2"]],
+                                      how="left", indicator=True)
+            qnode_check_df = qnode_check_df.loc[qnode_check_df['_merge'] == "left_only",
+                                                ["q1", "q2"]]
+            qnode_check_df.reset_index(drop=True, inplace=True)
         else:
-            temp_df = qnode_check_df.loc[curr_start:, ]
-        # Write temp file for each query
-        temp_df.to_csv(temp_fp, index=False, sep='\t')
-        qnode_temp_df = call_semantic_similarity(temp_fp, url)
-        added_entries = True
-        qnode_sim_df = pd.concat([qnode_sim_df, qnode_temp_df], ignore_index=True)
-        curr_start += 20
-
-    if added_entries:
-        # Remove any duplicates from the enhanced file
-        qnode_sim_df = qnode_sim_df.drop_duplicates().reset_index(drop=True)
-        # Remove any duplicates from the cached file
-        qnode_sim_cached_df = pd.concat([qnode_sim_cached_df, qnode_sim_df], ignore_index=True). \
-            drop_duplicates().reset_index(drop=True)
-        qnode_sim_cached_df.to_csv(qnode_sim_fp, index=False, sep='\t')
+            qnode_check_df = qnode_pair_df.reset_index(drop=True)
+
+        if qnode_check_df.shape[0] > 0:
+            # Each batch is cached as it arrives, so an interrupted run keeps its queries
+            qnode_temp_df_list = asyncio.run(fetch_qnode_sim_batches(
+                qnode_check_df, url, on_batch_result=qnode_sim_cache.insert,
+                max_in_flight=max_in_flight))
+            qnode_sim_df = pd.concat([qnode_sim_df] + qnode_temp_df_list, ignore_index=True)
+            # Remove any duplicates from the enhanced file
+            qnode_sim_df = qnode_sim_df.drop_duplicates().reset_index(drop=True)
 
     return qnode_sim_df
 
 
+def select_qnode_sim_scores(qnode_in_pair_df, qnode_sim_df):
+    """
+    Similarity scores of a set of qnode pairs, taken from the scores of a larger set of pairs
+    that were fetched beforehand with get_bulk_qnode_sim_scores
+    Args:
+        qnode_in_pair_df: data frame with columns q1 and q2
+        qnode_sim_df: similarity scores returned by get_bulk_qnode_sim_scores
+
+    Returns:
+        data frame with the similarity scores of the qnode pairs, in the order of the pairs
+    """
+    qnode_pair_df = qnode_in_pair_df.loc[:, ["q1", "q2"]].drop_duplicates()
+    return pd.merge(qnode_pair_df, qnode_sim_df, on=["q1", "q2"], how="inner")
+
+
 def clean_qnode_field(qnode: str):
     if '[' in qnode:
         new_qnode = ast.literal_eval(qnode)
@@ -81,6 +230,57 @@ def clean_qnode_field(qnode: str):
     return new_qnode
 
 
+def get_clean_qnode_lists(qnode_values) -> list:
+    """
+    Vectorized clean_qnode_field of many qnode fields. List literals of plain quoted strings
+    are recognized with a regular expression and split on their commas, and the wd: and wiki:
+    prefixes are removed with pandas string methods. Other fields fall back to
+    clean_qnode_field. Results are memoized in qnode_field_cache, so a qnode field is only
+    normalized once across instances
+    Args:
+        qnode_values: unique qnode field strings
+
+    Returns:
+        list with the tuple of normalized qnodes of every qnode field
+    """
+    new_values = pd.unique(pd.Series([value for value in qnode_values
+                                      if value not in qnode_field_cache], dtype=object))
+    if len(new_values) > 0:
+        if len(qnode_field_cache) + len(new_values) > QNODE_FIELD_CACHE_MAX_SIZE:
+            qnode_field_cache.clear()
+        new_series = pd.Series(new_values, dtype=object)
+        str_series = new_series[new_series.map(type).eq(str)].astype(str)
+        is_list = str_series.str.contains('[', regex=False)
+        is_plain_list = is_list & str_series.str.match(QNODE_LIST_PATTERN)
+        # Plain qnode fields are a list of one qnode. The items are kept in the order of
+        # the fields, then of their position in the list
+        item_positions = [str_series.index[~is_list].to_numpy()]
+        item_values = [str_series[~is_list].to_numpy()]
+        if is_plain_list.any():
+            list_item_series = str_series[is_plain_list].str.slice(1, -1).str.strip().\
+                str.rstrip(',').str.split(',').explode().str.strip()
+            # Only empty lists give an empty item, quoted items are at least two characters
+            list_item_series = list_item_series[list_item_series.str.len() > 0]
+            item_positions.append(list_item_series.index.to_numpy())
+            item_values.append(list_item_series.str.slice(1, -1).to_numpy())
+        item_positions = np.concatenate(item_positions)
+        item_order = np.argsort(item_positions, kind='stable')
+        item_values = pd.Series(np.concatenate(item_values)[item_order], dtype=str).\
+            str.replace("wd:", "", regex=False).str.replace("wiki:", "", regex=False).tolist()
+        item_counts = np.bincount(item_positions, minlength=len(new_values))
+        item_starts = np.cumsum(item_counts) - item_counts
+        is_parsed = np.zeros(len(new_values), dtype=bool)
+        is_parsed[str_series.index[~is_list | is_plain_list]] = True
+        for position, value in enumerate(new_values):
+            if is_parsed[position]:
+                item_start = item_starts[position]
+                qnode_field_cache[value] = tuple(
+                    item_values[item_start:item_start + item_counts[position]])
+            else:
+                qnode_field_cache[value] = tuple(clean_qnode_field(value))
+    return [qnode_field_cache[value] for value in qnode_values]
+
+
 def process_ta2_qnode_fields(ta2_df, id_field_name="id", qnode_field_name="qnode",
                              qnode_backup_field_name="ev_qnode"):
     """
@@ -108,8 +308,26 @@ def process_ta2_qnode_fields(ta2_df, id_field_name="id", qnode_field_name="qnode
     ta2_proc_df.drop(columns=[qnode_backup_field_name], inplace=True)
     # Now drop what is still missing
     ta2_proc_df.dropna(axis=0, inplace=True)
-    ta2_proc_df['qnode_proc'] = ta2_proc_df['qnode_orig'].apply(clean_qnode_field)
-    ta2_proc_df = ta2_proc_df.explode("qnode_proc")
+    if ta2_proc_df.shape[0] == 0:
+        ta2_proc_df['qnode_proc'] = ta2_proc_df['qnode_orig']
+        return ta2_proc_df.loc[:, ["id", "qnode_proc"]]
+    # Each distinct qnode field is normalized once, then the rows are repeated for each of
+    # their qnodes. Like explode, a row with an empty list gets a missing qnode
+    qnode_codes, qnode_values = pd.factorize(ta2_proc_df['qnode_orig'])
+    qnode_lists = [qnode_list if len(qnode_list) > 0 else (np.nan,)
+                   for qnode_list in get_clean_qnode_lists(qnode_values)]
+    qnode_list_lengths = np.array([len(qnode_list) for qnode_list in qnode_lists],
+                                  dtype=np.int64)
+    qnode_list_starts = np.cumsum(qnode_list_lengths) - qnode_list_lengths
+    qnode_items = np.empty(qnode_list_lengths.sum(), dtype=object)
+    qnode_items[:] = [qnode for qnode_list in qnode_lists for qnode in qnode_list]
+    row_lengths = qnode_list_lengths[qnode_codes]
+    row_starts = np.cumsum(row_lengths) - row_lengths
+    item_positions = np.repeat(qnode_list_starts[qnode_codes] - row_starts, row_lengths) + \
+        np.arange(row_lengths.sum())
+    ta2_proc_df = ta2_proc_df.iloc[np.repeat(np.arange(ta2_proc_df.shape[0]), row_lengths)]
+    ta2_proc_df = ta2_proc_df.assign(qnode_proc=pd.Series(qnode_items[item_positions],
+                                                          index=ta2_proc_df.index))
     return ta2_proc_df.loc[:, ["id", "qnode_proc"]]
 
 
@@ -142,10 +360,43 @@ def produce_qnode_pair_df(ta2_proc_qnode_df, ann_proc_qnode_df):
     Returns:
         A data frame with fields q1 (for the ta2 ev_qnode) and q2 (for the annotation ev qnode)
     """
-    ta2_qnode_list = ta2_proc_qnode_df['qnode_proc']
-    ann_qnode_list = ann_proc_qnode_df['qnode_proc']
+    return produce_qnode_pair_union_df([(ta2_proc_qnode_df, ann_proc_qnode_df)])
 
-    prod_df = pd.DataFrame(itertools.product(ta2_qnode_list, ann_qnode_list), columns=["q1", "q2"])
-    # Drop duplicates
-    prod_df = prod_df.drop_duplicates().reset_index(drop=True)
-    return prod_df
+
+def produce_qnode_pair_union_df(proc_qnode_df_pair_list: list) -> pd.DataFrame:
+    """
+    Distinct qnode pairs of several produce_qnode_pair_df products, such as the event and the
+    argument qnode pairs of an instance. The qnodes of each side are interned to integer codes,
+    and each product is built from the distinct codes of its two sides, so that it has no
+    duplicates to begin with. The pairs stay integer coded until they are decoded to q1 and q2
+    at the end. Pairs come in the order of the products, then of the first rows of q1 and q2
+    Args:
+        proc_qnode_df_pair_list: list of (ta2_proc_qnode_df, ann_proc_qnode_df) tuples
+
+    Returns:
+        A data frame with fields q1 (for the ta2 qnode) and q2 (for the annotation qnode)
+    """
+    if len(proc_qnode_df_pair_list) == 0:
+        return pd.DataFrame(columns=["q1", "q2"])
+    q1_codes, q1_qnodes = pd.factorize(pd.concat(
+        [ta2_proc_qnode_df['qnode_proc'] for ta2_proc_qnode_df, _ in proc_qnode_df_pair_list],
+        ignore_index=True), use_na_sentinel=False)
+    q2_codes, q2_qnodes = pd.factorize(pd.concat(
+        [ann_proc_qnode_df['qnode_proc'] for _, ann_proc_qnode_df in proc_qnode_df_pair_list],
+        ignore_index=True), use_na_sentinel=False)
+    num_q2 = max(len(q2_qnodes), 1)
+    pair_key_list = []
+    q1_start = 0
+    q2_start = 0
+    for ta2_proc_qnode_df, ann_proc_qnode_df in proc_qnode_df_pair_list:
+        q1_end = q1_start + ta2_proc_qnode_df.shape[0]
+        q2_end = q2_start + ann_proc_qnode_df.shape[0]
+        q1_grid, q2_grid = np.meshgrid(pd.unique(q1_codes[q1_start:q1_end]),
+                                       pd.unique(q2_codes[q2_start:q2_end]), indexing='ij')
+        pair_key_list.append(q1_grid.ravel().astype(np.int64) * num_q2 + q2_grid.ravel())
+        q1_start = q1_end
+        q2_start = q2_end
+    # Products of different pairs of data frames can share pairs
+    pair_keys = pd.unique(np.concatenate(pair_key_list))
+    return pd.DataFrame({"q1": q1_qnodes.take(pair_keys // num_q2),
+                         "q2": q2_qnodes.take(pair_keys % num_q2)})
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+# Columns of the similarity API results, as stored in the cache
+QNODE_SIM_COLUMNS = ['q1', 'q2', 'complex', 'q1_label', 'q2_label',
+                     'transe', 'text', 'class', 'jc', 'topsim']
+# Seconds a process waits for another process that is writing to the cache
+QNODE_SIM_CACHE_TIMEOUT = 120
+
+
+def get_qnode_sim_cache_path(qnode_sim_fp: str) -> str:
+    """
+    Path of the SQLite cache that belongs to a qnode similarity cache file such as
+    nist_isi_qnode_sim_cache.tsv. A tsv file at qnode_sim_fp seeds a new cache
+    """
+    if qnode_sim_fp.endswith('.tsv'):
+        return os.path.splitext(qnode_sim_fp)[0] + '.sqlite'
+    return qnode_sim_fp
+
+
+class QnodeSimCache:
+    """
+    Qnode similarity scores of the similarity API, indexed on the (q1, q2) qnode pair and
+    stored in a SQLite database that several scoring processes can share. Entries are only
+    added, except that an entry without a topsim score is replaced when the pair is queried again
+    """
+
+    def __init__(self, cache_path: str, seed_tsv_path: str = None):
+        """
+        Opens the cache, creating it if needed
+        Args:
+            cache_path: SQLite database file
+            seed_tsv_path: optional tsv file of cached scores that is imported when the cache
+                is created
+        """
+        self.cache_path = cache_path
+        self.connection = sqlite3.connect(cache_path, timeout=QNODE_SIM_CACHE_TIMEOUT,
+                                          isolation_level=None)
+        # Readers do not block the process that is writing new scores
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS qnode_sim (q1 TEXT NOT NULL, q2 TEXT NOT NULL, "
+                "complex REAL, q1_label TEXT, q2_label TEXT, transe REAL, text REAL, "
+                "class REAL, jc REAL, topsim REAL, PRIMARY KEY (q1, q2)) WITHOUT ROWID")
+            # user_version marks a cache that has been seeded
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] == 0:
+                if seed_tsv_path is not None and os.path.isfile(seed_tsv_path):
+                    self._insert_rows(pd.read_csv(seed_tsv_path, sep='\t'))
+                self.connection.execute("PRAGMA user_version = 1")
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            self.connection.close()
+            raise
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lookup(self, qnode_pair_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Cached scores of a set of qnode pairs
+        Args:
+            qnode_pair_df: data frame with columns q1 and q2
+
+        Returns:
+            data frame with QNODE_SIM_COLUMNS for the cached pairs, in the order of
+            qnode_pair_df. Pairs that are not cached, or have no topsim score, are left out
+        """
+        connection = self.connection
+        # The pairs go to a temporary table so that the lookup is a single indexed join
+        connection.execute("BEGIN")
+        try:
+            connection.execute("CREATE TEMP TABLE IF NOT EXISTS qnode_pair (q1 TEXT, q2 TEXT)")
+            connection.execute("DELETE FROM qnode_pair")
+            connection.executemany("INSERT INTO qnode_pair VALUES (?, ?)",
+                                   qnode_pair_df.loc[:, ['q1', 'q2']].astype(str).
+                                   itertuples(index=False, name=None))
+            qnode_sim_df = pd.read_sql_query(
+                "SELECT {} FROM qnode_pair p JOIN qnode_sim s ON s.q1 = p.q1 AND s.q2 = p.q2 "
+                "WHERE s.topsim IS NOT NULL ORDER BY p.rowid".format(
+                    ", ".join("s.{}".format(column) for column in QNODE_SIM_COLUMNS)),
+                connection)
+            connection.execute("DELETE FROM qnode_pair")
+        finally:
+            connection.execute("COMMIT")
+        return qnode_sim_df
+
+    def insert(self, qnode_sim_df: pd.DataFrame) -> None:
+        """
+        Adds the scores of newly queried qnode pairs. Rows of pairs that are already cached
+        with a topsim score are ignored
+        Args:
+            qnode_sim_df: data frame with the QNODE_SIM_COLUMNS returned by the similarity API
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert_rows(qnode_sim_df)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def _insert_rows(self, qnode_sim_df: pd.DataFrame) -> None:
+        row_df = qnode_sim_df.reindex(columns=QNODE_SIM_COLUMNS)
+        row_df = row_df.loc[pd.notna(row_df['q1']) & pd.notna(row_df['q2']), :].astype(object)
+        row_df = row_df.where(pd.notna(row_df), None)
+        self.connection.executemany(
+            "INSERT INTO qnode_sim ({columns}) VALUES ({values}) "
+            "ON CONFLICT (q1, q2) DO UPDATE SET {updates} "
+            "WHERE qnode_sim.topsim IS NULL".format(
+                columns=", ".join(QNODE_SIM_COLUMNS),
+                values=", ".join("?" * len(QNODE_SIM_COLUMNS)),
+                updates=", ".join("{0} = excluded.{0}".format(column)
+                                  for column in QNODE_SIM_COLUMNS[2:])),
+            row_df.itertuples(index=False, name=None))
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM qnode_sim").fetchone()[0]
@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, vstack
+
+# Similarity metrics of the similarity API, in the order of the last axis of the matrix
+QNODE_SIM_METRICS = ['class', 'complex', 'jc', 'text', 'topsim', 'transe']
+QNODE_SIM_MATRIX_DTYPE = np.float32
+# Maximum number of qnode pair cells gathered from the matrix at a time
+QNODE_SIM_MAX_BLOCK_SIZE = 2 ** 22
+
+
+class QnodeSimMatrix:
+    """
+    Similarity scores of a set of qnode pairs as a dense (n_q1 x n_q2 x 6) array. The q1 and
+    q2 qnodes are interned to integer codes, so that the scores of many pairs are gathered with
+    NumPy fancy indexing instead of data frame merges on q1 and q2. Scores of pairs that are
+    listed more than once are averaged. The last row and column stand for qnodes without
+    scores, which get the code -1
+    """
+
+    def __init__(self, qnode_sim_df: pd.DataFrame, dtype=QNODE_SIM_MATRIX_DTYPE):
+        """
+        Args:
+            qnode_sim_df: similarity scores returned by get_bulk_qnode_sim_scores
+            dtype: float type of the stored scores
+        """
+        sim_df = qnode_sim_df.loc[pd.notna(qnode_sim_df['q1']) & pd.notna(qnode_sim_df['q2']),
+                                  ['q1', 'q2'] + QNODE_SIM_METRICS].copy()
+        for metric in QNODE_SIM_METRICS:
+            sim_df[metric] = pd.to_numeric(sim_df[metric], errors="coerce")
+        sim_df = sim_df.groupby(['q1', 'q2'], sort=False).mean().reset_index()
+        q1_codes, self.q1_index = pd.factorize(sim_df['q1'])
+        q2_codes, self.q2_index = pd.factorize(sim_df['q2'])
+        self.q1_index = pd.Index(self.q1_index)
+        self.q2_index = pd.Index(self.q2_index)
+        num_q1 = len(self.q1_index)
+        num_q2 = len(self.q2_index)
+        self.values = np.full((num_q1 + 1, num_q2 + 1, len(QNODE_SIM_METRICS)), np.nan,
+                              dtype=dtype)
+        self.values[q1_codes, q2_codes, :] = sim_df.loc[:, QNODE_SIM_METRICS].to_numpy()
+        self.has_pair = np.zeros((num_q1 + 1, num_q2 + 1), dtype=bool)
+        self.has_pair[q1_codes, q2_codes] = True
+
+    def get_q1_codes(self, qnodes) -> np.ndarray:
+        return self.q1_index.get_indexer(pd.Index(qnodes))
+
+    def get_q2_codes(self, qnodes) -> np.ndarray:
+        return self.q2_index.get_indexer(pd.Index(qnodes))
+
+    def get_segment_sim_df(self, q1_df: pd.DataFrame, q1_keys: list,
+                           q2_df: pd.DataFrame, q2_keys: list) -> pd.DataFrame:
+        """
+        Mean similarity of every pair of q1 and q2 segments. A segment is a group of rows with
+        the same key values, such as the qnodes of an event. The mean is taken over the qnode
+        pairs of the two segments that have scores, counting repeated rows, and skips missing
+        scores, which matches merging the rows with the scores and averaging with groupby
+        Args:
+            q1_df: data frame with the q1_keys columns and column q1
+            q1_keys: segment columns of q1_df
+            q2_df: data frame with the q2_keys columns and column q2
+            q2_keys: segment columns of q2_df
+
+        Returns:
+            data frame with the q1_keys, q2_keys and QNODE_SIM_METRICS columns, for the segment
+            pairs that have at least one scored qnode pair
+        """
+        q1_df = q1_df.dropna(subset=q1_keys)
+        q2_df = q2_df.dropna(subset=q2_keys)
+        q1_segment_df, q1_starts, q1_codes = self._get_segments(q1_df, q1_keys, 'q1')
+        q2_segment_df, q2_starts, q2_codes = self._get_segments(q2_df, q2_keys, 'q2')
+        if q1_segment_df.shape[0] == 0 or q2_segment_df.shape[0] == 0:
+            return pd.DataFrame(columns=q1_keys + q2_keys + QNODE_SIM_METRICS)
+
+        q1_segment_list = []
+        q2_segment_list = []
+        means_list = []
+        for block_start, sums, counts, pair_counts in self._get_segment_blocks(
+                q1_starts, q1_codes, q2_starts, q2_codes):
+            q1_segments, q2_segments = np.nonzero(pair_counts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means_list.append(sums[q1_segments, q2_segments] /
+                                  counts[q1_segments, q2_segments])
+            q1_segment_list.append(q1_segments + block_start)
+            q2_segment_list.append(q2_segments)
+        q1_segments = np.concatenate(q1_segment_list)
+        q2_segments = np.concatenate(q2_segment_list)
+        segment_sim_df = pd.concat(
+            [q1_segment_df.iloc[q1_segments].reset_index(drop=True),
+             q2_segment_df.iloc[q2_segments].reset_index(drop=True),
+             pd.DataFrame(np.concatenate(means_list), columns=QNODE_SIM_METRICS)], axis=1)
+        return segment_sim_df
+
+    def get_sparse_segment_sim(self, q1_df: pd.DataFrame, q1_keys: list,
+                               q2_df: pd.DataFrame, q2_keys: list,
+                               min_similarity: float = 0.0) -> 'SparseSegmentSim':
+        """
+        Sparse form of get_segment_sim_df for large sets of segments, such as the arguments of
+        instances with hundreds of events. Only the segment pairs with a mean above
+        min_similarity for at least one metric keep their means; the other pairs with scored
+        qnode pairs are only recorded in a boolean CSR matrix. Missing means count as 0
+        Args:
+            q1_df: data frame with the q1_keys columns and column q1
+            q1_keys: segment columns of q1_df
+            q2_df: data frame with the q2_keys columns and column q2
+            q2_keys: segment columns of q2_df
+            min_similarity: similarity floor of the kept means
+
+        Returns:
+            SparseSegmentSim of the segment pairs
+        """
+        q1_df = q1_df.dropna(subset=q1_keys)
+        q2_df = q2_df.dropna(subset=q2_keys)
+        q1_segment_df, q1_starts, q1_codes = self._get_segments(q1_df, q1_keys, 'q1')
+        q2_segment_df, q2_starts, q2_codes = self._get_segments(q2_df, q2_keys, 'q2')
+        shape = (q1_segment_df.shape[0], q2_segment_df.shape[0])
+        pair_matrix_list = []
+        q1_segment_list = [np.array([], dtype=np.int64)]
+        q2_segment_list = [np.array([], dtype=np.int64)]
+        means_list = [np.zeros((0, len(QNODE_SIM_METRICS)))]
+        if shape[0] > 0 and shape[1] > 0:
+            for block_start, sums, counts, pair_counts in self._get_segment_blocks(
+                    q1_starts, q1_codes, q2_starts, q2_codes):
+                pair_matrix_list.append(csr_matrix(pair_counts > 0))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    means = sums / counts
+                # Comparisons with missing means are False
+                q1_segments, q2_segments = np.nonzero(
+                    (pair_counts > 0) & (means > min_similarity).any(axis=2))
+                means_list.append(means[q1_segments, q2_segments])
+                q1_segment_list.append(q1_segments + block_start)
+                q2_segment_list.append(q2_segments)
+        pair_matrix = vstack(pair_matrix_list, format='csr') if pair_matrix_list \
+            else csr_matrix(shape, dtype=bool)
+        q1_segments = np.concatenate(q1_segment_list)
+        q2_segments = np.concatenate(q2_segment_list)
+        sim_df = pd.concat(
+            [pd.DataFrame({'q1_segment': q1_segments, 'q2_segment': q2_segments}),
+             q1_segment_df.iloc[q1_segments].reset_index(drop=True),
+             q2_segment_df.iloc[q2_segments].reset_index(drop=True),
+             pd.DataFrame(np.concatenate(means_list), columns=QNODE_SIM_METRICS)], axis=1)
+        return SparseSegmentSim(q1_segment_df, q2_segment_df, pair_matrix, sim_df)
+
+    def _get_segment_blocks(self, q1_starts, q1_codes, q2_starts, q2_codes):
+        # Yields the score sums, score counts and scored pair counts of the segment pairs of
+        # blocks of whole q1 segments, which bounds the memory of the gathered scores
+        num_metrics = len(QNODE_SIM_METRICS)
+        max_rows = max(1, QNODE_SIM_MAX_BLOCK_SIZE // (len(q2_codes) * num_metrics))
+        block_start = 0
+        while block_start < len(q1_starts):
+            block_end = np.searchsorted(q1_starts, q1_starts[block_start] + max_rows,
+                                        side='right')
+            block_end = max(block_end, block_start + 1)
+            row_start = q1_starts[block_start]
+            row_end = q1_starts[block_end] if block_end < len(q1_starts) else len(q1_codes)
+            block_codes = q1_codes[row_start:row_end]
+            block_starts = q1_starts[block_start:block_end] - row_start
+            block_values = self.values[block_codes[:, None], q2_codes[None, :], :]
+            scored = ~np.isnan(block_values)
+            block_values = np.where(scored, block_values, 0).astype(np.float64)
+            sums = self._segment_sum(block_values, block_starts, q2_starts)
+            counts = self._segment_sum(scored.astype(np.int64), block_starts, q2_starts)
+            pair_counts = self._segment_sum(
+                self.has_pair[block_codes[:, None], q2_codes[None, :]].astype(np.int64),
+                block_starts, q2_starts)
+            yield block_start, sums, counts, pair_counts
+            block_start = block_end
+
+    def _get_segments(self, qnode_df, keys, qnode_column):
+        # Rows of a segment are made contiguous, segments are numbered in sorted key order
+        qnode_df = qnode_df.sort_values(keys, kind='stable')
+        segment_codes = qnode_df.groupby(keys, sort=False).ngroup().to_numpy()
+        starts = np.flatnonzero(np.r_[True, segment_codes[1:] != segment_codes[:-1]]) \
+            if len(segment_codes) > 0 else np.array([], dtype=np.int64)
+        segment_df = qnode_df.iloc[starts].loc[:, keys].reset_index(drop=True)
+        if qnode_column == 'q1':
+            codes = self.get_q1_codes(qnode_df['q1'])
+        else:
+            codes = self.get_q2_codes(qnode_df['q2'])
+        return segment_df, starts, codes
+
+    @staticmethod
+    def _segment_sum(block, q1_starts, q2_starts):
+        return np.add.reduceat(np.add.reduceat(block, q1_starts, axis=0), q2_starts, axis=1)
+
+
+class SparseSegmentSim:
+    """
+    Segment similarities of QnodeSimMatrix.get_sparse_segment_sim. pair_matrix is a boolean
+    (q1 segment x q2 segment) CSR matrix of the segment pairs with scored qnode pairs, and
+    sim_df has the q1_segment and q2_segment numbers, the segment keys and the means of the
+    pairs above the similarity floor, in segment order. Segments are numbered in the row
+    order of q1_segment_df and q2_segment_df
+    """
+
+    def __init__(self, q1_segment_df: pd.DataFrame, q2_segment_df: pd.DataFrame,
+                 pair_matrix: csr_matrix, sim_df: pd.DataFrame):
+        self.q1_segment_df = q1_segment_df
+        self.q2_segment_df = q2_segment_df
+        self.pair_matrix = pair_matrix
+        self.sim_df = sim_df
+
+    def select_q1_segments(self, keep: np.ndarray) -> 'SparseSegmentSim':
+        """
+        Similarities of the q1 segments where keep is True, numbered again in their order
+        """
+        q1_segments = np.cumsum(keep) - 1
+        sim_df = self.sim_df.loc[keep[self.sim_df['q1_segment'].to_numpy()], :]
+        sim_df = sim_df.assign(q1_segment=q1_segments[sim_df['q1_segment'].to_numpy()]).\
+            reset_index(drop=True)
+        return SparseSegmentSim(self.q1_segment_df.loc[keep, :].reset_index(drop=True),
+                                self.q2_segment_df, self.pair_matrix[np.flatnonzero(keep)],
+                                sim_df)
@@ -0,0 +1,109 @@
+import json
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import pandas as pd
+
+from kevs.qnode_sim_cache import QNODE_SIM_COLUMNS
+
+
+class MockQnodeSimServer:
+    """
+    Local stand-in for the similarity API, so that qnode similarity queries can be tested and
+    benchmarked offline. Scores are served from a fixture table with the QNODE_SIM_COLUMNS, for
+    instance a qnode similarity cache tsv file. Pairs that are not in the table are returned
+    without scores, like pairs the similarity API cannot compare
+    """
+
+    def __init__(self, qnode_sim_df: pd.DataFrame, host: str = "127.0.0.1", port: int = 0,
+                 num_failures: int = 0, delay_seconds: float = 0):
+        """
+        Args:
+            qnode_sim_df: fixture table of similarity scores
+            host: host name to listen on
+            port: port to listen on, 0 picks a free port
+            num_failures: number of first requests that are answered with a 503 error, to
+                exercise the retries of the client
+            delay_seconds: time the server takes to answer every request
+        """
+        self.qnode_sim_df = qnode_sim_df.reindex(columns=QNODE_SIM_COLUMNS).drop_duplicates(
+            subset=["q1", "q2"]).astype({"q1": str, "q2": str})
+        self.num_failures = num_failures
+        self.delay_seconds = delay_seconds
+        self.num_requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[0:2]
+        return "http://{}:{}/similarity_api".format(host, port)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_scores(self, qnode_pair_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Rows of the fixture table for the requested qnode pairs, in request order
+        """
+        qnode_pair_df = qnode_pair_df.loc[:, ["q1", "q2"]].astype(str)
+        return pd.merge(qnode_pair_df, self.qnode_sim_df, on=["q1", "q2"], how="left")
+
+    def _make_handler(self):
+        server = self
+
+        class QnodeSimRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server.lock:
+                    server.num_requests += 1
+                    fail_request = server.num_requests <= server.num_failures
+                if server.delay_seconds:
+                    threading.Event().wait(server.delay_seconds)
+                if fail_request:
+                    self._send(503, b"")
+                    return
+                # The tsv file is the single part of the multipart form upload
+                message = BytesParser(policy=HTTP).parsebytes(
+                    b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" +
+                    body)
+                input_tsv = next(message.iter_parts()).get_payload(decode=True).decode()
+                qnode_pair_df = pd.read_csv(StringIO(input_tsv), sep="\t", dtype=str)
+                # The similarity API returns the records as a json encoded string
+                content = json.dumps(server.get_scores(qnode_pair_df).to_json(
+                    orient="records")).encode()
+                self._send(200, content, "application/json")
+
+            def _send(self, status, content, content_type="text/plain"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return QnodeSimRequestHandler
@@ -8,6 +8,7 @@ setuptools.setup(
         'joblib',
         'numpy',
         'pandas',
+        'pyarrow',
         'pytest',
         'scipy',
         'sklearn',
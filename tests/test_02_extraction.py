@@ -1,10 +1,17 @@
 import sys
 import os
 import configparser
+import json
 import pandas as pd
+import pytest
 
 from kevs.TA1Library import TA1Library, TA1Collection
-from kevs.TA2Instantiation import TA2Instantiation, TA2Collection
+from kevs.TA2Instantiation import TA2Instantiation, TA2Collection, init_ta2_arg_dataframe
+from kevs.extract_elements_from_json import build_element_dataframe
+from kevs.extraction_files import EXTRACTION_FILE_FORMATS, read_extraction_file, \
+    write_extraction_file, write_partitioned_extraction_file, get_partition_slices, \
+    get_partition_view
+from kevs.load_json_data import iter_sdf_instances
 
 local_path = os.path.join("..")
 sys.path.append(local_path)
@@ -110,9 +117,11 @@ class TestExtractions(object):
         # Assert import check by doing a dataframe diff
 
         # Check the schema_instance_id to make sure it matches
-        schema_fpath = os.path.join(ta2_task1_score_dir, "NISTTESTA", "Extracted_Schemas",
-                                    "nisttesta-nisttesta-task1-ce2002-00001_schema.csv")
+        schema_fpath = os.path.join(ta2_task1_score_dir, "NISTTESTA", "Extracted_Tables",
+                                    "extracted_schema.csv")
         schema_df = pd.read_csv(schema_fpath)
+        schema_df = schema_df[schema_df['schema_instance_id'] ==
+                              "nisttesta-nisttesta-task1-ce2002.json_00001"]
         assert schema_df.shape == (1, 23)
         schema_row = schema_df.iloc[0, ]
         # assert str(schema_row['instance_id_short']) == "00001"
@@ -194,3 +203,173 @@ class TestExtractions(object):
         ta2_import_collection = TA2Collection()
         ta2_import_collection.import_extractions_from_file_collection(graph_g_extraction_dir)
         assert True
+
+    def test_build_element_dataframe(self):
+        arg_rows = [{'schema_instance_id': 'a.json_00001', 'ev_id': 'ev1', 'arg_id': 'arg1',
+                     'arg_extra': 'x'},
+                    {'schema_instance_id': 'a.json_00001', 'ev_id': 'ev1', 'arg_id': 'arg2'}]
+        arg_df = build_element_dataframe(init_ta2_arg_dataframe(), arg_rows)
+        # Same columns as appending each row with pd.concat: initialized columns first
+        expected_df = init_ta2_arg_dataframe()
+        for arg_row in arg_rows:
+            expected_df = pd.concat([expected_df, pd.DataFrame([arg_row])], ignore_index=True)
+        assert arg_df.columns.tolist() == expected_df.columns.tolist()
+        assert arg_df.shape == (2, 14)
+        assert arg_df['arg_id'].tolist() == ['arg1', 'arg2']
+        assert pd.isna(arg_df.loc[1, 'arg_extra'])
+        # Empty buffers leave the initialized data frame untouched
+        assert build_element_dataframe(init_ta2_arg_dataframe(), []).shape == (0, 13)
+
+    def test_streaming_sdf_instances(self, tmp_path):
+        sdf = {'@id': 'nist:Submissions/1', 'sdfVersion': '1.4',
+               'instances': [{'@id': 'nist:Instances/0000{}/x'.format(i), 'name': str(i),
+                              'events': [{'@id': 'ev', 'confidence': [0.5, 12345]}]}
+                             for i in range(3)],
+               'provenanceData': [{'provenanceID': 'p', 'offset': 10}]}
+        with open(os.path.join(tmp_path, "nist-nist-task1-ce2002.json"), 'w') as json_file:
+            json.dump(sdf, json_file)
+        loaded = list(iter_sdf_instances(str(tmp_path), "nist-nist-task1-ce2002.json"))
+        # A threshold of 0 forces the incremental parser for any file size
+        streamed = list(iter_sdf_instances(str(tmp_path), "nist-nist-task1-ce2002.json",
+                                           streaming_threshold=0))
+        header = {key: value for key, value in sdf.items() if key != 'instances'}
+        for instance_list in [loaded, streamed]:
+            assert [instance for _, instance in instance_list] == sdf['instances']
+            # Top-level fields after the instances are still part of the header
+            assert all(schema == header for schema, _ in instance_list)
+
+    def test_extraction_file_formats(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        ev_df = pd.DataFrame({'ta2_team_name': ['NIST', 'NIST'],
+                              'ev_id': ['ev1', 'ev2'], 'ev_child_list': [[], ['ev1']],
+                              'ev_confidence_val': [0.5, None], 'ev_comment': [None, None],
+                              'arg_ta2confidence': ['0.25', 1.0]})
+        for file_format in EXTRACTION_FILE_FORMATS:
+            file_path_base = os.path.join(tmp_path, "test_" + file_format + "_ev")
+            write_extraction_file(ev_df, file_path_base, file_format)
+            read_ev_df = read_extraction_file(file_path_base, file_format)
+            assert read_ev_df.columns.tolist() == ev_df.columns.tolist()
+            # Lists are stored as text, the same as a csv round trip
+            assert read_ev_df['ev_child_list'].tolist() == ['[]', "['ev1']"]
+            assert read_ev_df['arg_ta2confidence'].tolist() == [0.25, 1.0]
+            assert read_ev_df['ev_confidence_val'].isna().tolist() == [False, True]
+            assert read_ev_df['ev_comment'].isna().all()
+            # Columns of the extraction schema have the same dtype in every format
+            assert read_ev_df['ta2_team_name'].dtype == 'category'
+            assert read_ev_df['ev_confidence_val'].dtype == 'Float64'
+        with pytest.raises(FileNotFoundError):
+            read_extraction_file(os.path.join(tmp_path, "missing_ev"), 'parquet')
+
+    def test_partitioned_extraction_file(self, tmp_path):
+        ev_df = pd.DataFrame({'schema_instance_id': ['b', 'a', 'b', 'c'],
+                              'ev_id': ['ev1', 'ev2', 'ev3', 'ev4'],
+                              'ev_confidence_val': [0.1, 0.2, 0.3, 0.4]})
+        file_path_base = os.path.join(tmp_path, "extracted_events")
+        write_partitioned_extraction_file(ev_df, file_path_base)
+        team_ev_df = read_extraction_file(file_path_base)
+        # Rows of a partition are contiguous, in order of first appearance
+        assert team_ev_df['ev_id'].tolist() == ['ev1', 'ev3', 'ev2', 'ev4']
+        partition_slices = get_partition_slices(team_ev_df)
+        assert partition_slices == {'b': slice(0, 2), 'a': slice(2, 3), 'c': slice(3, 4)}
+        instance_ev_df = get_partition_view(team_ev_df, partition_slices['b'])
+        assert instance_ev_df['ev_id'].tolist() == ['ev1', 'ev3']
+        assert instance_ev_df.index.tolist() == [0, 1]
+        # An empty table removes the file of a previous extraction
+        write_partitioned_extraction_file(ev_df.iloc[0:0], file_path_base)
+        assert not os.path.isfile(file_path_base + '.csv')
+
+    def test_lazy_element_tables(self, tmp_path):
+        for file_suffix, element_df in [
+                ('_schema', pd.DataFrame({'file_name': ['test.json'], 'schema_id': ['s1']})),
+                ('_ev', pd.DataFrame({'schema_id': ['s1', 's1'], 'ev_id': ['ev1', 'ev2']})),
+                ('_arg', pd.DataFrame({'schema_id': ['s1'], 'ev_id': ['ev1'],
+                                       'arg_id': ['arg1']}))]:
+            write_extraction_file(element_df, os.path.join(tmp_path, "test-library" + file_suffix))
+        ta1_library = TA1Library("TEST")
+        ta1_library.import_extractions_from_files(str(tmp_path))
+        assert ta1_library.schema_id == 's1'
+        assert not ta1_library.is_table_loaded('ev_df')
+        assert ta1_library.ev_df['ev_id'].tolist() == ['ev1', 'ev2']
+        assert ta1_library.is_table_loaded('ev_df')
+        # Tables without a file are the initialized data frames
+        assert ta1_library.rel_df.empty
+        ta1_library.release_element_tables()
+        assert not ta1_library.is_table_loaded('ev_df')
+        assert len(ta1_library.ev_df) == 2
+        # Assigned data frames are kept on release
+        ta1_library.arg_df = ta1_library.arg_df.head(0)
+        ta1_library.release_element_tables()
+        assert ta1_library.arg_df.empty
+
+    def test_ta1_parallel_extraction(self, tmp_path):
+        sdf_dir = os.path.join(tmp_path, "sdf")
+        os.makedirs(os.path.join(sdf_dir, "TEST"))
+        for file_index in range(2):
+            schema_id = 'test:Schemas/{}'.format(file_index)
+            sdf = {'@id': schema_id, 'sdfVersion': '1.4',
+                   'events': [{'@id': schema_id + '/ev1', 'name': 'ev1',
+                               'participants': [{'@id': schema_id + '/arg1',
+                                                 'roleName': 'A0'}]}],
+                   'relations': [{'@id': schema_id + '/rel1',
+                                  'relationSubject': schema_id + '/ev1',
+                                  'relationPredicate': 'Q79030196',
+                                  'relationObject': schema_id + '/ev2'},
+                                 {'@id': schema_id + '/rel2',
+                                  'relationSubject': schema_id + '/ev1',
+                                  'relationPredicate': 'Q1',
+                                  'relationObject': schema_id + '/ev2'}]}
+            with open(os.path.join(sdf_dir, "TEST", "test-library-{}.json".format(file_index)),
+                      'w') as json_file:
+                json.dump(sdf, json_file)
+        serial_library = TA1Library("TEST")
+        serial_library.extract_contents_from_sdf(sdf_dir)
+        parallel_library = TA1Library("TEST")
+        parallel_library.extract_contents_from_sdf(sdf_dir, workers=2)
+        # The order relations of every file are kept
+        assert serial_library.temporalrel_df.shape[0] == 2
+        for table_name in ['schema_df', 'ev_df', 'arg_df', 'ent_df', 'rel_df', 'temporalrel_df',
+                           'children_df']:
+            pd.testing.assert_frame_equal(
+                getattr(serial_library, table_name).reset_index(drop=True),
+                getattr(parallel_library, table_name).reset_index(drop=True),
+                check_dtype=False)
+
+    def test_incremental_extraction(self, tmp_path):
+        sdf_dir = os.path.join(tmp_path, "sdf")
+        os.makedirs(os.path.join(sdf_dir, "NISTTESTA"))
+
+        def write_sdf(ce_name, instance_name):
+            sdf = {'@id': 'nist:Submissions/1', 'sdfVersion': '1.4', 'ceID': ce_name,
+                   'instances': [{'@id': 'nist:Instances/00001/x', 'name': instance_name,
+                                  'confidence': 0.9, 'entities': [], 'relations': [],
+                                  'events': [{'@id': 'nist:Events/00001/ev1', 'name': 'ev1',
+                                              'confidence': [0.5],
+                                              'participants': [{'@id': 'nist:Participants/1',
+                                                                'roleName': 'A0',
+                                                                'entity': 'nist:Entities/1'}]
+                                              }]}]}
+            with open(os.path.join(sdf_dir, "NISTTESTA",
+                                   "nisttesta-nisttesta-task1-{}.json".format(ce_name)),
+                      'w') as json_file:
+                json.dump(sdf, json_file)
+
+        for ce_name in ['ce2002', 'ce2004', 'ce2005']:
+            write_sdf(ce_name, ce_name)
+        score_dir = os.path.join(tmp_path, "extractions")
+        ta2_instantiation = TA2Instantiation("NISTTESTA", is_task2=False)
+        assert ta2_instantiation.update_extractions(sdf_dir, score_dir) == \
+            {'unchanged': 0, 'extracted': 3, 'removed': 0}
+        assert len(ta2_instantiation.ta2dict) == 3
+        # Nothing to do when no SDF file changed
+        assert ta2_instantiation.update_extractions(sdf_dir, score_dir) == \
+            {'unchanged': 3, 'extracted': 0, 'removed': 0}
+        write_sdf('ce2004', 'changed')
+        os.remove(os.path.join(sdf_dir, "NISTTESTA", "nisttesta-nisttesta-task1-ce2005.json"))
+        assert ta2_instantiation.update_extractions(sdf_dir, score_dir) == \
+            {'unchanged': 1, 'extracted': 1, 'removed': 1}
+        assert sorted(ta2_instantiation.schema_df['instance_name']) == ['ce2002', 'changed']
+        assert sorted(ta2_instantiation.ev_df['schema_instance_id'].unique()) == \
+            ['nisttesta-nisttesta-task1-ce2002.json_00001',
+             'nisttesta-nisttesta-task1-ce2004.json_00001']
+        assert ta2_instantiation.update_extractions(sdf_dir, score_dir,
+                                                    full_extraction=True)['extracted'] == 2
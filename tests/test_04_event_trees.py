@@ -2,7 +2,9 @@ import sys
 import os
 import configparser
 
-from kevs.TA1Library import TA1Collection
+import pandas as pd
+
+from kevs.TA1Library import TA1Collection, TA1Library
 from kevs.TA2Instantiation import TA2Collection
 
 local_path = os.path.join("..")
@@ -14,6 +16,25 @@ class TestTrees(object):
     Testing Extraction Methods
     """
 
+    def test_event_hierarchy(self):
+        ta1_library = TA1Library("TEST")
+        ta1_library.ev_df = pd.DataFrame({'ev_id': ['ev1', 'ev2', 'ev3', 'ev4', 'ev5']})
+        ta1_library.children_df = pd.DataFrame({'ev_id': ['ev1', 'ev1', 'ev2', 'ev5'],
+                                                'child_id': ['ev3', 'ev2', 'ev3', 'ev6']})
+        ev_hierarchy = ta1_library.event_hierarchy
+        assert ev_hierarchy.root_ids == ['ev1', 'ev4', 'ev5']
+        # Children keep the order of the SDF
+        assert ev_hierarchy.get_children('ev1') == ['ev3', 'ev2']
+        assert ev_hierarchy.get_parents('ev3') == ['ev1', 'ev2']
+        assert ev_hierarchy.get_children('ev4') == []
+        assert ev_hierarchy.get_parents('missing') == []
+        assert ev_hierarchy.is_leaf('ev3') and ev_hierarchy.is_leaf('ev6')
+        assert not ev_hierarchy.is_leaf('ev5')
+        # The adjacency is rebuilt when a table is replaced
+        assert ta1_library.event_hierarchy is ev_hierarchy
+        ta1_library.children_df = ta1_library.children_df.head(0)
+        assert ta1_library.event_hierarchy.root_ids == ['ev1', 'ev2', 'ev3', 'ev4', 'ev5']
+
     def test_ta1_trees(self):
         config_filepath = "./execution_scripts/config.ini"
         config_mode = "Test"
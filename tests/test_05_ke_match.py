@@ -1,15 +1,106 @@
 import sys
 import os
 import configparser
+import json
+import pickle
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
 
 from kevs.Annotation import Annotation
-from kevs.TA2Instantiation import TA2Collection
-from kevs.match_ke import match_ke_elements
+from kevs.TA2Instantiation import TA2Collection, TA2Instantiation
+from kevs.match_ke import match_ke_elements, get_ev_arg_sim, get_graph_metric_match, \
+    match_graph_ke_elements, MATCHING_BACKENDS, sweep_ke_ev_graph_confidence_thresholds, \
+    score_ke_elements, score_ke_element_sets, get_arg_candidate_pair_df, get_sparse_ev_arg_sim, \
+    get_arg_assignment_sums, match_ke_ce_elements, get_ke_ev_graph_all_df, get_ke_candidate_df, \
+    count_changed_matches
+import kevs.match_ke
+from kevs.qnode_libs import get_bulk_qnode_sim_scores, select_qnode_sim_scores, \
+    process_ta2_qnode_fields, qnode_field_cache, produce_qnode_pair_union_df
+from kevs.qnode_sim_cache import QnodeSimCache, get_qnode_sim_cache_path
+from kevs.qnode_sim_server import MockQnodeSimServer
+from kevs.qnode_sim_matrix import QnodeSimMatrix
+from kevs.ke_match_cache import KEMatchCache, get_ke_match_cache_key
 
 local_path = os.path.join("..")
 sys.path.append(local_path)
 
 
+def make_synthetic_ke_match_inputs(tmp_path, num_instances=3):
+    """
+    Small TA2 Task 1 submission of one team, extracted and imported like script_04 does, with
+    its annotation, Graph G and a qnode similarity cache that has every needed pair, so that
+    matching does not query the similarity API
+    """
+    rng = random.Random(0)
+    sdf_dir = os.path.join(tmp_path, "sdf")
+    os.makedirs(os.path.join(sdf_dir, "NISTTESTA"))
+    instance_list = []
+    for instance_index in range(num_instances):
+        prefix = "nisttesta:{{}}/{:05d}/".format(instance_index + 1)
+        event_list = []
+        for ev_index in range(8):
+            event = {'@id': prefix.format('Events') + 'ev{}'.format(ev_index),
+                     'name': 'ev{}'.format(ev_index),
+                     'wd_node': ['wd:Q{}'.format(rng.randint(1, 6))], 'wd_label': ['l'],
+                     'ta1ref': 'ta1:Events/{}'.format(ev_index) if ev_index % 4 else 'kairos:NULL',
+                     'confidence': round(rng.random(), 2),
+                     'participants': [{'@id': prefix.format('Participants') +
+                                       '{}_{}'.format(ev_index, arg_index),
+                                       'roleName': 'A{}'.format(arg_index),
+                                       'values': {'ta2entity': prefix.format('Entities') +
+                                                  str(rng.randint(0, 2))}}
+                                      for arg_index in range(rng.randint(0, 2))]}
+            if ev_index % 3:
+                event['provenance'] = ['prov']
+            event_list.append(event)
+        instance_list.append({'@id': prefix.format('Instances') + 'x',
+                              'name': str(instance_index), 'confidence': 0.9,
+                              'events': event_list, 'relations': [],
+                              'entities': [{'@id': prefix.format('Entities') + str(ent_index),
+                                            'name': 'ent', 'wd_node': ['wd:Q{}'.format(ent_index)],
+                                            'ta2wd_node': 'wd:Q{}'.format(ent_index + 100)}
+                                           for ent_index in range(3)]})
+    with open(os.path.join(sdf_dir, "NISTTESTA", "nisttesta-nisttesta-task1-ce2002.json"),
+              'w') as json_file:
+        json.dump({'@id': 'nisttesta:Submissions/1', 'sdfVersion': '1.4', 'ceID': 'ce2002',
+                   'instances': instance_list}, json_file)
+    score_dir = os.path.join(tmp_path, "extractions")
+    TA2Instantiation("NISTTESTA", is_task2=False).update_extractions(sdf_dir, score_dir)
+    ta2_collection = TA2Collection(is_task2=False)
+    ta2_collection.import_extractions_from_file_collection(score_dir)
+
+    ann_arg_rows = [{'eventprimitive_id': 'ep{}'.format(ep_index), 'entity_id': 'ent{}'.format(
+                     (ep_index + arg_index) % 3), 'arg_id': 'arg{}'.format(arg_index),
+                     'arg_num': str(arg_index)}
+                    for ep_index in range(6) for arg_index in range(ep_index % 3)]
+    task1_ceannotation = SimpleNamespace(
+        ep_df=pd.DataFrame({'eventprimitive_id': ['ep{}'.format(ep_index)
+                                                  for ep_index in range(6)],
+                            'qnode_type_id': ['Q{}'.format(ep_index + 1)
+                                              for ep_index in range(6)]}),
+        arg_df=pd.DataFrame(ann_arg_rows),
+        entity_qnode_df=pd.DataFrame({'entity_id': ['ent0', 'ent1', 'ent2'],
+                                      'qnode_kb_id_identity': ['Q100', 'NIL', 'Q102'],
+                                      'qnode_kb_id_type': ['Q7', 'Q101', 'Q8']}))
+    annotation_collection = SimpleNamespace(annotation_dict={'task1|ce2002': task1_ceannotation})
+    graph_g_collection = SimpleNamespace(ta2dict={'GRAPHG': SimpleNamespace(
+        ta2dict={'a|b|ce2002': None})})
+
+    qnode_list = ['Q{}'.format(qnode_index) for qnode_index in list(range(10)) + [100, 101, 102]]
+    qnode_sim_df = pd.DataFrame([{'q1': q1, 'q2': q2, 'q1_label': q1, 'q2_label': q2}
+                                 for q1 in qnode_list for q2 in qnode_list])
+    for metric in ['class', 'complex', 'jc', 'text', 'topsim', 'transe']:
+        qnode_sim_df[metric] = [round(rng.random(), 3) for _ in range(qnode_sim_df.shape[0])]
+    qnode_dir = os.path.join(tmp_path, "qnode")
+    os.makedirs(qnode_dir)
+    qnode_sim_fp = os.path.join(qnode_dir, 'nist_isi_qnode_sim_cache.tsv')
+    qnode_sim_df.to_csv(qnode_sim_fp, sep='\t', index=False)
+    return annotation_collection, ta2_collection, graph_g_collection, qnode_dir, qnode_sim_fp
+
+
 class TestKEMatch(object):
     def __init__(self, config_filepath: str, config_mode: str) -> None:
         try:
@@ -168,6 +259,418 @@ class TestKEMatch(object):
         match_ke_elements(ta2_t2_as_path, task1_annotation_collection, ta2_task2_collection,
                           graph_g_collection, qnode_dir,
                           qnode_sim_fp, is_task2=True, use_graph_g=False,
-                          min_confidence_threshold=0)
+                          min_confidence_threshold=0,
+                          confidence_threshold_list=[0, 0.25, 0.5, 0.75])
 
         assert True
+
+
+class TestQnodeFields(object):
+    def test_process_ta2_qnode_fields(self):
+        ta2_df = pd.DataFrame({'id': ['e1', 'e2', 'e3', 'e4', 'e5', 'e6'],
+                               'qnode': ["['wd:Q1', 'wiki:Q2']", 'wd:Q3', None, '[]',
+                                         '["wd:Q4, Q5"]', "['wd:Q1', 'wiki:Q2']"],
+                               'ev_qnode': [None, None, 'wd:Q6', None, None, None]})
+        ta2_proc_df = process_ta2_qnode_fields(ta2_df)
+        # Lists are exploded, an empty list gives a missing qnode
+        assert ta2_proc_df.index.tolist() == [0, 0, 1, 2, 3, 4, 5, 5]
+        assert ta2_proc_df['id'].tolist() == ['e1', 'e1', 'e2', 'e3', 'e4', 'e5', 'e6', 'e6']
+        assert ta2_proc_df['qnode_proc'].fillna('').tolist() == \
+            ['Q1', 'Q2', 'Q3', 'Q6', '', 'Q4, Q5', 'Q1', 'Q2']
+        # Normalized fields are kept for later instances
+        assert qnode_field_cache["['wd:Q1', 'wiki:Q2']"] == ('Q1', 'Q2')
+        assert process_ta2_qnode_fields(ta2_df).equals(ta2_proc_df)
+
+    def test_produce_qnode_pair_union_df(self):
+        ev_pair = (pd.DataFrame({'qnode_proc': ['Q1', 'Q2', 'Q1']}),
+                   pd.DataFrame({'qnode_proc': ['Q5', 'Q5', 'Q6']}))
+        arg_pair = (pd.DataFrame({'qnode_proc': ['Q3', 'Q1']}),
+                    pd.DataFrame({'qnode_proc': ['Q6']}))
+        # Distinct pairs, in the order of the products and of the first rows of the qnodes
+        qnode_pair_df = produce_qnode_pair_union_df([ev_pair, arg_pair])
+        assert qnode_pair_df.values.tolist() == [['Q1', 'Q5'], ['Q1', 'Q6'], ['Q2', 'Q5'],
+                                                 ['Q2', 'Q6'], ['Q3', 'Q6']]
+
+
+class TestQnodeSimCache(object):
+    def test_qnode_sim_cache(self, tmp_path):
+        qnode_sim_fp = os.path.join(tmp_path, 'nist_isi_qnode_sim_cache.tsv')
+        pd.DataFrame({'q1': ['Q1', 'Q1', 'Q2'], 'q2': ['Q5', 'Q6', 'Q5'],
+                      'complex': [0.1, 0.2, 0.3], 'q1_label': ['a', 'a', 'b'],
+                      'q2_label': ['e', 'f', 'e'], 'transe': [0.4, 0.5, 0.6],
+                      'text': [0.7, 0.8, 0.9], 'class': [0.1, 0.2, 0.3],
+                      'jc': [0.4, 0.5, 0.6], 'topsim': [0.7, 0.8, None]}).\
+            to_csv(qnode_sim_fp, sep='\t', index=False)
+        cache_path = get_qnode_sim_cache_path(qnode_sim_fp)
+        assert cache_path.endswith('nist_isi_qnode_sim_cache.sqlite')
+        qnode_pair_df = pd.DataFrame({'q1': ['Q1', 'Q2', 'Q1', 'Q3'],
+                                      'q2': ['Q6', 'Q5', 'Q5', 'Q5']})
+        with QnodeSimCache(cache_path, qnode_sim_fp) as qnode_sim_cache:
+            assert len(qnode_sim_cache) == 3
+            # Pairs without a topsim score count as missing
+            qnode_sim_df = qnode_sim_cache.lookup(qnode_pair_df)
+            assert qnode_sim_df[['q1', 'q2']].values.tolist() == [['Q1', 'Q6'], ['Q1', 'Q5']]
+            assert qnode_sim_df['topsim'].tolist() == [0.8, 0.7]
+            # Scored pairs are kept, incomplete pairs are replaced
+            qnode_sim_cache.insert(pd.DataFrame({'q1': ['Q1', 'Q2'], 'q2': ['Q6', 'Q5'],
+                                                 'topsim': [0.0, 0.5]}))
+            assert qnode_sim_cache.lookup(qnode_pair_df)['topsim'].tolist() == [0.8, 0.5, 0.7]
+        # A second process sees the same entries, and the tsv file is only read once
+        os.remove(qnode_sim_fp)
+        with QnodeSimCache(cache_path, qnode_sim_fp) as qnode_sim_cache:
+            assert len(qnode_sim_cache) == 3
+        # Fully cached pairs do not query the similarity API
+        qnode_sim_df = get_bulk_qnode_sim_scores(qnode_pair_df.iloc[0:3], str(tmp_path),
+                                                 qnode_sim_fp)
+        assert qnode_sim_df['topsim'].tolist() == [0.8, 0.5, 0.7]
+        # Scores of a subset of prefetched pairs
+        qnode_sub_df = select_qnode_sim_scores(qnode_pair_df.iloc[[2, 0, 2]], qnode_sim_df)
+        assert qnode_sub_df[['q1', 'q2', 'topsim']].values.tolist() == \
+            [['Q1', 'Q5', 0.7], ['Q1', 'Q6', 0.8]]
+
+    def test_qnode_sim_client(self, tmp_path):
+        qnode_pair_df = pd.DataFrame({'q1': ['Q{}'.format(i) for i in range(50)],
+                                      'q2': ['Q{}'.format(i + 1) for i in range(50)]})
+        fixture_df = qnode_pair_df.iloc[0:45].assign(topsim=[i / 50 for i in range(45)])
+        qnode_sim_fp = os.path.join(tmp_path, 'nist_isi_qnode_sim_cache.tsv')
+        # Failed requests are retried
+        with MockQnodeSimServer(fixture_df, num_failures=2) as server:
+            qnode_sim_df = get_bulk_qnode_sim_scores(qnode_pair_df, str(tmp_path), qnode_sim_fp,
+                                                     url=server.url, max_in_flight=3)
+            assert server.num_requests == 5
+        assert qnode_sim_df[['q1', 'q2']].values.tolist() == qnode_pair_df.values.tolist()
+        assert qnode_sim_df['topsim'].iloc[0:45].tolist() == fixture_df['topsim'].tolist()
+        assert qnode_sim_df['topsim'].iloc[45:].isna().all()
+        with QnodeSimCache(get_qnode_sim_cache_path(qnode_sim_fp)) as qnode_sim_cache:
+            assert qnode_sim_cache.lookup(qnode_pair_df).shape[0] == 45
+
+
+class TestKEMatchWorkers(object):
+    def test_worker_instances(self, tmp_path):
+        annotation_collection, ta2_collection, graph_g_collection, qnode_dir, qnode_sim_fp = \
+            make_synthetic_ke_match_inputs(tmp_path)
+        ta2_instantiation = ta2_collection.ta2dict['NISTTESTA']
+        ta2_ceinstance = next(iter(ta2_instantiation.ta2dict.values()))
+        # An instance is pickled with its own rows, not the tables of its team
+        ta2_instantiation.ev_df
+        ta2_instantiation.arg_df
+        pickled_ceinstance = pickle.loads(pickle.dumps(ta2_ceinstance))
+        assert 'table_loaders' not in pickled_ceinstance.__dict__
+        assert pickled_ceinstance.ev_df.equals(ta2_ceinstance.ev_df)
+        assert len(pickle.dumps(ta2_ceinstance)) < len(pickle.dumps(ta2_instantiation))
+
+        # The worker pool gives the files of a serial run
+        for workers in [1, 2]:
+            match_ke_elements(os.path.join(tmp_path, "workers_{}".format(workers)),
+                              annotation_collection, ta2_collection, graph_g_collection,
+                              qnode_dir, qnode_sim_fp, matching_backend="scipy", workers=workers)
+        file_path_list = []
+        for directory, _, file_name_list in os.walk(os.path.join(tmp_path, "workers_1")):
+            file_path_list += [os.path.relpath(os.path.join(directory, file_name),
+                                               os.path.join(tmp_path, "workers_1"))
+                               for file_name in file_name_list]
+        assert len(file_path_list) == 4 + 3 * 6
+        for file_path in file_path_list:
+            with open(os.path.join(tmp_path, "workers_1", file_path)) as serial_file, \
+                    open(os.path.join(tmp_path, "workers_2", file_path)) as parallel_file:
+                assert serial_file.read() == parallel_file.read()
+
+
+class TestKEMatchSweep(object):
+    def test_confidence_threshold_sweep(self, tmp_path, monkeypatch):
+        annotation_collection, ta2_collection, graph_g_collection, qnode_dir, qnode_sim_fp = \
+            make_synthetic_ke_match_inputs(tmp_path)
+        task1_ceannotation = annotation_collection.annotation_dict['task1|ce2002']
+        ta2_ceinstance = next(iter(ta2_collection.ta2dict['NISTTESTA'].ta2dict.values()))
+        ev_graph_all_df = get_ke_ev_graph_all_df(task1_ceannotation, ta2_ceinstance, qnode_dir,
+                                                 qnode_sim_fp)
+        candidate_df = get_ke_candidate_df(ev_graph_all_df, ta2_ceinstance.ta2_team_name)
+        confidence_list = sorted(candidate_df['ev_confidence'].unique())
+        # Thresholds between the same confidences share their candidates
+        threshold_list = [0, confidence_list[0], (confidence_list[0] + confidence_list[1]) / 2,
+                          confidence_list[1], 2]
+        num_candidate_sets = len({(candidate_df['ev_confidence'] >= threshold).sum()
+                                  for threshold in threshold_list})
+        assert num_candidate_sets < len(threshold_list)
+
+        match_graph_ke_elements_calls = []
+
+        def count_match_graph_ke_elements(*args):
+            match_graph_ke_elements_calls.append(args[0].shape[0])
+            return match_graph_ke_elements(*args)
+
+        monkeypatch.setattr(kevs.match_ke, "match_graph_ke_elements",
+                            count_match_graph_ke_elements)
+        ke_sweep_df, ke_sweep_match_df = sweep_ke_ev_graph_confidence_thresholds(
+            ev_graph_all_df, ta2_ceinstance, "task_1", threshold_list, matching_backend="scipy")
+        # The events are only matched again when the candidates change
+        assert len(match_graph_ke_elements_calls) == num_candidate_sets - 1
+        monkeypatch.undo()
+        assert ke_sweep_df['min_confidence_threshold'].tolist() == threshold_list
+
+        for threshold_index, threshold in enumerate(threshold_list):
+            ke_match_df_list = match_ke_ce_elements(
+                task1_ceannotation, ta2_ceinstance, None, qnode_dir, qnode_sim_fp,
+                min_confidence_threshold=threshold, matching_backend="scipy")
+            for sweep_df, ke_score_df in [(ke_sweep_df, ke_match_df_list[2]),
+                                          (ke_sweep_match_df, ke_match_df_list[4])]:
+                # The instance columns of the concatenated rows are no longer categorical
+                sweep_row_df = sweep_df.iloc[[threshold_index], :].drop(
+                    columns='min_confidence_threshold').reset_index(drop=True)
+                pd.testing.assert_frame_equal(sweep_row_df.astype(object),
+                                              ke_score_df.astype(object))
+
+        # The sweep of a match reuses its event graph, also in the sparse mode
+        for sparse_similarity_floor in [None, 0]:
+            ke_match_df_list = match_ke_ce_elements(
+                task1_ceannotation, ta2_ceinstance, None, qnode_dir, qnode_sim_fp,
+                matching_backend="scipy", sparse_similarity_floor=sparse_similarity_floor,
+                confidence_threshold_list=threshold_list)
+            assert len(ke_match_df_list) == 8
+            pd.testing.assert_frame_equal(ke_match_df_list[6], ke_sweep_df)
+            pd.testing.assert_frame_equal(ke_match_df_list[7], ke_sweep_match_df)
+
+        # The sweep files of match_ke_elements, from the workers and from the cache
+        sweep_file_name = "TA2_task_1_automated_team_matched_ke_threshold_sweep.csv"
+        team_sweep_df_list = []
+        for workers, ke_match_cache_dir in [(1, None), (2, None),
+                                            (2, os.path.join(tmp_path, "cache")),
+                                            (1, os.path.join(tmp_path, "cache"))]:
+            output_dir = os.path.join(tmp_path, "sweep_{}".format(len(team_sweep_df_list)))
+            match_ke_elements(output_dir, annotation_collection, ta2_collection,
+                              graph_g_collection, qnode_dir, qnode_sim_fp,
+                              matching_backend="scipy", workers=workers,
+                              ke_match_cache_dir=ke_match_cache_dir,
+                              confidence_threshold_list=threshold_list)
+            team_sweep_df_list.append(pd.read_csv(os.path.join(output_dir, sweep_file_name)))
+        assert team_sweep_df_list[0]['min_confidence_threshold'].tolist() == threshold_list
+        # The restored scores are read back from their files
+        for team_sweep_df in team_sweep_df_list[1:]:
+            pd.testing.assert_frame_equal(team_sweep_df, team_sweep_df_list[0])
+
+
+class TestKEMatchCache(object):
+    def test_ke_match_cache(self, tmp_path):
+        ta2_ceinstance = SimpleNamespace(
+            schema_instance_id='a-b-task1-ce2002.json_00001', ta1_team_name='A',
+            ta2_team_name='B', ev_df=pd.DataFrame({'ev_id': ['ev1'], 'ev_confidence': [0.5]}),
+            arg_df=pd.DataFrame(), ent_df=pd.DataFrame())
+        task1_ceannotation = SimpleNamespace(ep_df=pd.DataFrame({'eventprimitive_id': ['ep1']}),
+                                             arg_df=pd.DataFrame(), entity_qnode_df=pd.DataFrame())
+        match_params = {'min_confidence_threshold': 0, 'use_graph_g': False}
+        key = get_ke_match_cache_key(task1_ceannotation, ta2_ceinstance, match_params)
+        # The key changes with the parameters and the content of the tables, not their dtypes
+        assert key != get_ke_match_cache_key(task1_ceannotation, ta2_ceinstance,
+                                             {'min_confidence_threshold': 0.5,
+                                              'use_graph_g': False})
+        ta2_ceinstance.ev_df = ta2_ceinstance.ev_df.astype({'ev_confidence': 'Float64'})
+        assert key == get_ke_match_cache_key(task1_ceannotation, ta2_ceinstance, match_params)
+        ta2_ceinstance.ev_df.loc[0, 'ev_confidence'] = 0.25
+        changed_key = get_ke_match_cache_key(task1_ceannotation, ta2_ceinstance, match_params)
+        assert key != changed_key
+
+        file_paths = [os.path.join(tmp_path, 'out_{}.csv'.format(i)) for i in range(2)]
+        for file_path in file_paths:
+            with open(file_path, 'w') as output_file:
+                output_file.write('x' * 100)
+        cache_dir = os.path.join(tmp_path, 'cache')
+        ke_match_cache = KEMatchCache(cache_dir, max_bytes=300)
+        assert not ke_match_cache.restore(key, file_paths)
+        ke_match_cache.store(key, file_paths)
+        ke_match_cache.store(changed_key, file_paths)
+        # The least recently used result is evicted
+        assert ke_match_cache.get_size() == 200
+        for file_path in file_paths:
+            os.remove(file_path)
+        ke_match_cache = KEMatchCache(cache_dir, max_bytes=300)
+        assert not ke_match_cache.restore(key, file_paths)
+        assert ke_match_cache.restore(changed_key, file_paths)
+        assert all(os.path.getsize(file_path) == 100 for file_path in file_paths)
+
+
+class TestQnodeSimMatrix(object):
+    def test_segment_sim(self):
+        qnode_sim_df = pd.DataFrame({'q1': ['Q1', 'Q1', 'Q2', 'Q3'], 'q2': ['Q5', 'Q6', 'Q5', 'Q6'],
+                                     'class': [0.5, 0.25, 1.0, None], 'complex': 0.5,
+                                     'jc': 0.5, 'text': 0.5, 'topsim': [0.5, 0.25, 1.0, 0.75],
+                                     'transe': 0.5})
+        qnode_sim_matrix = QnodeSimMatrix(qnode_sim_df)
+        assert qnode_sim_matrix.values.shape == (4, 3, 6)
+        # ev1 has qnodes Q1 and Q2, ev3 has a qnode without scores
+        ta2_df = pd.DataFrame({'ta2_ev_id': ['ev1', 'ev1', 'ev2', 'ev3'],
+                               'q1': ['Q1', 'Q2', 'Q3', 'Q9']})
+        ann_df = pd.DataFrame({'ann_ev_id': ['ep1', 'ep2'], 'q2': ['Q5', 'Q6']})
+        segment_sim_df = qnode_sim_matrix.get_segment_sim_df(ta2_df, ['ta2_ev_id'],
+                                                             ann_df, ['ann_ev_id'])
+        assert segment_sim_df[['ta2_ev_id', 'ann_ev_id']].values.tolist() == \
+            [['ev1', 'ep1'], ['ev1', 'ep2'], ['ev2', 'ep2']]
+        assert segment_sim_df['topsim'].tolist() == [0.75, 0.25, 0.75]
+        assert segment_sim_df['class'].iloc[0:2].tolist() == [0.75, 0.25]
+        assert pd.isna(segment_sim_df['class'].iloc[2])
+
+    def test_sparse_segment_sim(self):
+        qnode_sim_df = pd.DataFrame({'q1': ['Q1', 'Q1', 'Q2', 'Q3'], 'q2': ['Q5', 'Q6', 'Q5', 'Q6'],
+                                     'class': [0.5, 0.25, 1.0, None], 'complex': 0.5,
+                                     'jc': 0.5, 'text': 0.5, 'topsim': [0.5, 0.25, 1.0, 0.75],
+                                     'transe': 0.5})
+        qnode_sim_matrix = QnodeSimMatrix(qnode_sim_df)
+        ta2_df = pd.DataFrame({'ta2_ev_id': ['ev1', 'ev1', 'ev2', 'ev3'],
+                               'q1': ['Q1', 'Q2', 'Q3', 'Q9']})
+        ann_df = pd.DataFrame({'ann_ev_id': ['ep1', 'ep2'], 'q2': ['Q5', 'Q6']})
+        segment_sim = qnode_sim_matrix.get_sparse_segment_sim(ta2_df, ['ta2_ev_id'],
+                                                              ann_df, ['ann_ev_id'], 0.5)
+        # All scored pairs are recorded, ev1 and ep2 has no mean above 0.5
+        assert segment_sim.pair_matrix.toarray().tolist() == \
+            [[True, True], [False, True], [False, False]]
+        assert segment_sim.sim_df[['ta2_ev_id', 'ann_ev_id']].values.tolist() == \
+            [['ev1', 'ep1'], ['ev2', 'ep2']]
+        assert segment_sim.sim_df['topsim'].tolist() == [0.75, 0.75]
+        segment_sim = segment_sim.select_q1_segments(np.array([False, True, True]))
+        assert segment_sim.pair_matrix.shape == (2, 2)
+        assert segment_sim.sim_df[['q1_segment', 'q2_segment']].values.tolist() == [[0, 1]]
+
+
+class TestEvArgSim(object):
+    def test_ev_arg_sim(self):
+        # ev1 has two arguments, ep1 has three arguments in two slots
+        arg_match_df = pd.DataFrame({'ta2_ev_id': 'ev1', 'ann_ev_id': 'ep1',
+                                     'ta2_arg_id': ['a1', 'a1', 'a1', 'a2', 'a2', 'a2'],
+                                     'ann_arg_id': ['x1', 'x2', 'x3', 'x1', 'x2', 'x3'],
+                                     'arg_num': ['1', '1', '2', '1', '1', '2']})
+        for metric in ['class', 'complex', 'jc', 'text', 'topsim', 'transe']:
+            arg_match_df[metric] = [0.9, 0.5, 0.25, 0.75, 0.0, 0.5]
+        arg_sim_df = get_ev_arg_sim(arg_match_df)
+        assert arg_sim_df.shape[0] == 1
+        assert arg_sim_df.loc[0, ['num_ta2_args', 'num_ann_args',
+                                  'num_ann_arg_slots']].tolist() == [2, 3, 2]
+        # a1 matches x1 and a2 matches x3, summing to 1.4 over 2 slots
+        assert abs(arg_sim_df.loc[0, 'topsim_arg'] - 0.7) < 1e-9
+
+    def test_arg_assignment_negative_similarity(self):
+        # a1-x2 is the best pair, but a2-x1 is not a candidate, so both arguments can only be
+        # matched with a1-x1 and a2-x2, which have negative similarities
+        has_edge = np.array([[True, True], [False, True]])
+        arg_sim_block = np.array([[[-1.0, 1.0], [0.0, -1.0]]])
+        assert get_arg_assignment_sums(arg_sim_block, has_edge).tolist() == [-2.0]
+
+    def test_sparse_ev_arg_sim(self):
+        # The argument similarities of test_ev_arg_sim, a1 and a2 have qnodes Q1 and Q2
+        qnode_sim_df = pd.DataFrame({'q1': ['Q1', 'Q1', 'Q1', 'Q2', 'Q2', 'Q2'],
+                                     'q2': ['Q5', 'Q6', 'Q7', 'Q5', 'Q6', 'Q7']})
+        for metric in ['class', 'complex', 'jc', 'text', 'topsim', 'transe']:
+            qnode_sim_df[metric] = [0.9, 0.5, 0.25, 0.75, 0.0, 0.5]
+        ta2_df = pd.DataFrame({'ta2_ev_id': 'ev1', 'ta2_arg_id': ['a1', 'a2'], 'q1': ['Q1', 'Q2']})
+        ann_df = pd.DataFrame({'ann_ev_id': 'ep1', 'ann_arg_id': ['x1', 'x2', 'x3'],
+                               'arg_num': ['1', '1', '2'], 'q2': ['Q5', 'Q6', 'Q7']})
+        arg_sim = QnodeSimMatrix(qnode_sim_df).get_sparse_segment_sim(
+            ta2_df, ['ta2_ev_id', 'ta2_arg_id'], ann_df, ['ann_ev_id', 'ann_arg_id', 'arg_num'],
+            0.3)
+        assert arg_sim.sim_df.shape[0] == 4
+        arg_sim_df = get_sparse_ev_arg_sim(arg_sim)
+        # The counts include the pairs below the floor, and the matching is unchanged
+        assert arg_sim_df.loc[0, ['num_ta2_args', 'num_ann_args',
+                                  'num_ann_arg_slots']].tolist() == [2, 3, 2]
+        # Scores are stored as float32
+        assert abs(arg_sim_df.loc[0, 'topsim_arg'] - 0.7) < 1e-6
+
+    def test_arg_candidate_pruning(self):
+        ev_sim_df = pd.DataFrame({'ta2_ev_id': ['ev1', 'ev1', 'ev1', 'ev2'],
+                                  'ann_ev_id': ['ep1', 'ep2', 'ep3', 'ep1']})
+        for metric in ['class', 'complex', 'jc', 'text', 'topsim', 'transe']:
+            ev_sim_df[metric] = [0.9, 0.5, 0.1, 0.2]
+        ev_sim_df.loc[2, 'class'] = 0.95
+        # ep3 is the top candidate of ev1 for the class metric only
+        candidate_pair_df = get_arg_candidate_pair_df(ev_sim_df, top_k=1)
+        assert candidate_pair_df.values.tolist() == [['ev1', 'ep1'], ['ev1', 'ep3'],
+                                                     ['ev2', 'ep1']]
+        candidate_pair_df = get_arg_candidate_pair_df(ev_sim_df, min_similarity=0.5)
+        assert candidate_pair_df.values.tolist() == [['ev1', 'ep1'], ['ev1', 'ep2'],
+                                                     ['ev1', 'ep3']]
+        # The arguments of the kept pairs have the same similarity as without pruning
+        arg_match_df = pd.DataFrame({'ta2_ev_id': ['ev1', 'ev1', 'ev1', 'ev2', 'ev2'],
+                                     'ann_ev_id': ['ep1', 'ep2', 'ep1', 'ep1', 'ep2'],
+                                     'ta2_arg_id': ['a1', 'a1', 'a2', 'a3', 'a3'],
+                                     'ann_arg_id': ['x1', 'x2', 'x1', 'x1', 'x2'],
+                                     'arg_num': ['1', '1', '1', '1', '1']})
+        for metric in ['class', 'complex', 'jc', 'text', 'topsim', 'transe']:
+            arg_match_df[metric] = [0.8, 0.4, 0.6, 0.3, 0.7]
+        arg_sim_df = get_ev_arg_sim(arg_match_df)
+        pruned_arg_sim_df = get_ev_arg_sim(arg_match_df, candidate_pair_df)
+        assert pruned_arg_sim_df[['ta2_ev_id', 'ann_ev_id']].values.tolist() == \
+            [['ev1', 'ep1'], ['ev1', 'ep2']]
+        pd.testing.assert_frame_equal(pruned_arg_sim_df, arg_sim_df.iloc[0:2])
+
+    def test_arg_candidate_pruning_validation(self, tmp_path, capsys):
+        annotation_collection, ta2_collection, graph_g_collection, qnode_dir, qnode_sim_fp = \
+            make_synthetic_ke_match_inputs(tmp_path, num_instances=1)
+        task1_ceannotation = annotation_collection.annotation_dict['task1|ce2002']
+        ta2_ceinstance = next(iter(ta2_collection.ta2dict['NISTTESTA'].ta2dict.values()))
+        ke_match_df_list = match_ke_ce_elements(task1_ceannotation, ta2_ceinstance, None,
+                                                qnode_dir, qnode_sim_fp, matching_backend="scipy")
+        pruned_ke_match_df_list = match_ke_ce_elements(
+            task1_ceannotation, ta2_ceinstance, None, qnode_dir, qnode_sim_fp,
+            matching_backend="scipy", arg_candidate_top_k=1)
+        # Matching the arguments of the top event only changes some matched event pairs
+        num_changed = count_changed_matches(pruned_ke_match_df_list[1], ke_match_df_list[1])
+        assert num_changed > 0
+        capsys.readouterr()
+
+        validated_ke_match_df_list = match_ke_ce_elements(
+            task1_ceannotation, ta2_ceinstance, None, qnode_dir, qnode_sim_fp,
+            matching_backend="scipy", arg_candidate_top_k=1, validate_arg_candidate_pruning=True)
+        assert "Warning: Argument candidate pruning changed {} matched event pairs of {}".format(
+            num_changed, ta2_ceinstance.schema_instance_id) in capsys.readouterr().out
+        # The validation leaves the pruned results as they are
+        for validated_df, pruned_df in zip(validated_ke_match_df_list, pruned_ke_match_df_list):
+            pd.testing.assert_frame_equal(validated_df, pruned_df)
+        # Without pruning, there is nothing to validate and the results are unchanged
+        unpruned_ke_match_df_list = match_ke_ce_elements(
+            task1_ceannotation, ta2_ceinstance, None, qnode_dir, qnode_sim_fp,
+            matching_backend="scipy", validate_arg_candidate_pruning=True)
+        assert "Argument candidate pruning" not in capsys.readouterr().out
+        for unpruned_df, ke_match_df in zip(unpruned_ke_match_df_list, ke_match_df_list):
+            pd.testing.assert_frame_equal(unpruned_df, ke_match_df)
+
+    def test_matching_backends(self):
+        ev_edge_df = pd.DataFrame({'ta2_ev_id': ['ev1', 'ev1', 'ev2', 'ev2', 'ev3', 'ev3'],
+                                   'ann_ev_id': ['ep1', 'ep2', 'ep1', 'ep2', 'ep1', 'ep2'],
+                                   'topsim': [0.9, 0.8, 0.7, 0.1, 0.6, None]})
+        for matching_backend in MATCHING_BACKENDS:
+            ev_match_df = get_graph_metric_match(ev_edge_df, sim_metric='topsim',
+                                                 matching_backend=matching_backend)
+            assert sorted(ev_match_df[['ta2_ev_id', 'ann_ev_id']].values.tolist()) == \
+                [['ev1', 'ep2'], ['ev2', 'ep1']]
+        # All metrics are matched in one pass, unmatched pairs have no similarity
+        for metric in ['class', 'complex', 'jc', 'text', 'transe']:
+            ev_edge_df[metric] = [0.9, 0.1, 0.2, 0.3, 0.4, 0.5]
+        for column in ['schema_instance_id', 'ta2_team_name', 'ta1_team_name', 'task', 'ce_id',
+                       'ev_confidence']:
+            ev_edge_df[column] = 'x'
+        for matching_backend in MATCHING_BACKENDS:
+            ev_match_df = match_graph_ke_elements(ev_edge_df, matching_backend)
+            assert ev_match_df.shape[0] == 6
+            assert ev_match_df['topsim'].fillna(-1).tolist() == [-1, 0.8, 0.7, -1, -1, -1]
+            assert ev_match_df['class'].fillna(-1).tolist() == [0.9, -1, -1, -1, -1, 0.5]
+
+
+class TestKEScore(object):
+    def test_score_ke_element_sets(self):
+        ta2_ceinstance = SimpleNamespace(schema_instance_id='a-b-task1-ce2002.json_00001',
+                                         ta1_team_name='A', ta2_team_name='B', ce_name='ce2002')
+        ev_match_df = pd.DataFrame({'ta2_ev_id': ['ev{}'.format(i % 11) for i in range(30)],
+                                    'ann_ev_id': ['ep{}'.format(i % 7) for i in range(30)],
+                                    'schema_instance_id': 'a-b-task1-ce2002.json_00001',
+                                    'ta1_team_name': 'A', 'ta2_team_name': 'B',
+                                    'task': 'task_1', 'ce_id': 'ce2002'})
+        for metric_index, metric in enumerate(['class', 'complex', 'jc', 'text', 'topsim',
+                                               'transe']):
+            ev_match_df[metric] = [((i * 7 + metric_index) % 13) / 13 for i in range(30)]
+        ev_match_df.loc[[3, 4, 14], 'class'] = None
+        ev_match_df_list = [ev_match_df, ev_match_df.iloc[0:5], ev_match_df.iloc[0:0]]
+        # The scores are the same as those of the pivot tables, to the last digit
+        for ke_score_df, ev_df in zip(score_ke_element_sets(ta2_ceinstance, 'task_1',
+                                                            ev_match_df_list),
+                                      ev_match_df_list):
+            pd.testing.assert_frame_equal(ke_score_df,
+                                          score_ke_elements(ta2_ceinstance, 'task_1', ev_df),
+                                          check_exact=True, check_dtype=False)